@@ -0,0 +1,67 @@
+"""
+Benchmark the calendar diff engine.
+
+Compares `vobject.ics_diff.diff` with the native engine in `fifty_cal.diff` across
+a range of calendar sizes. Run from the root of the repo with:
+
+    python -m benchmarks.bench_diff
+"""
+
+import sys
+from argparse import ArgumentParser
+from time import perf_counter
+from typing import Callable, Sequence
+
+from vobject import ics_diff, readOne
+
+from benchmarks.synthetic import generate_calendar
+from fifty_cal.diff import CalendarDiff, diff_calendars
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000]
+
+
+def time_diff(diff_function: Callable, calendar_diff: CalendarDiff) -> float:
+    """
+    Time a single run of `diff_function` on the cleaned calendars.
+    """
+    start = perf_counter()
+    diff_function(calendar_diff.cal1_cleaned, calendar_diff.cal2_cleaned)
+    return perf_counter() - start
+
+
+def main(command_args: Sequence[str]):
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Event counts."
+    )
+    parser.add_argument(
+        "--modified-ratio",
+        type=float,
+        default=0.1,
+        help="Proportion of events that differ between the two calendars.",
+    )
+    parser.add_argument(
+        "--skip-vobject",
+        action="store_true",
+        help="Only time the native engine.",
+    )
+    args = parser.parse_args(command_args)
+
+    print(f"{'events':>8} {'vobject (s)':>12} {'native (s)':>12}")
+    for size in args.sizes:
+        calendar_diff = CalendarDiff(
+            readOne(generate_calendar(size)),
+            readOne(generate_calendar(size, modified_ratio=args.modified_ratio)),
+        )
+        calendar_diff.clean_calendars()
+
+        vobject_time = "-"
+        if not args.skip_vobject:
+            vobject_time = f"{time_diff(ics_diff.diff, calendar_diff):.3f}"
+        native_time = time_diff(diff_calendars, calendar_diff)
+
+        print(f"{size:>8} {vobject_time:>12} {native_time:>12.3f}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
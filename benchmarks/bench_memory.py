@@ -0,0 +1,87 @@
+"""
+Benchmark the peak memory used when cleaning, diffing and merging calendars.
+
+Compares cleaning calendars by copying them with `Component.duplicate`, as
+fifty-cal used to, with the views created by `CalendarDiff.clean_calendars`. Each
+measurement runs in a fresh process as peak RSS can only ever go up. Run from the
+root of the repo with:
+
+    python -m benchmarks.bench_memory
+"""
+
+import multiprocessing
+import resource
+import sys
+from argparse import ArgumentParser
+from typing import Sequence, Tuple
+
+from vobject import readOne
+from vobject.base import Component
+
+from benchmarks.synthetic import generate_calendar
+from fifty_cal.diff import IGNORED_PROPERTIES, CalendarDiff
+from fifty_cal.merge import merge
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000]
+
+
+class CopyingCalendarDiff(CalendarDiff):
+    """
+    `CalendarDiff` that cleans calendars by copying them.
+    """
+
+    def clean_calendars(self):
+        cal1_cleaned = Component.duplicate(self.cal1)
+        cal2_cleaned = Component.duplicate(self.cal2)
+        for calendar in [cal1_cleaned, cal2_cleaned]:
+            for event in calendar.contents["vevent"]:
+                for name in IGNORED_PROPERTIES:
+                    event.contents.pop(name, None)
+
+        self.cal1_cleaned = cal1_cleaned
+        self.cal2_cleaned = cal2_cleaned
+
+
+def get_peak_rss() -> int:
+    """
+    Get the peak resident set size of the current process in KiB.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(size: int, copying: bool) -> Tuple[int, int]:
+    """
+    Get the peak RSS after parsing the calendars and after merging them.
+    """
+    cal1 = readOne(generate_calendar(size))
+    cal2 = readOne(generate_calendar(size, modified_ratio=0.1))
+    parsed_rss = get_peak_rss()
+
+    diff_class = CopyingCalendarDiff if copying else CalendarDiff
+    merge(diff_class(cal1, cal2))
+
+    return parsed_rss, get_peak_rss()
+
+
+def main(command_args: Sequence[str]):
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Event counts."
+    )
+    args = parser.parse_args(command_args)
+
+    context = multiprocessing.get_context("spawn")
+    print(
+        f"{'events':>8} {'parsed (KiB)':>14} {'copying (KiB)':>14} {'views (KiB)':>14}"
+    )
+    for size in args.sizes:
+        results = []
+        for copying in (True, False):
+            with context.Pool(1) as pool:
+                results.append(pool.apply(measure, (size, copying)))
+        (parsed_rss, copying_rss), (_, views_rss) = results
+        print(f"{size:>8} {parsed_rss:>14} {copying_rss:>14} {views_rss:>14}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,75 @@
+"""
+Benchmark merging calendars.
+
+Merges an out of date calendar with one where a proportion of events have been
+modified, checks that the merged calendar contains exactly one, up to date, copy of
+each event and reports the time taken per event. Run from the root of the repo with:
+
+    python -m benchmarks.bench_merge
+"""
+
+import sys
+from argparse import ArgumentParser
+from time import perf_counter
+from typing import List, Sequence
+
+from vobject import readOne
+from vobject.base import Component
+
+from benchmarks.synthetic import generate_calendar
+from fifty_cal.diff import CalendarDiff
+from fifty_cal.merge import merge
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000]
+
+
+def check_merged(merged: Component, latest_events: List[Component]):
+    """
+    Check the merged calendar contains exactly the latest version of each event.
+    """
+    merged_events = merged.contents["vevent"]
+    assert len(merged_events) == len(latest_events), "Merged calendar has duplicates."
+    for merged_event, latest_event in zip(merged_events, latest_events):
+        assert merged_event is latest_event, "Merged calendar has stale events."
+
+
+def main(command_args: Sequence[str]):
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Event counts."
+    )
+    parser.add_argument(
+        "--modified-ratio",
+        type=float,
+        default=0.1,
+        help="Proportion of events that conflict between the two calendars.",
+    )
+    args = parser.parse_args(command_args)
+
+    print(f"{'events':>8} {'merge (s)':>10} {'per event (us)':>15}")
+    for size in args.sizes:
+        original = readOne(generate_calendar(size))
+        modified = readOne(generate_calendar(size, modified_ratio=args.modified_ratio))
+
+        start = perf_counter()
+        merged = merge(CalendarDiff(modified, original))
+        elapsed = perf_counter() - start
+
+        # The merged calendar is based on the original, with modified events
+        # replaced in place. The generator bumps the sequence of modified events.
+        modified_events = {
+            event.uid.value: event
+            for event in modified.vevent_list
+            if event.sequence.value != "0"
+        }
+        expected = [
+            modified_events.get(event.uid.value, event)
+            for event in original.vevent_list
+        ]
+        check_merged(merged, expected)
+
+        print(f"{size:>8} {elapsed:>10.3f} {elapsed / size * 1e6:>15.1f}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
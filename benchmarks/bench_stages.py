@@ -0,0 +1,154 @@
+"""
+Benchmark each stage of syncing a calendar.
+
+Times parsing, cleaning, diffing, merging and serializing a local and a remote
+copy of a synthetic calendar, separately, across a range of calendar sizes. The
+results can be written to JSON so that runs can be compared to spot regressions.
+Run from the root of the repo with:
+
+    python -m benchmarks.bench_stages --output stages.json
+"""
+
+import datetime as dt
+import json
+import platform
+import sys
+from argparse import ArgumentParser
+from time import perf_counter
+from typing import Dict, Sequence
+
+from vobject import readOne
+
+from benchmarks.synthetic import generate_calendar_pair
+from fifty_cal.diff import CalendarDiff
+from fifty_cal.merge import merge
+from fifty_cal.pipeline import parse_calendar
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000]
+
+STAGES = ("parse", "clean", "diff", "merge", "serialize")
+
+
+def time_stages(local: bytes, remote: bytes, use_vobject: bool = False) -> Dict:
+    """
+    Time each stage of merging the `remote` calendar into the `local` one.
+
+    Calendars are parsed into records, as they are when syncing, unless
+    `use_vobject` is set, in which case they are parsed with `vobject.readOne`.
+    """
+    timings = {}
+
+    start = perf_counter()
+    if use_vobject:
+        calendars = [readOne(calendar.decode()) for calendar in (local, remote)]
+    else:
+        calendars = [parse_calendar(calendar) for calendar in (local, remote)]
+    timings["parse"] = perf_counter() - start
+
+    calendar_diff = CalendarDiff(*calendars)
+    start = perf_counter()
+    calendar_diff.clean_calendars()
+    timings["clean"] = perf_counter() - start
+
+    start = perf_counter()
+    calendar_diff.get_diff()
+    timings["diff"] = perf_counter() - start
+
+    start = perf_counter()
+    merged = merge(calendar_diff)
+    timings["merge"] = perf_counter() - start
+
+    start = perf_counter()
+    serialized = merged.serialize()
+    timings["serialize"] = perf_counter() - start
+
+    return {
+        "stages": timings,
+        "total": sum(timings.values()),
+        "differences": len(calendar_diff.diff),
+        "serialized_bytes": len(serialized.encode()),
+    }
+
+
+def main(command_args: Sequence[str]):
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Event counts."
+    )
+    parser.add_argument(
+        "--modified-ratio",
+        type=float,
+        default=0.1,
+        help="Proportion of events only modified in the remote calendar.",
+    )
+    parser.add_argument(
+        "--conflict-ratio",
+        type=float,
+        default=0.01,
+        help="Proportion of events modified differently in both calendars.",
+    )
+    parser.add_argument(
+        "--recurrence-ratio",
+        type=float,
+        default=0.1,
+        help="Proportion of events that recur, each with one overridden occurrence.",
+    )
+    parser.add_argument(
+        "--property-size",
+        type=int,
+        default=200,
+        help="Length of the description of each event.",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Generator seed.")
+    parser.add_argument(
+        "--vobject",
+        action="store_true",
+        help="Parse with vobject.readOne rather than into records.",
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    args = parser.parse_args(command_args)
+
+    parameters = {
+        "modified_ratio": args.modified_ratio,
+        "conflict_ratio": args.conflict_ratio,
+        "recurrence_ratio": args.recurrence_ratio,
+        "property_size": args.property_size,
+        "seed": args.seed,
+        "parser": "vobject" if args.vobject else "records",
+    }
+    results = []
+
+    print(f"{'events':>8} " + " ".join(f"{stage + ' (s)':>13}" for stage in STAGES))
+    for size in args.sizes:
+        local, remote = generate_calendar_pair(
+            size,
+            modified_ratio=args.modified_ratio,
+            conflict_ratio=args.conflict_ratio,
+            seed=args.seed,
+            recurrence_ratio=args.recurrence_ratio,
+            property_size=args.property_size,
+        )
+        result = time_stages(local.encode(), remote.encode(), args.vobject)
+        result["events"] = size
+        results.append(result)
+
+        stages = result["stages"]
+        print(f"{size:>8} " + " ".join(f"{stages[stage]:>13.3f}" for stage in STAGES))
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(
+                {
+                    "benchmark": "stages",
+                    "created": dt.datetime.now(dt.timezone.utc).isoformat(),
+                    "python": platform.python_version(),
+                    "parameters": parameters,
+                    "results": results,
+                },
+                output_file,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
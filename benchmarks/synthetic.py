@@ -0,0 +1,173 @@
+"""
+Deterministic generator for synthetic calendars used by the benchmarks.
+"""
+
+import datetime as dt
+import random
+from typing import List, Tuple
+
+CALENDAR_HEADER = [
+    "BEGIN:VCALENDAR",
+    "PRODID:-//fifty-cal//benchmarks//EN",
+    "VERSION:2.0",
+    "CALSCALE:GREGORIAN",
+]
+CALENDAR_FOOTER = ["END:VCALENDAR"]
+
+START_DATE = dt.datetime(2020, 1, 1, 9)
+
+# Lines longer than this many characters are folded, as iCalendar requires.
+FOLD_LENGTH = 75
+
+# The number of weekly occurrences of each recurring event.
+OCCURRENCES = 52
+
+
+def fold(line: str) -> List[str]:
+    """
+    Fold a content line onto continuation lines of at most `FOLD_LENGTH` characters.
+    """
+    lines = [line[:FOLD_LENGTH]]
+    for index in range(FOLD_LENGTH, len(line), FOLD_LENGTH - 1):
+        lines.append(" " + line[index : index + FOLD_LENGTH - 1])
+    return lines
+
+
+def generate_description(index: int, size: int, edit: int) -> List[str]:
+    """
+    Generate a `DESCRIPTION` of `size` characters, folded.
+    """
+    text = f"Event {index} edit {edit} " * (size // 10 + 1)
+    return fold(f"DESCRIPTION:{text[:size]}")
+
+
+def generate_event(
+    index: int,
+    rng: random.Random,
+    modified: bool = False,
+    edit: int = 0,
+    recurring: bool = False,
+    property_size: int = 0,
+) -> List[str]:
+    """
+    Generate the lines of a single VEVENT.
+
+    The event with a given index always has the same UID. Passing `modified` moves
+    the event forward by an hour and bumps its `LAST-MODIFIED` and `SEQUENCE`.
+    Passing a higher `edit` makes a different modification, later again, so that
+    two calendars can both modify the same event in conflicting ways.
+
+    A `recurring` event repeats weekly and has its second occurrence overridden,
+    adding a second VEVENT with the same UID. `property_size` adds a `DESCRIPTION`
+    of that many characters.
+    """
+    start = START_DATE + dt.timedelta(hours=rng.randrange(24 * 365 * 3))
+    edit = max(edit, int(modified))
+    last_modified = START_DATE + dt.timedelta(days=edit)
+    start += dt.timedelta(hours=edit)
+    uid = f"UID:{index:08d}-fifty-cal-benchmark"
+
+    lines = [
+        "BEGIN:VEVENT",
+        uid,
+        f"DTSTAMP:{last_modified:%Y%m%dT%H%M%SZ}",
+        f"LAST-MODIFIED:{last_modified:%Y%m%dT%H%M%SZ}",
+        f"DTSTART:{start:%Y%m%dT%H%M%S}",
+        f"DTEND:{start + dt.timedelta(hours=1):%Y%m%dT%H%M%S}",
+        f"SUMMARY:Event {index}",
+        f"SEQUENCE:{edit}",
+    ]
+    if property_size:
+        lines += generate_description(index, property_size, edit)
+    if not recurring:
+        return lines + ["END:VEVENT"]
+
+    lines.append(f"RRULE:FREQ=WEEKLY;COUNT={OCCURRENCES}")
+    lines.append("END:VEVENT")
+    override_start = start + dt.timedelta(weeks=1)
+    return lines + [
+        "BEGIN:VEVENT",
+        uid,
+        f"DTSTAMP:{last_modified:%Y%m%dT%H%M%SZ}",
+        f"LAST-MODIFIED:{last_modified:%Y%m%dT%H%M%SZ}",
+        f"RECURRENCE-ID:{override_start:%Y%m%dT%H%M%S}",
+        f"DTSTART:{override_start + dt.timedelta(hours=2):%Y%m%dT%H%M%S}",
+        f"DTEND:{override_start + dt.timedelta(hours=3):%Y%m%dT%H%M%S}",
+        f"SUMMARY:Event {index} moved",
+        f"SEQUENCE:{edit}",
+        "END:VEVENT",
+    ]
+
+
+def generate_calendar(
+    event_count: int,
+    modified_ratio: float = 0.0,
+    seed: int = 0,
+    recurrence_ratio: float = 0.0,
+    property_size: int = 0,
+) -> str:
+    """
+    Generate an iCalendar document containing `event_count` events.
+
+    `modified_ratio` is the proportion of events that are modified versions of those
+    generated with the same `seed` and a ratio of 0. `recurrence_ratio` is the
+    proportion of events that recur, each with one overridden occurrence, and
+    `property_size` is the length of the description given to every event.
+    """
+    return generate_calendar_pair(
+        event_count,
+        modified_ratio=modified_ratio,
+        seed=seed,
+        recurrence_ratio=recurrence_ratio,
+        property_size=property_size,
+    )[1]
+
+
+def generate_calendar_pair(
+    event_count: int,
+    modified_ratio: float = 0.0,
+    conflict_ratio: float = 0.0,
+    seed: int = 0,
+    recurrence_ratio: float = 0.0,
+    property_size: int = 0,
+) -> Tuple[str, str]:
+    """
+    Generate a local and a remote copy of the same calendar.
+
+    A proportion `modified_ratio` of the events are only modified in the remote
+    copy. A further `conflict_ratio` are modified differently in each copy, with the
+    remote modification being the later one. The other arguments are as for
+    `generate_calendar`.
+    """
+    rng = random.Random(seed)
+    modified_rng = random.Random(seed + 1)
+    recurrence_rng = random.Random(seed + 2)
+    local_lines = list(CALENDAR_HEADER)
+    remote_lines = list(CALENDAR_HEADER)
+    for index in range(event_count):
+        change = modified_rng.random()
+        local_edit = 1 if change < conflict_ratio else 0
+        remote_edit = 2 if local_edit else int(change < conflict_ratio + modified_ratio)
+        recurring = (
+            bool(recurrence_ratio) and recurrence_rng.random() < recurrence_ratio
+        )
+        state = rng.getstate()
+        local_lines += generate_event(
+            index,
+            rng,
+            edit=local_edit,
+            recurring=recurring,
+            property_size=property_size,
+        )
+        rng.setstate(state)
+        remote_lines += generate_event(
+            index,
+            rng,
+            edit=remote_edit,
+            recurring=recurring,
+            property_size=property_size,
+        )
+    local_lines += CALENDAR_FOOTER
+    remote_lines += CALENDAR_FOOTER
+
+    return "\r\n".join(local_lines) + "\r\n", "\r\n".join(remote_lines) + "\r\n"
@@ -0,0 +1,174 @@
+import json
+import logging
+import os
+import time
+from threading import Lock
+from typing import Dict, Mapping, Optional
+
+log = logging.getLogger(__name__)
+
+
+def write_json(data: Mapping, path: str, private: bool = False, compact: bool = False):
+    """
+    Write `data` to `path` as JSON, replacing the file atomically.
+
+    `private` files can only be read and written by the current user. `compact`
+    files are written without any whitespace, for large files that are only read
+    by fifty-cal.
+    """
+    temp_path = f"{path}.tmp"
+    mode = 0o600 if private else 0o666
+    file_descriptor = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    if private:
+        # The mode is only applied when the file is created.
+        os.chmod(temp_path, mode)
+    with os.fdopen(file_descriptor, "w") as temp_file:
+        if compact:
+            json.dump(data, temp_file, separators=(",", ":"))
+        else:
+            json.dump(data, temp_file, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+
+def read_json(path: str) -> dict:
+    """
+    Read a JSON file written by `write_json`.
+
+    A missing or unreadable file is treated as empty so that a damaged cache never
+    stops a sync from running.
+    """
+    try:
+        with open(path) as json_file:
+            return json.load(json_file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError):
+        log.warning(f"Ignoring unreadable cache file {path}.")
+        return {}
+
+
+def get_sync_base_path(cache_path: str, name: str) -> str:
+    """
+    Get the path the sync base of the named calendar is stored at.
+    """
+    return os.path.join(cache_path, "sync_base", f"{name}.json")
+
+
+class FeedCache:
+    """
+    Record the validators of each downloaded calendar feed.
+
+    Stores the `ETag` and `Last-Modified` headers along with a hash of the body of
+    each feed, keyed on the calendar hash, so that unchanged feeds can be detected
+    on the next run.
+    """
+
+    FILE_NAME = "feeds.json"
+
+    def __init__(self, cache_path: str):
+        self.path = os.path.join(cache_path, self.FILE_NAME)
+        self.entries: Dict[str, Dict[str, Optional[str]]] = read_json(self.path)
+        self.lock = Lock()
+
+    def get(self, calendar_hash: str) -> Optional[Mapping[str, Optional[str]]]:
+        """
+        Get the validators stored for a calendar, if there are any.
+        """
+        return self.entries.get(calendar_hash)
+
+    def update(
+        self,
+        calendar_hash: str,
+        etag: Optional[str],
+        last_modified: Optional[str],
+        body_hash: str,
+    ):
+        """
+        Store the validators for a calendar.
+        """
+        with self.lock:
+            self.entries[calendar_hash] = {
+                "etag": etag,
+                "last_modified": last_modified,
+                "body_hash": body_hash,
+            }
+
+    def save(self):
+        """
+        Write the cache to disk.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.lock:
+            write_json(self.entries, self.path)
+
+
+class CookieCache:
+    """
+    Keep the session cookies from a login so that later runs can reuse them.
+
+    The cookies are stored along with the time they expire in a file that only the
+    current user can read.
+    """
+
+    FILE_NAME = "cookies.json"
+
+    def __init__(self, cache_path: str):
+        self.path = os.path.join(cache_path, self.FILE_NAME)
+
+    def load(self) -> Optional[Dict[str, str]]:
+        """
+        Get the stored cookies, if there are any that haven't expired.
+        """
+        cached = read_json(self.path)
+        if not cached or cached.get("expires", 0) <= time.time():
+            return None
+        return cached.get("cookies")
+
+    def save(self, cookies: Mapping[str, str], expires: float):
+        """
+        Store cookies that expire at the `expires` timestamp.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        write_json(
+            {"cookies": dict(cookies), "expires": expires}, self.path, private=True
+        )
+
+    def clear(self):
+        """
+        Remove the stored cookies.
+        """
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class CalendarMapCache:
+    """
+    Keep the mapping of calendar name to calendar hash found on the calendar page.
+
+    The mapping is reused until it is `max_age` seconds old, so the calendar page
+    only has to be read occasionally.
+    """
+
+    FILE_NAME = "calendars.json"
+
+    def __init__(self, cache_path: str, max_age: float = 86400):
+        self.path = os.path.join(cache_path, self.FILE_NAME)
+        self.max_age = max_age
+
+    def load(self) -> Optional[Dict[str, str]]:
+        """
+        Get the stored mapping, if there is one that isn't too old.
+        """
+        cached = read_json(self.path)
+        if not cached or cached.get("discovered", 0) + self.max_age <= time.time():
+            return None
+        return cached.get("calendars")
+
+    def save(self, cal_map: Mapping[str, str]):
+        """
+        Store the mapping.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        write_json({"calendars": dict(cal_map), "discovered": time.time()}, self.path)
@@ -1,5 +1,331 @@
-from vobject.base import Component
-from vobject.ics_diff import diff
+import datetime as dt
+import hashlib
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from vobject.base import Component, newFromBehavior, toVName
+
+# The component types that are compared when diffing two calendars.
+DIFFED_COMPONENTS = ("vevent", "vtodo")
+
+# Properties that change without the event itself changing. These are stripped by
+# `CalendarDiff.clean_calendars` and ignored when fingerprinting events.
+IGNORED_PROPERTIES = ("sequence",)
+
+EventKey = Tuple[str, str, str]
+EventPair = Tuple[Optional[Component], Optional[Component]]
+
+
+class ComponentView:
+    """
+    A read only view of a component that hides some of its properties.
+
+    Allows a component to be diffed as if the `ignored` properties had been deleted,
+    without having to copy it. Child components named in `children` are also viewed
+    so that a calendar can be viewed with the properties of its events ignored.
+
+    The visible contents of a view of a single event are only gathered when they are
+    first used, as most events are matched on `getChildValue` and their fingerprint
+    alone.
+    """
+
+    __slots__ = ("component", "name", "ignored", "_contents")
+
+    component: Component
+    name: str
+    ignored: Iterable[str]
+
+    def __init__(
+        self,
+        component: Component,
+        ignored: Iterable[str] = IGNORED_PROPERTIES,
+        children: Iterable[str] = (),
+    ):
+        self.component = component
+        self.name = component.name
+        self.ignored = ignored
+        self._contents = None
+        if children:
+            self._contents = self.view_contents(children)
+
+    def view_contents(self, children: Iterable[str] = ()) -> Dict[str, list]:
+        """
+        Get the contents of the component without the ignored properties.
+        """
+        contents = {}
+        for key, values in self.component.contents.items():
+            if key in self.ignored:
+                continue
+            if key in children:
+                values = [ComponentView(value, self.ignored) for value in values]
+            contents[key] = values
+        return contents
+
+    @property
+    def contents(self) -> Dict[str, list]:
+        """
+        The visible contents of the component.
+        """
+        if self._contents is None:
+            self._contents = self.view_contents()
+        return self._contents
+
+    def __getattr__(self, name: str):
+        """
+        Make the visible contents accessible in the same way as a `Component`.
+        """
+        if name.startswith("_"):
+            raise AttributeError(name)
+        try:
+            if name.endswith("_list"):
+                return self.contents[toVName(name, 5)]
+            return self.contents[toVName(name)][0]
+        except KeyError:
+            raise AttributeError(name)
+
+    def getChildValue(self, childName: str, default: Any = None) -> Any:
+        """
+        Return the value of the first child with the given name or `default`.
+        """
+        if toVName(childName) in self.ignored:
+            return default
+        return self.component.getChildValue(childName, default)
+
+
+def unwrap(component: Component) -> Component:
+    """
+    Get the underlying component if `component` is a `ComponentView`.
+    """
+    if isinstance(component, ComponentView):
+        return component.component
+    return component
+
+
+def get_event_key(component: Component) -> EventKey:
+    """
+    Get the key used to match a component with its counterpart in another calendar.
+
+    Events are matched on their `UID` and, for overridden instances of a recurring
+    event, their `RECURRENCE-ID`. The `SEQUENCE` is included to stay consistent with
+    `vobject.ics_diff`, which treats events with differing sequences as different
+    events. `CalendarDiff.clean_calendars` strips the sequence so that in practice
+    events are matched on `UID` and `RECURRENCE-ID` alone.
+    """
+    uid = component.getChildValue("uid", "")
+    sequence = "{0:05d}".format(int(component.getChildValue("sequence", 0)))
+    recurrence_id = component.getChildValue("recurrence_id", None)
+    recurrence_id = "" if recurrence_id is None else recurrence_id.isoformat()
+
+    return uid, sequence, recurrence_id
+
+
+def _normalise_value(value: Any) -> str:
+    """
+    Convert a property value into a stable string for fingerprinting.
+    """
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (dt.date, dt.time)):
+        normalised = value.isoformat()
+    elif isinstance(value, (list, tuple)):
+        normalised = ",".join(_normalise_value(item) for item in value)
+    else:
+        normalised = str(value)
+    return f"{type(value).__name__}:{normalised}"
+
+
+def _fingerprint_lines(component: Component, ignored: Iterable[str]) -> List[str]:
+    """
+    Get the normalised lines of a component that make up its fingerprint.
+    """
+    lines = []
+    for key in sorted(component.contents):
+        if key in ignored:
+            continue
+        for child in component.contents[key]:
+            if isinstance(child, Component):
+                lines.append(f"BEGIN:{key}")
+                lines += _fingerprint_lines(child, ignored)
+                lines.append(f"END:{key}")
+            elif child.params:
+                params = sorted(child.params.items())
+                lines.append(f"{key};{params}:{_normalise_value(child.value)}")
+            else:
+                lines.append(f"{key}:{_normalise_value(child.value)}")
+    return lines
+
+
+def get_fingerprint(
+    component: Component, ignored: Iterable[str] = IGNORED_PROPERTIES
+) -> str:
+    """
+    Get a hash of the contents of a component.
+
+    The hash ignores the order that properties appear in as well as any `ignored`
+    properties so that two components with equal fingerprints are considered to be
+    the same event. Components with differing fingerprints may still be equal, for
+    example when the same time is expressed in different timezones, so they should
+    be compared properly.
+    """
+    own_fingerprint = getattr(unwrap(component), "get_fingerprint", None)
+    if own_fingerprint is not None:
+        # Components that aren't vobject components, such as `EventRecord`, can
+        # fingerprint themselves more cheaply.
+        return own_fingerprint(ignored)
+    content = "\n".join(_fingerprint_lines(component, ignored))
+    return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+
+
+def has_own_fingerprint(component: Component) -> bool:
+    """
+    Check whether a component can fingerprint itself, as an `EventRecord` can from
+    its raw lines, rather than having to be walked by `get_fingerprint`.
+    """
+    return hasattr(unwrap(component), "get_fingerprint")
+
+
+def index_components(
+    components: Iterable[Component],
+) -> Dict[EventKey, List[Component]]:
+    """
+    Build a hash index of components keyed on `get_event_key`.
+
+    Each key maps to a list as a calendar may contain more than one copy of an event.
+    Copies are matched against each other in the order they appear.
+    """
+    index = defaultdict(list)
+    for component in components:
+        index[get_event_key(component)].append(component)
+    return index
+
+
+def diff_components(
+    left: Iterable[Component],
+    right: Iterable[Component],
+    fingerprint: Callable[[Component], str] = get_fingerprint,
+) -> List[EventPair]:
+    """
+    Diff two lists of components, matching them using a hash index.
+
+    The right hand side is indexed once and each component on the left is then
+    looked up in constant time, making the diff linear in the number of components
+    rather than relying on comparing components against each other. Matched
+    components that can fingerprint themselves, see `has_own_fingerprint`, are
+    skipped without comparing them property by property if their fingerprints are
+    equal. Other components are compared straight away, as walking them to
+    fingerprint them costs more than the comparison. `fingerprint` can be swapped
+    for a function that looks up fingerprints that have already been calculated.
+
+    Returns a list of pairs in the same format as `vobject.ics_diff.diff`:
+        * `(left, None)` - the component only exists in the left hand list.
+        * `(None, right)` - the component only exists in the right hand list.
+          Components that only exist on one side are always returned as the
+          original component rather than a `ComponentView`.
+        * `(left, right)` - the component exists in both but differs. Each item
+          contains the `UID` plus the children that differ.
+
+    The pairs are ordered by key so that the output matches that of `vobject`.
+    """
+    right_index = index_components(right)
+    keyed_output = []
+
+    for left_component in left:
+        key = get_event_key(left_component)
+        matches = right_index.get(key)
+        if not matches:
+            keyed_output.append((key, (unwrap(left_component), None)))
+            continue
+        right_component = matches.pop(0)
+        if not matches:
+            del right_index[key]
+        if (
+            has_own_fingerprint(left_component)
+            and has_own_fingerprint(right_component)
+            and fingerprint(left_component) == fingerprint(right_component)
+        ):
+            continue
+        pair = diff_pair(left_component, right_component)
+        if pair is not None:
+            keyed_output.append((key, pair))
+
+    for key, right_components in right_index.items():
+        for right_component in right_components:
+            keyed_output.append((key, (None, unwrap(right_component))))
+
+    keyed_output.sort(key=lambda keyed_pair: keyed_pair[0])
+
+    return [pair for _, pair in keyed_output]
+
+
+def diff_pair(left: Component, right: Component) -> Optional[EventPair]:
+    """
+    Compare two components that share a key.
+
+    Returns `None` if they match, otherwise a pair of new components containing the
+    `UID`, any `RECURRENCE-ID` and the children that differ.
+    """
+    different_lines = []
+    different_components = {}
+
+    for key, left_children in left.contents.items():
+        right_children = right.contents.get(key, [])
+        if isinstance(left_children[0], Component):
+            component_diff = diff_components(left_children, right_children)
+            if component_diff:
+                different_components[key] = component_diff
+        elif left_children != right_children:
+            different_lines.append((left_children, right_children))
+
+    for key, right_children in right.contents.items():
+        if key in left.contents:
+            continue
+        if isinstance(right_children[0], Component):
+            different_components[key] = [(None, child) for child in right_children]
+        else:
+            different_lines.append(([], right_children))
+
+    if not different_lines and not different_components:
+        return None
+
+    left_diff = newFromBehavior(left.name)
+    right_diff = newFromBehavior(left.name)
+    uid = left.getChildValue("uid")
+    if uid is not None:
+        left_diff.add("uid").value = uid
+        right_diff.add("uid").value = uid
+    # Overridden instances of a recurring event share its `UID`, so the diff keeps
+    # the `RECURRENCE-ID` to tell which instance it is for.
+    recurrence_id = left.contents.get("recurrence-id")
+    if recurrence_id:
+        left_diff.contents["recurrence-id"] = recurrence_id
+        right_diff.contents["recurrence-id"] = right.contents["recurrence-id"]
+
+    for name, child_pairs in different_components.items():
+        left_diff.contents[name] = [child for child, _ in child_pairs if child]
+        right_diff.contents[name] = [child for _, child in child_pairs if child]
+
+    for left_lines, right_lines in different_lines:
+        name = (left_lines or right_lines)[0].name
+        left_diff.contents[name] = left_lines
+        right_diff.contents[name] = right_lines
+
+    return left_diff, right_diff
+
+
+def diff_calendars(
+    left: Component,
+    right: Component,
+    fingerprint: Callable[[Component], str] = get_fingerprint,
+) -> List[EventPair]:
+    """
+    Diff the events and todos in two calendars.
+    """
+    output = []
+    for name in DIFFED_COMPONENTS:
+        output += diff_components(
+            left.contents.get(name, []), right.contents.get(name, []), fingerprint
+        )
+    return output
 
 
 class CalendarDiff:
@@ -12,6 +338,7 @@ class CalendarDiff:
     cal1_cleaned: Component
     cal2_cleaned: Component
     diff: list
+    diffed: bool
 
     def __init__(self, cal1: Component, cal2: Component):
         """
@@ -20,29 +347,27 @@ class CalendarDiff:
         self.cal1 = cal1
         self.cal2 = cal2
         self.diff = []
+        self.diffed = False
 
     def clean_calendars(self):
         """
-        Remove attributes that the diff function has issues with.
+        Hide attributes that the diff function has issues with.
 
-        At the moment this only removes the `sequence` attribute. It appears that
-        this attribute is incremented any time the event is amended. However the
-        diffing function supplied with `vobject` does not recognise calendar events
-        that are identical in every way apart from this `sequence` value.
-        """
-        cal1_cleaned = Component.duplicate(self.cal1)
-        cal2_cleaned = Component.duplicate(self.cal2)
-        for calendar in [cal1_cleaned, cal2_cleaned]:
-            for event in calendar.contents["vevent"]:
-                if hasattr(event, "sequence"):
-                    delattr(event, "sequence")
+        At the moment this only hides the `sequence` attribute (see
+        `IGNORED_PROPERTIES`). It appears that this attribute is incremented any time
+        the event is amended. However the diffing function does not recognise
+        calendar events that are identical in every way apart from this `sequence`
+        value.
 
-        self.cal1_cleaned = cal1_cleaned
-        self.cal2_cleaned = cal2_cleaned
+        The cleaned calendars are views of the originals, so no events are copied.
+        """
+        self.cal1_cleaned = ComponentView(self.cal1, children=DIFFED_COMPONENTS)
+        self.cal2_cleaned = ComponentView(self.cal2, children=DIFFED_COMPONENTS)
 
     def get_diff(self):
         """
         Get the diff between cal1 and cal2
         """
 
-        self.diff = diff(self.cal1_cleaned, self.cal2_cleaned)
+        self.diff = diff_calendars(self.cal1_cleaned, self.cal2_cleaned)
+        self.diffed = True
@@ -1,8 +1,13 @@
+import hashlib
+import json
 import logging
-from typing import Mapping
+import os
+import re
+from typing import Dict, Mapping, NamedTuple, Optional
 
-from requests import Session
-from vobject.base import Component, readOne
+from requests import RequestException, Response, Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from fifty_cal.exceptions import (
     HttpErrorException,
@@ -18,44 +23,226 @@ ERROR_RESPONSE_CODES = {
     403: UnauthorizedException,
     404: NotFoundException,
     500: ServerErrorException,
+    # The rest of the `RETRY_STATUS_CODES`, raised once the retries have run out.
+    502: ServerErrorException,
+    503: ServerErrorException,
+    504: ServerErrorException,
 }
 
+# Roundcube passes the calendars to its JavaScript as JSON in `rcmail.set_env`.
+SET_ENV_PATTERN = re.compile(r"rcmail\.set_env\((\{.*?\})\);", re.DOTALL)
+FEED_HASH_PATTERN = re.compile(r"_cal=([^&]+?)\.ics")
+
+# The most connections kept open to the server for reuse. Any more made at once, by
+# downloading more calendars at the same time, are closed after a single request.
+DEFAULT_POOL_SIZE = 10
+
+# Requests that fail with one of `RETRY_STATUS_CODES` or can't connect are retried
+# this many times. The first retry is immediate, after that the wait starts at twice
+# the backoff factor in seconds and doubles each time.
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+# Only requests that don't change anything are retried, so that events are never
+# imported twice because the server failed after importing them the first time.
+RETRY_METHODS = frozenset({"GET", "HEAD"})
 
 log = logging.getLogger(__name__)
 
 
-def get_requests_session(cookies: Mapping[str, str]) -> Session:
+class Feed(NamedTuple):
+    """
+    The raw contents of a calendar feed along with its validators.
+    """
+
+    content: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+    body_hash: str
+
+
+def get_requests_session(
+    cookies: Mapping[str, str],
+    pool_size: int = DEFAULT_POOL_SIZE,
+    retries: int = DEFAULT_RETRIES,
+    backoff_factor: float = DEFAULT_BACKOFF_FACTOR,
+) -> Session:
     """
     Create and return a `requests.Session` object.
 
     Expects session and auth cookies to be passed in.
+
+    Up to `pool_size` connections are kept alive and reused, so that calendars
+    downloaded one after another, or by up to that many threads at once, don't each
+    need a new connection and TLS handshake. Requests that fail with a server error
+    are retried, see `DEFAULT_RETRIES`. Once the retries run out the last response
+    is returned, so it is handled like any other failed response.
+
+    Feeds are requested with gzip or deflate encoding, which `requests` asks for by
+    default and decodes as the response is read.
     """
     session = Session()
 
     session.cookies.update(cookies)
 
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=RETRY_METHODS,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
     return session
 
 
-def get_calendar(calendar_hash: str, session: Session, calendar_url: str) -> Component:
+def check_session(session: Session, calendar_url: str) -> bool:
+    """
+    Check whether the cookies in `session` belong to a logged in user.
+
+    Roundcube shows the login form in place of the calendar when the session is no
+    longer valid.
+    """
+    try:
+        response = session.get(calendar_url, allow_redirects=False)
+    except RequestException:
+        log.exception("Unable to check session.")
+        return False
+
+    return response.status_code == 200 and "rcmloginuser" not in response.text
+
+
+def is_safe_name(name: str) -> bool:
+    """
+    Check whether a calendar name can be used as a file name without the file ending
+    up outside the directory it is saved in.
+    """
+    return bool(name) and os.path.basename(name) == name and ".." not in name
+
+
+def parse_calendar_map(page: str) -> Dict[str, str]:
     """
-    Get the most recent version of the calendar.
+    Get a mapping of calendar name to calendar hash from the calendar page.
 
-    Downloads the calendar specified in the `calendar_hash` - a unique identifier
-    that namesco uses to refer to a specific calendar. Parses and returns as a
-    vobject `Component` object.
+    The hash is taken from the feed URL of each calendar, falling back to the ID of
+    the calendar if it doesn't have one. Calendars are saved under their names, so
+    any whose name isn't a safe file name, see `is_safe_name`, are skipped.
+    """
+    cal_map = {}
+    for match in SET_ENV_PATTERN.finditer(page):
+        try:
+            env = json.loads(match.group(1))
+        except ValueError:
+            continue
+        for calendar_id, calendar in env.get("calendars", {}).items():
+            feed_hash = FEED_HASH_PATTERN.search(calendar.get("feedurl") or "")
+            name = calendar.get("name") or calendar_id
+            if not is_safe_name(name):
+                log.warning(f"Skipping calendar with unsafe name {name!r}.")
+                continue
+            cal_map[name] = feed_hash.group(1) if feed_hash else calendar_id
+
+    return cal_map
+
+
+def get_calendar_map(session: Session, calendar_url: str) -> Dict[str, str]:
+    """
+    Download the calendar page and get a mapping of calendar name to calendar hash.
+
+    A single request replaces starting the browser and reading the calendar list
+    from the page one element at a time.
+    """
+    response = session.get(calendar_url)
+    if response.status_code != 200:
+        log.error(f"Request Failed {response.status_code}: {response.reason}")
+        raise ERROR_RESPONSE_CODES.get(response.status_code, HttpErrorException)
+
+    return parse_calendar_map(response.text)
+
+
+def request_calendar(
+    calendar_hash: str,
+    session: Session,
+    calendar_url: str,
+    headers: Optional[Mapping[str, str]] = None,
+) -> Response:
+    """
+    Request the calendar feed, raising an exception if the request is unsuccessful.
+
+    A 304 response is only possible when conditional `headers` are sent, so is
+    treated as a success.
     """
 
     url = f"{calendar_url}{calendar_hash}.ics&_action=feed"
 
-    calendar_request = session.get(url)
+    calendar_request = session.get(url, headers=headers)
 
     response_code = calendar_request.status_code
 
-    if response_code != 200:
+    if response_code not in (200, 304):
         log.exception(
             f"Request Failed {calendar_request.status_code}: {calendar_request.reason}"
         )
         raise ERROR_RESPONSE_CODES.get(response_code, HttpErrorException)
-    else:
-        return readOne(calendar_request.text)
+
+    return calendar_request
+
+
+def get_bytes_received(response: Response) -> int:
+    """
+    Get the number of bytes of a response body read from the connection so far.
+
+    This is the size of the body as it was sent, before any content encoding is
+    decoded.
+    """
+    return response.raw.tell()
+
+
+def fetch_calendar(
+    calendar_hash: str,
+    session: Session,
+    calendar_url: str,
+    validators: Optional[Mapping[str, Optional[str]]] = None,
+    metrics: Optional[Dict[str, float]] = None,
+) -> Optional[Feed]:
+    """
+    Get the most recent version of the calendar as raw, unparsed, bytes.
+
+    `validators` are those stored in the `FeedCache` from the last time the calendar
+    was downloaded. They are sent as conditional request headers and `None` is
+    returned if the server reports the feed as not modified or the body is identical
+    to last time.
+
+    If a `metrics` dictionary is passed, the number of bytes received is stored in it
+    as `"bytes"`.
+    """
+    validators = validators or {}
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+
+    calendar_request = request_calendar(
+        calendar_hash, session, calendar_url, headers=headers
+    )
+    if calendar_request.status_code == 304:
+        return None
+
+    content = calendar_request.content
+    if metrics is not None:
+        metrics["bytes"] = get_bytes_received(calendar_request)
+    body_hash = hashlib.blake2b(content, digest_size=16).hexdigest()
+    if body_hash == validators.get("body_hash"):
+        return None
+
+    return Feed(
+        content=content,
+        etag=calendar_request.headers.get("ETag"),
+        last_modified=calendar_request.headers.get("Last-Modified"),
+        body_hash=body_hash,
+    )
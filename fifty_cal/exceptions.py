@@ -62,3 +62,35 @@ class ConfigurationException(CalendarException):
     """
     The config file is invalid.
     """
+
+
+class DownloadFailedException(CalendarException):
+    """
+    One or more calendars could not be downloaded.
+
+    Thrown once every calendar has been attempted so that one failure does not stop
+    the rest from being synced.
+    """
+
+
+class UploadFailedException(CalendarException):
+    """
+    One or more calendars could not be uploaded.
+
+    Thrown once every calendar has been attempted, in the same way as
+    `DownloadFailedException`.
+    """
+
+
+class LoginFailedException(SessionException):
+    """
+    Unable to log in.
+
+    Thrown when the login page doesn't respond as expected.
+    """
+
+
+class InvalidCredentialsException(LoginFailedException):
+    """
+    The username or password was rejected.
+    """
@@ -0,0 +1,188 @@
+import logging
+import re
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Dict, Mapping, Optional
+from urllib.parse import urlsplit
+
+import requests
+
+from fifty_cal.exceptions import (
+    ConfigurationException,
+    InvalidCredentialsException,
+    LoginFailedException,
+    UnableToLogoutException,
+)
+from fifty_cal.session import Session
+
+log = logging.getLogger(__name__)
+
+AUTHENTICATORS = ("selenium", "http")
+
+# Roundcube only sets this cookie once the user has logged in successfully.
+AUTH_COOKIE_NAME = "roundcube_sessauth"
+
+LOGIN_TOKEN_PATTERN = re.compile(
+    r"<input[^>]*name=\"_token\"[^>]*value=\"([^\"]+)\"", re.IGNORECASE
+)
+REQUEST_TOKEN_PATTERN = re.compile(r"\"request_token\"\s*:\s*\"([^\"]+)\"")
+
+
+class HttpSession:
+    """
+    Handle the user session without a browser.
+
+    Submits the roundcube login form with a plain `requests.Session`: the login page
+    is fetched for its `_token`, the form is posted with the user's credentials and
+    the resulting cookies are collected. Can be used in place of `Session` and takes
+    a couple of http requests rather than starting Firefox.
+
+    If `fallback` is given, it is used to log in instead whenever the login form
+    doesn't behave as expected, for example if the login page changes. Rejected
+    credentials are never retried with the fallback.
+
+    The credentials are only ever sent over https. `allow_insecure` lifts this, for
+    testing against a local server.
+    """
+
+    def __init__(
+        self,
+        timings: Optional[Dict[str, float]] = None,
+        login_url: str = Session.LOGIN_URL,
+        login_timeout: float = Session.LOGIN_TIMEOUT_SECONDS,
+        logout_timeout: float = Session.LOGOUT_RETRY_MAX_SECONDS,
+        fallback: Optional[Session] = None,
+        allow_insecure: bool = False,
+    ):
+        self.logged_in = False
+        self.cookies_expire: Optional[float] = None
+        self.timings = timings if timings is not None else {}
+        self.login_url = login_url
+        self.login_timeout = login_timeout
+        self.logout_timeout = logout_timeout
+        self.fallback = fallback
+        self.allow_insecure = allow_insecure
+        self.check_secure(login_url)
+        self.requests_session: Optional[requests.Session] = None
+        self.request_token: Optional[str] = None
+
+    @contextmanager
+    def start_session(
+        self, username: str, password: str, logout: bool = True
+    ) -> Mapping[str, str]:
+        """
+        Log in and get session and auth cookies.
+
+        Behaves in the same way as `Session.start_session`.
+        """
+        use_fallback = False
+        try:
+            cookies = self.login(username, password)
+        except InvalidCredentialsException:
+            raise
+        except (LoginFailedException, requests.RequestException):
+            if self.fallback is None:
+                raise
+            log.warning("Unable to log in over http. Falling back to the browser.")
+            use_fallback = True
+
+        if use_fallback:
+            with self.fallback.start_session(username, password, logout) as cookies:
+                self.cookies_expire = self.fallback.cookies_expire
+                yield cookies
+            return
+
+        try:
+            yield cookies
+        finally:
+            if logout:
+                log.debug("Session exited. Logging out.")
+                self.logout()
+            else:
+                log.debug("Session exited. Leaving session logged in for reuse.")
+
+    def check_secure(self, url: str):
+        """
+        Raise `ConfigurationException` if `url` isn't https, unless `allow_insecure`
+        is set.
+        """
+        if not self.allow_insecure and urlsplit(url).scheme != "https":
+            raise ConfigurationException(f"Refusing to log in to {url} without https.")
+
+    def login(self, username: str, password: str) -> Dict[str, str]:
+        """
+        Submit the login form and return the cookies of the new session.
+
+        The form is posted to the login page as it was finally loaded, after any
+        redirects, as a redirected post would lose the form.
+        """
+        log.debug("Logging in over http.")
+        login_start = perf_counter()
+        self.requests_session = requests.Session()
+
+        login_page = self.requests_session.get(
+            self.login_url, timeout=self.login_timeout
+        )
+        token = LOGIN_TOKEN_PATTERN.search(login_page.text)
+        if token is None:
+            raise LoginFailedException("No request token found on the login page.")
+        self.check_secure(login_page.url)
+
+        response = self.requests_session.post(
+            login_page.url,
+            params={"_task": "login"},
+            data={
+                "_token": token.group(1),
+                "_task": "login",
+                "_action": "login",
+                "_timezone": "_default_",
+                "_url": "",
+                "_user": username,
+                "_pass": password,
+            },
+            timeout=self.login_timeout,
+        )
+        if AUTH_COOKIE_NAME not in self.requests_session.cookies:
+            if response.status_code == 401:
+                raise InvalidCredentialsException("Username or password rejected.")
+            raise LoginFailedException(
+                f"Login failed with status {response.status_code}."
+            )
+
+        # The page the login redirects to holds the token needed to log out again.
+        request_token = REQUEST_TOKEN_PATTERN.search(response.text)
+        self.request_token = request_token.group(1) if request_token else None
+
+        expiry_times = [
+            cookie.expires for cookie in self.requests_session.cookies if cookie.expires
+        ]
+        self.cookies_expire = min(expiry_times) if expiry_times else None
+        self.logged_in = True
+        self.timings["login"] = perf_counter() - login_start
+
+        return self.requests_session.cookies.get_dict()
+
+    def logout(self):
+        """
+        Log out of the current session.
+        """
+        if self.request_token is None:
+            log.error("No request token available to log out with.")
+            raise UnableToLogoutException
+
+        try:
+            response = self.requests_session.get(
+                self.login_url,
+                params={"_task": "logout", "_token": self.request_token},
+                timeout=self.logout_timeout,
+            )
+        except requests.RequestException:
+            log.exception("Unable to log out of current session.")
+            raise UnableToLogoutException
+        if response.status_code >= 400:
+            log.error(f"Logout request failed with status {response.status_code}.")
+            raise UnableToLogoutException
+
+        self.logged_in = False
+        self.request_token = None
+        log.debug("Successfully logged out.")
@@ -1,11 +1,105 @@
-from vobject.base import Component, readOne
+import hashlib
+import logging
+import os
+from typing import Optional
 
+from fifty_cal.cache import read_json, write_json
+from fifty_cal.records import EventRecord, RecordCalendar, read_records
 
-def get_local_calendar(file_path: str) -> Component:
+log = logging.getLogger(__name__)
+
+# Bump whenever the layout of `RecordCalendar` or `EventRecord` changes so that old
+# cache files are ignored rather than loaded.
+RECORDS_CACHE_VERSION = 3
+
+
+def get_records_cache_path(file_path: str) -> str:
+    """
+    Get the path of the file that caches the records of a local calendar.
+
+    The cache is a hidden JSON file next to the calendar.
+    """
+    directory, file_name = os.path.split(file_path)
+    return os.path.join(directory, f".{file_name}.records")
+
+
+def load_cached_records(
+    file_path: str, size: int, mtime_ns: int, content_hash: str
+) -> Optional[RecordCalendar]:
+    """
+    Load the cached records of a local calendar if they match the calendar file.
+    """
+    cached = read_json(get_records_cache_path(file_path))
+    if cached.get("version") != RECORDS_CACHE_VERSION or (
+        cached.get("size"),
+        cached.get("mtime_ns"),
+        cached.get("hash"),
+    ) != (size, mtime_ns, content_hash):
+        return None
+    try:
+        return RecordCalendar.from_json(cached["calendar"])
+    except (KeyError, TypeError, ValueError):
+        log.warning(f"Ignoring unreadable records cache for {file_path}.")
+        return None
+
+
+def save_cached_records(
+    file_path: str,
+    calendar: RecordCalendar,
+    size: int,
+    mtime_ns: int,
+    content_hash: str,
+):
+    """
+    Cache the records of a local calendar along with the state of its file.
+
+    The fingerprint of each event is worked out first so that it is cached too.
+    """
+    for children in calendar.contents.values():
+        for child in children:
+            if isinstance(child, EventRecord):
+                child.get_fingerprint()
+
+    write_json(
+        {
+            "version": RECORDS_CACHE_VERSION,
+            "size": size,
+            "mtime_ns": mtime_ns,
+            "hash": content_hash,
+            "calendar": calendar.to_json(),
+        },
+        get_records_cache_path(file_path),
+        private=True,
+        compact=True,
+    )
+
+
+def get_local_records(file_path: str) -> RecordCalendar:
     """
-    Read and parse a local calendar file, returning a vobject Component object.
+    Read a local calendar file into a `RecordCalendar` without parsing its events.
+
+    The records are cached next to the calendar. If the size, modification time and
+    hash of the calendar file haven't changed since, the cached records are loaded
+    instead of reading the calendar again. Timezones are still parsed so that they
+    are registered with vobject.
     """
-    with open(file_path) as calendar_file:
-        local_calendar = calendar_file.read()
+    file_stat = os.stat(file_path)
+    with open(file_path, "rb") as calendar_file:
+        content = calendar_file.read()
+    content_hash = hashlib.blake2b(content, digest_size=16).hexdigest()
+
+    calendar = load_cached_records(
+        file_path, file_stat.st_size, file_stat.st_mtime_ns, content_hash
+    )
+    if calendar is not None:
+        calendar.register_timezones()
+        return calendar
 
-    return readOne(local_calendar)
+    calendar = read_records(content.decode("utf-8").splitlines())
+    try:
+        save_cached_records(
+            file_path, calendar, file_stat.st_size, file_stat.st_mtime_ns, content_hash
+        )
+    except OSError:
+        log.warning(f"Unable to cache records for {file_path}.", exc_info=True)
+    return calendar
@@ -1,66 +1,241 @@
+import copy
+from typing import Callable, Dict, Iterator, List, Optional, Union
+
 from vobject.base import Component
 
-from fifty_cal.diff import CalendarDiff
+from fifty_cal.diff import (
+    DIFFED_COMPONENTS,
+    CalendarDiff,
+    get_event_key,
+    get_fingerprint,
+)
+
+# The state of an event at the last successful sync: its fingerprint, `LAST-MODIFIED`
+# and `SEQUENCE`. Stored as JSON, so read back as a list rather than a tuple.
+BaseEntry = List[Union[str, int, None]]
+SyncBase = Dict[str, BaseEntry]
+
+
+def copy_calendar(calendar: Component) -> Component:
+    """
+    Make a shallow copy of a calendar.
+
+    The copy has its own `contents` so that events can be added and removed without
+    affecting the original, but the events themselves are shared rather than copied.
+    """
+    calendar_copy = copy.copy(calendar)
+    calendar_copy.contents = {
+        key: list(children) for key, children in calendar.contents.items()
+    }
+    return calendar_copy
+
+
+def iter_events(calendar: Component) -> Iterator[Component]:
+    """
+    Iterate over the events and todos in a calendar.
+    """
+    for name in DIFFED_COMPONENTS:
+        yield from calendar.contents.get(name, [])
+
+
+def count_events(calendar: Component) -> int:
+    """
+    Count the events and todos in a calendar.
+    """
+    return sum(len(calendar.contents.get(name, [])) for name in DIFFED_COMPONENTS)
+
+
+def get_sync_key(event: Component) -> str:
+    """
+    Get the key an event is stored under in a sync base.
+
+    Overridden instances of a recurring event share the `UID` of the event they
+    override, so their `RECURRENCE-ID` is included.
+    """
+    uid, _, recurrence_id = get_event_key(event)
+    return f"{uid}#{recurrence_id}" if recurrence_id else uid
+
+
+def index_events(calendar: Component) -> Dict[str, Component]:
+    """
+    Build a mapping of sync key to event for the events and todos in a calendar.
+
+    A recurring event and each of its overridden instances get their own key, see
+    `get_sync_key`. If a key appears more than once the first occurrence is used.
+    """
+    index = {}
+    for event in iter_events(calendar):
+        index.setdefault(get_sync_key(event), event)
+    return index
 
 
-def merge(diff: CalendarDiff) -> Component:
+def build_sync_base(
+    calendar: Component, fingerprint: Callable[[Component], str] = get_fingerprint
+) -> SyncBase:
+    """
+    Record the state of every event in a calendar that has just been synced.
+    """
+    base = {}
+    for event in iter_events(calendar):
+        last_modified = event.getChildValue("last_modified")
+        base[get_sync_key(event)] = [
+            fingerprint(event),
+            last_modified.isoformat() if last_modified else None,
+            int(event.getChildValue("sequence", 0)),
+        ]
+    return base
+
+
+def get_changes(
+    calendar: Component,
+    base: SyncBase,
+    fingerprint: Callable[[Component], str] = get_fingerprint,
+) -> Dict[str, Optional[Component]]:
+    """
+    Find the events in a calendar that have changed since the sync base was taken.
+
+    Returns a mapping of sync key to the added or changed event, or to `None` if the
+    event has been deleted.
+    """
+    changes = {}
+    keys = set()
+    for event in iter_events(calendar):
+        key = get_sync_key(event)
+        keys.add(key)
+        entry = base.get(key)
+        if entry is None or entry[0] != fingerprint(event):
+            changes[key] = event
+    for key in base.keys() - keys:
+        changes[key] = None
+    return changes
+
+
+def is_newer(event_1: Component, event_2: Component) -> bool:
+    """
+    Check whether `event_1` was last modified more recently than `event_2`.
+
+    An event without a `LAST-MODIFIED` value is treated as older than one with.
+    """
+    event_1_last_modified = event_1.getChildValue("last_modified")
+    event_2_last_modified = event_2.getChildValue("last_modified")
+
+    if event_1_last_modified is None:
+        return False
+    if event_2_last_modified is None:
+        return True
+    return event_1_last_modified > event_2_last_modified
+
+
+def merge(diff: CalendarDiff, stats: Optional[Dict[str, float]] = None) -> Component:
     """
     Take a diff and rebuild the calendar such that it is up to date.
 
     Out of sync calendars will be updated with new events and any conflicts resolved by
     taking the latest version of the event.
+
+    The merged calendar is based on `cal2`. Events in `cal2` that are superseded by
+    those in `cal1` are replaced in place and events only in `cal1` are appended.
+    Each calendar is indexed once on `UID` and `RECURRENCE-ID`, so the merge is
+    linear in the number of events and each overridden instance of a recurring event
+    is merged on its own.
+
+    If a `stats` dictionary is passed, the number of events that differ in both
+    calendars is stored in it as `"conflicts"`.
     """
 
-    if not diff.diff:
+    if not diff.diffed:
         diff.clean_calendars()
         diff.get_diff()
 
-    calendar_1 = diff.cal1
-    calendar_2 = diff.cal2
+    calendar_1_events = index_events(diff.cal1)
+    calendar_2_events = index_events(diff.cal2)
     updated_events = {}
+    conflicts = 0
 
-    for event_diff in diff.diff:
-        if None in event_diff:
-            # `None` in event_diff implies no conflict - just that one calendar has an
-            # event that the other doesn't.
-            event = event_diff[0] or event_diff[1]
-            uid = event.uid.value
-            updated_events[uid] = event
+    for event_1, event_2 in diff.diff:
+        if event_1 is None:
+            # Events only in calendar 2 are already in the updated calendar.
             continue
-        # `None` not in event_diff implies a conflict.
-        uid = event_diff[0].uid.value
-
-        # Get the version that was last modified more recently.
-        event_1_last_modified = event_diff[0].contents["LAST-MODIFIED"][0].value
-        event_2_last_modified = event_diff[1].contents["LAST-MODIFIED"][0].value
-
-        if event_1_last_modified > event_2_last_modified:
-            for event in calendar_1.contents["vevent"]:
-                if event.contents["uid"][0].value == uid:
-                    updated_events[uid] = event
-                    break
+        key = get_sync_key(event_1)
+        if event_2 is None:
+            # Calendar 1 has an event that calendar 2 doesn't.
+            updated_events[key] = event_1
             continue
+        # Both calendars have a version of the event. The diff only contains the
+        # properties that differ so compare the full events.
+        conflicts += 1
+        if is_newer(calendar_1_events[key], calendar_2_events[key]):
+            updated_events[key] = calendar_1_events[key]
 
-        for event in calendar_2.contents["vevent"]:
-            if event.contents["uid"][0].value == uid:
-                updated_events[uid] = event
-                break
-        continue
+    updated_cal = copy_calendar(diff.cal2)
 
-    updated_cal = Component.duplicate(calendar_2)
-    out_of_date_events = []
+    for name in DIFFED_COMPONENTS:
+        events = updated_cal.contents.get(name, [])
+        for index, event in enumerate(events):
+            key = get_sync_key(event)
+            if key in updated_events:
+                events[index] = updated_events.pop(key)
 
-    for event in updated_cal.contents["vevent"]:
-        uid = event.uid.value
-        if uid not in updated_events:
+    for event in updated_events.values():
+        updated_cal.add(event)
+
+    if stats is not None:
+        stats["conflicts"] = conflicts
+    return updated_cal
+
+
+def merge_three_way(
+    diff: CalendarDiff, base: SyncBase, stats: Optional[Dict[str, float]] = None
+) -> Component:
+    """
+    Merge two calendars using the state they were in after the last sync.
+
+    `cal1` and `cal2` of the diff are compared against `base` rather than each
+    other, so only the events that changed on either side since the last sync are
+    looked at. This also tells deletions apart from additions: an event missing from
+    one calendar that is in the base has been deleted and stays deleted, unless it has
+    been changed in the other calendar since. Events changed in both calendars are
+    resolved in the same way as `merge`, by taking the latest version of the event.
+
+    The merged calendar is based on `cal2`, and `stats` filled in, as with `merge`.
+    """
+    calendar_1_changes = get_changes(diff.cal1, base)
+    calendar_2_changes = get_changes(diff.cal2, base)
+    updated_events: Dict[str, Optional[Component]] = {}
+    conflicts = 0
+
+    for key, event_1 in calendar_1_changes.items():
+        if key not in calendar_2_changes:
+            updated_events[key] = event_1
             continue
-        event = updated_events[uid]
-        out_of_date_events.append(event)
+        conflicts += 1
+        event_2 = calendar_2_changes[key]
+        if event_1 is None or event_2 is None:
+            # Deleted on one side and changed on the other. Keep the change.
+            updated_events[key] = event_1 or event_2
+        elif is_newer(event_1, event_2):
+            updated_events[key] = event_1
 
-    for event in out_of_date_events:
-        del event
+    updated_cal = copy_calendar(diff.cal2)
 
-    for uid, event in updated_events.items():
-        updated_cal.add(event)
+    for name in DIFFED_COMPONENTS:
+        events = updated_cal.contents.get(name)
+        if not events:
+            continue
+        kept_events = []
+        for event in events:
+            key = get_sync_key(event)
+            if key in updated_events:
+                event = updated_events.pop(key)
+                if event is None:
+                    continue
+            kept_events.append(event)
+        updated_cal.contents[name] = kept_events
+
+    for event in updated_events.values():
+        if event is not None:
+            updated_cal.add(event)
 
+    if stats is not None:
+        stats["conflicts"] = conflicts
     return updated_cal
@@ -0,0 +1,194 @@
+"""
+Measuring each stage of a run and exporting the measurements.
+
+Stages are measured into plain dictionaries with `measure_stage`, so that the
+measurements can be passed back from the processes calendars are synced in. A
+`Recorder` collects them for the whole run and exports them as JSON lines, for
+logging, and in the Prometheus text format, for the textfile collector of
+node_exporter.
+"""
+
+import json
+import logging
+import os
+import re
+import sys
+import time
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+from typing import Dict, Iterator, List, Mapping, Optional, Tuple
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+log = logging.getLogger(__name__)
+
+# The values measured for each stage, keyed on stage name.
+Stages = Dict[str, Dict[str, float]]
+
+METRIC_PREFIX = "fifty_cal_stage_"
+EXPORT_TIMESTAMP_METRIC = "fifty_cal_last_export_timestamp_seconds"
+
+# The values that stages can measure, with the help text of their Prometheus metric.
+METRICS = {
+    "seconds": "Wall time taken by the stage.",
+    "bytes": "Bytes of calendar data received or sent.",
+    "events": "Events handled by the stage.",
+    "differences": "Events that differ between the local and downloaded calendars.",
+    "conflicts": "Events changed in both calendars, resolved by keeping the latest.",
+    "max_rss_bytes": "Peak resident memory of the process by the end of the stage.",
+}
+
+LABEL_ESCAPES = {"\\": "\\\\", '"': '\\"', "\n": "\\n"}
+LABEL_ESCAPE_PATTERN = re.compile(r'[\\"\n]')
+
+
+def get_max_rss() -> Optional[int]:
+    """
+    Get the peak resident memory of this process in bytes, if it can be measured.
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS bytes.
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+@contextmanager
+def measure_stage(stages: Optional[Stages], name: str) -> Iterator[Dict[str, float]]:
+    """
+    Measure a stage, storing what was measured in `stages` under `name`.
+
+    Yields a dictionary that any other values measured during the stage, such as the
+    number of events handled, can be added to. The wall time and peak memory are
+    added when the stage ends. Nothing is stored if `stages` is `None`.
+    """
+    values: Dict[str, float] = {}
+    start = perf_counter()
+    try:
+        yield values
+    finally:
+        if stages is not None:
+            values["seconds"] = perf_counter() - start
+            max_rss = get_max_rss()
+            if max_rss is not None:
+                values["max_rss_bytes"] = max_rss
+            stages[name] = values
+
+
+class Recorder:
+    """
+    Collects the stages measured for each calendar during a run.
+
+    This recorder throws the measurements away, so that the run can be instrumented
+    whether or not metrics are wanted. Override `record` and `export` to send them
+    somewhere else.
+    """
+
+    def record(self, calendar: Optional[str], stage: str, values: Mapping[str, float]):
+        """
+        Record the values measured for a stage. `calendar` is `None` for stages of
+        the run as a whole, like logging in.
+        """
+
+    def record_stages(self, calendar: Optional[str], stages: Stages):
+        """
+        Record every stage measured by `measure_stage`.
+        """
+        for stage, values in stages.items():
+            self.record(calendar, stage, values)
+
+    def export(self):
+        """
+        Export the values recorded so far.
+        """
+
+
+def escape_label(value: str) -> str:
+    """
+    Escape a Prometheus label value.
+    """
+    return LABEL_ESCAPE_PATTERN.sub(lambda match: LABEL_ESCAPES[match.group()], value)
+
+
+def format_prometheus(
+    latest: Mapping[Tuple[Optional[str], str], Mapping[str, float]], timestamp: float
+) -> str:
+    """
+    Format the latest values of each stage in the Prometheus text format.
+
+    Every value is a gauge labelled with its stage and, if it has one, calendar.
+    """
+    lines = []
+    for name, help_text in METRICS.items():
+        samples = []
+        for (calendar, stage), values in sorted(
+            latest.items(), key=lambda item: (item[0][0] or "", item[0][1])
+        ):
+            if name not in values:
+                continue
+            labels = f'stage="{escape_label(stage)}"'
+            if calendar is not None:
+                labels = f'calendar="{escape_label(calendar)}",{labels}'
+            samples.append(f"{METRIC_PREFIX}{name}{{{labels}}} {values[name]}")
+        if samples:
+            lines.append(f"# HELP {METRIC_PREFIX}{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} gauge")
+            lines.extend(samples)
+    lines.append(f"# HELP {EXPORT_TIMESTAMP_METRIC} When the metrics were exported.")
+    lines.append(f"# TYPE {EXPORT_TIMESTAMP_METRIC} gauge")
+    lines.append(f"{EXPORT_TIMESTAMP_METRIC} {timestamp}")
+    return "\n".join(lines) + "\n"
+
+
+def write_text(text: str, path: str):
+    """
+    Write `text` to `path`, replacing the file atomically so that a collector never
+    reads a partly written file.
+    """
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as temp_file:
+        temp_file.write(text)
+    os.replace(temp_path, path)
+
+
+class MetricsRecorder(Recorder):
+    """
+    Keeps the values recorded during a run and exports them to files.
+
+    Each export appends the values recorded since the last one to `json_path` as
+    JSON lines, one per stage, and replaces `prometheus_path` with the latest values
+    of every stage. In watch mode this means the JSON log holds every sync while the
+    Prometheus file holds the most recent.
+    """
+
+    def __init__(
+        self, json_path: Optional[str] = None, prometheus_path: Optional[str] = None
+    ):
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.pending: List[Dict] = []
+        self.latest: Dict[Tuple[Optional[str], str], Dict[str, float]] = {}
+        self.lock = Lock()
+
+    def record(self, calendar: Optional[str], stage: str, values: Mapping[str, float]):
+        with self.lock:
+            self.pending.append(
+                {"time": time.time(), "calendar": calendar, "stage": stage, **values}
+            )
+            self.latest[calendar, stage] = dict(values)
+
+    def export(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+            prometheus = format_prometheus(self.latest, time.time())
+        if self.json_path and pending:
+            with open(self.json_path, "a") as json_file:
+                for sample in pending:
+                    json_file.write(json.dumps(sample, sort_keys=True) + "\n")
+        if self.prometheus_path:
+            write_text(prometheus, self.prometheus_path)
+        log.debug(f"Exported metrics for {len(pending)} stages.")
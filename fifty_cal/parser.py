@@ -0,0 +1,80 @@
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from vobject.base import Component, readOne
+
+CALENDAR_NAME = "VCALENDAR"
+
+# A block is the name of a top level component within the calendar and its raw lines.
+# Calendar properties, such as `PRODID`, are returned with a name of `None`.
+Block = Tuple[Optional[str], List[str]]
+
+
+def iter_blocks(lines: Iterable[str]) -> Iterator[Block]:
+    """
+    Split the lines of an iCalendar document into blocks without parsing them.
+
+    Only one block is held in memory at a time, so `lines` can be a file handle or
+    the lines of a streamed http response. Line endings are stripped and folded
+    lines are kept with the line they belong to.
+    """
+    block_name = None
+    block = []
+    depth = 0
+
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if not line:
+            continue
+        if line[0] in " \t":
+            # A folded line continues the previous line.
+            block.append(line)
+            continue
+
+        if block and depth <= 1:
+            # The previous calendar property is complete.
+            yield None, block
+            block = []
+
+        upper_line = line.upper()
+        if upper_line.startswith("BEGIN:"):
+            depth += 1
+            if depth == 1:
+                # The start of the calendar itself.
+                continue
+            if depth == 2:
+                block_name = upper_line[6:].strip()
+        elif upper_line.startswith("END:"):
+            depth -= 1
+            if depth == 0:
+                # The end of the calendar itself.
+                continue
+            if depth == 1:
+                block.append(line)
+                yield block_name, block
+                block_name = None
+                block = []
+                continue
+
+        block.append(line)
+
+    if block:
+        yield block_name, block
+
+
+def parse_block(block: List[str]) -> Component:
+    """
+    Parse the lines of a single component into a vobject `Component`.
+
+    The component is wrapped in a calendar so that vobject treats it exactly as it
+    would when parsing a whole calendar, for example registering timezones.
+    """
+    calendar = parse_calendar_block(block)
+    return next(calendar.getChildren())
+
+
+def parse_calendar_block(block: List[str]) -> Component:
+    """
+    Parse lines into a vobject calendar `Component`.
+    """
+    lines = [f"BEGIN:{CALENDAR_NAME}"] + block + [f"END:{CALENDAR_NAME}"]
+    return readOne("\r\n".join(lines) + "\r\n")
@@ -0,0 +1,227 @@
+"""
+The parse, diff, merge and serialize steps of syncing a calendar.
+
+The functions in this module only take raw calendar data and file paths so that they
+can be run in a separate process.
+"""
+
+import hashlib
+import io
+import logging
+import os
+import stat
+import tempfile
+from typing import NamedTuple, Optional, Union
+
+from vobject.base import Component
+
+from fifty_cal.cache import read_json, write_json
+from fifty_cal.diff import CalendarDiff
+from fifty_cal.local import get_local_records
+from fifty_cal.merge import (
+    SyncBase,
+    build_sync_base,
+    count_events,
+    merge,
+    merge_three_way,
+)
+from fifty_cal.metrics import Stages, measure_stage
+from fifty_cal.records import RecordCalendar, read_records
+from fifty_cal.window import SyncWindow, pass_through, split_calendars
+
+log = logging.getLogger(__name__)
+
+# Calendars are written out in chunks of this many bytes.
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# Read once, as the umask can only be read by changing it, which isn't thread safe.
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+class SyncResult(NamedTuple):
+    """
+    The process that synced a calendar and the stages it measured while doing so.
+    """
+
+    pid: int
+    stages: Stages
+
+
+def parse_calendar(calendar_data: bytes) -> RecordCalendar:
+    """
+    Read the raw bytes of a downloaded calendar.
+
+    Events are only parsed by vobject if they need to be, see `RecordCalendar`.
+    """
+    return read_records(io.StringIO(calendar_data.decode("utf-8")))
+
+
+def update_local(
+    downloaded_calendar: RecordCalendar,
+    existing_calendar: RecordCalendar,
+    base: Optional[SyncBase] = None,
+    window: Optional[SyncWindow] = None,
+    stages: Optional[Stages] = None,
+) -> RecordCalendar:
+    """
+    Merge a downloaded calendar with the existing local copy.
+
+    If the sync `base` from the last run is given, the calendars are merged against
+    it so that events deleted from either calendar stay deleted.
+
+    If a sync `window` is given, only the events within it are merged. The rest are
+    passed through as they are, see `fifty_cal.window`.
+
+    If a `stages` dictionary is passed, diffing and merging are measured into it,
+    see `fifty_cal.metrics`. A three way merge has no separate diff stage, as it
+    compares each calendar with the base as it merges.
+
+    If the merge leaves every event as it is in the local copy, the local copy itself
+    is returned.
+    """
+    local_calendar = existing_calendar
+
+    passed_events = []
+    if window:
+        (
+            existing_calendar,
+            downloaded_calendar,
+            passed_events,
+            base,
+        ) = split_calendars(existing_calendar, downloaded_calendar, window, base)
+
+    cal_diff = CalendarDiff(cal1=existing_calendar, cal2=downloaded_calendar)
+    if not base:
+        with measure_stage(stages, "diff") as metrics:
+            cal_diff.clean_calendars()
+            cal_diff.get_diff()
+            metrics["differences"] = len(cal_diff.diff)
+    with measure_stage(stages, "merge") as metrics:
+        if base:
+            merged_calendar = merge_three_way(cal_diff, base, metrics)
+        else:
+            merged_calendar = merge(cal_diff, metrics)
+        metrics["events"] = count_events(merged_calendar) + len(passed_events)
+    merged_calendar = pass_through(merged_calendar, passed_events)
+    if build_sync_base(merged_calendar) == build_sync_base(local_calendar):
+        return local_calendar
+    return merged_calendar
+
+
+def file_matches(filepath: str, content: bytes) -> bool:
+    """
+    Check whether the file at `filepath` already holds exactly `content`.
+    """
+    try:
+        if os.path.getsize(filepath) != len(content):
+            return False
+        file_hash = hashlib.blake2b()
+        with open(filepath, "rb") as existing_file:
+            for chunk in iter(lambda: existing_file.read(WRITE_BUFFER_SIZE), b""):
+                file_hash.update(chunk)
+    except FileNotFoundError:
+        return False
+
+    return file_hash.digest() == hashlib.blake2b(content).digest()
+
+
+def write_file(filepath: str, content: bytes):
+    """
+    Replace the file at `filepath` with `content` atomically.
+
+    The content is written to a temporary file in the same directory, flushed to
+    disk and then renamed over the original, so a crash part way through never
+    leaves a truncated file behind.
+    """
+    directory = os.path.dirname(filepath) or "."
+    file_descriptor, temp_path = tempfile.mkstemp(
+        dir=directory, prefix=f".{os.path.basename(filepath)}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(file_descriptor, "wb", buffering=WRITE_BUFFER_SIZE) as temp_file:
+            temp_file.write(content)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        # `mkstemp` creates files that only the current user can read, so give it
+        # the mode of the file it replaces or that of a newly created file.
+        try:
+            mode = stat.S_IMODE(os.stat(filepath).st_mode)
+        except FileNotFoundError:
+            mode = 0o666 & ~UMASK
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, filepath)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    # Make sure the rename itself is on disk.
+    directory_descriptor = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(directory_descriptor)
+    finally:
+        os.close(directory_descriptor)
+
+
+def save_calendar(calendar: Union[Component, RecordCalendar], filepath: str) -> bool:
+    """
+    Save a calendar to disk.
+
+    For a `RecordCalendar` serializing mostly means copying the lines of the events
+    that were read unchanged. Nothing is written if the file already holds the same
+    calendar, otherwise the file is replaced atomically.
+
+    Returns whether the file was written.
+    """
+    buffer = io.StringIO()
+    calendar.serialize(buffer)
+    content = buffer.getvalue().encode("utf-8")
+
+    if file_matches(filepath, content):
+        log.debug(f"{filepath} is unchanged.")
+        return False
+
+    write_file(filepath, content)
+    return True
+
+
+def sync_calendar_data(
+    calendar_data: bytes,
+    filepath: str,
+    base_path: Optional[str] = None,
+    window: Optional[SyncWindow] = None,
+) -> SyncResult:
+    """
+    Parse a downloaded calendar, merge it with any local copy and save it.
+
+    The local copy is read as records, see `get_local_records`, and is left as it
+    is if the merge doesn't change any of its events, even if the server serializes
+    them differently.
+
+    If `base_path` is given, the sync base stored there by the last run is used to
+    merge the calendars and is replaced with the state of the saved calendar. If a
+    sync `window` is given, only the events within it are merged.
+
+    Returns the process ID that did the work so that callers can log it, along with
+    the stages measured, as they can't be recorded from another process.
+    """
+    stages: Stages = {}
+    with measure_stage(stages, "parse") as metrics:
+        calendar = parse_calendar(calendar_data)
+        metrics["events"] = count_events(calendar)
+    local_calendar = None
+    if os.path.isfile(filepath):
+        with measure_stage(stages, "read_local") as metrics:
+            local_calendar = get_local_records(filepath)
+            metrics["events"] = count_events(local_calendar)
+        base = read_json(base_path) if base_path else None
+        calendar = update_local(calendar, local_calendar, base, window, stages)
+    with measure_stage(stages, "save"):
+        saved = calendar is not local_calendar and save_calendar(calendar, filepath)
+        if base_path and (saved or not os.path.isfile(base_path)):
+            os.makedirs(os.path.dirname(base_path), exist_ok=True)
+            # Saving leaves each event with the lines it was written as, so the base
+            # matches the saved file without reading it back.
+            write_json(build_sync_base(calendar), base_path)
+
+    return SyncResult(os.getpid(), stages)
@@ -0,0 +1,623 @@
+"""
+A compact representation of a calendar for diffing and merging.
+
+Diffing and merging only need a handful of properties from each event, so rather
+than parsing every event into a tree of vobject objects, events are kept as the raw
+lines they were read from along with those properties. An event is only parsed by
+vobject if something needs more than that, such as comparing two different versions
+of it property by property or serializing it.
+"""
+
+import datetime as dt
+import hashlib
+import io
+import logging
+import re
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from vobject.base import Component, ParseError, toVName
+from vobject.icalendar import TimezoneComponent, getTzid, stringToDurations
+
+from fifty_cal.diff import IGNORED_PROPERTIES, get_fingerprint
+from fifty_cal.parser import (
+    CALENDAR_NAME,
+    iter_blocks,
+    parse_block,
+    parse_calendar_block,
+)
+
+log = logging.getLogger(__name__)
+
+# Marks a property that is present but has to be parsed by vobject to get its value.
+UNPARSED = object()
+
+# The properties read straight from the raw lines of an event, and the attribute of
+# `EventRecord` each is stored in.
+RECORD_FIELDS = {
+    "uid": "_uid",
+    "sequence": "_sequence",
+    "last-modified": "_last_modified",
+    "recurrence-id": "_recurrence_id",
+    "dtstart": "_dtstart",
+    "dtend": "_dtend",
+    "due": "_due",
+    "duration": "_duration",
+    "rrule": "_rrule",
+    "rdate": "_rdate",
+    "tzid": "_tzid",
+}
+
+DATE_FORMAT = "%Y%m%d"
+LOCAL_DATE_TIME_FORMAT = "%Y%m%dT%H%M%S"
+
+TIMEZONE_NAME = "vtimezone"
+
+TZID_PATTERN = re.compile(r"(?:^|;)TZID=(\"[^\"]*\"|[^;]*)", re.IGNORECASE)
+
+
+def unfold(lines: Iterable[str]) -> Iterator[str]:
+    """
+    Join folded lines back onto the line they continue.
+    """
+    unfolded = None
+    for line in lines:
+        if line[:1] in (" ", "\t") and unfolded is not None:
+            unfolded += line[1:]
+            continue
+        if unfolded is not None:
+            yield unfolded
+        unfolded = line
+    if unfolded is not None:
+        yield unfolded
+
+
+def split_line(line: str) -> Tuple[str, str, str]:
+    """
+    Split an unfolded content line into its name, parameters and value.
+
+    The name is lower case, in the same form as the keys of `Component.contents`.
+    """
+    in_quotes = False
+    name_end = None
+    for index, character in enumerate(line):
+        if character == '"':
+            in_quotes = not in_quotes
+        elif in_quotes:
+            continue
+        elif character == ";" and name_end is None:
+            name_end = index
+        elif character == ":":
+            if name_end is None:
+                name_end = index
+            return (
+                line[:name_end].lower(),
+                line[name_end + 1 : index],
+                line[index + 1 :],
+            )
+    return line.lower(), "", ""
+
+
+class ZonedTime:
+    """
+    A local date time read from a raw line along with the `TZID` it is in.
+
+    The timezone is only looked up when the value is used, as it may not have been
+    registered with vobject when the line was read.
+    """
+
+    __slots__ = ("tzid", "value")
+
+    def __init__(self, tzid: str, value: dt.datetime):
+        self.tzid = tzid
+        self.value = value
+
+    def resolve(self) -> Optional[dt.datetime]:
+        """
+        Get the date time in its timezone, in the same way as vobject.
+
+        Returns `None` if the timezone isn't known.
+        """
+        tzinfo = getTzid(self.tzid)
+        if tzinfo is None:
+            return None
+        if hasattr(tzinfo, "localize"):
+            return tzinfo.localize(self.value)
+        return self.value.replace(tzinfo=tzinfo)
+
+
+def parse_date_time(params: str, value: str) -> Any:
+    """
+    Parse a raw date or date time value, such as a `RECURRENCE-ID`.
+
+    Dates, UTC and floating date times and date times with a `TZID` are handled.
+    Anything else returns `UNPARSED`.
+    """
+    tzid = None
+    value_type = "DATE-TIME"
+    for param in params.split(";") if params else ():
+        param_name, _, param_value = param.partition("=")
+        param_name = param_name.upper()
+        if param_name == "TZID":
+            tzid = param_value.strip('"')
+        elif param_name == "VALUE":
+            value_type = param_value.upper()
+        else:
+            return UNPARSED
+
+    try:
+        if value_type == "DATE" and not tzid:
+            return dt.datetime.strptime(value, DATE_FORMAT).date()
+        if value_type != "DATE-TIME":
+            return UNPARSED
+        if value.endswith("Z") and not tzid:
+            parsed = dt.datetime.strptime(value[:-1], LOCAL_DATE_TIME_FORMAT)
+            return parsed.replace(tzinfo=dt.timezone.utc)
+        parsed = dt.datetime.strptime(value, LOCAL_DATE_TIME_FORMAT)
+    except ValueError:
+        return UNPARSED
+    return ZonedTime(tzid, parsed) if tzid else parsed
+
+
+def parse_field(name: str, params: str, value: str) -> Any:
+    """
+    Get the value of one of the `RECORD_FIELDS` from its raw line.
+
+    Returns `UNPARSED` for values that are awkward to parse without vobject, such as
+    escaped text, which only occur rarely.
+    """
+    if name == "sequence":
+        return value
+    if name in ("uid", "tzid", "rrule"):
+        return UNPARSED if "\\" in value else value
+    if name == "rdate":
+        # Only read to know whether an event has any.
+        return UNPARSED
+    if name == "duration":
+        try:
+            return UNPARSED if params else stringToDurations(value)[0]
+        except ParseError:
+            return UNPARSED
+    return parse_date_time(params, value)
+
+
+def encode_field(value: Any) -> Any:
+    """
+    Convert the value of one of the `RECORD_FIELDS` into a form that can be stored
+    as JSON, see `decode_field`.
+    """
+    if value is None or isinstance(value, str):
+        return value
+    if value is UNPARSED:
+        return ["unparsed"]
+    if isinstance(value, ZonedTime):
+        return ["zoned", value.tzid, value.value.isoformat()]
+    if isinstance(value, dt.datetime):
+        return ["datetime", value.isoformat()]
+    if isinstance(value, dt.date):
+        return ["date", value.isoformat()]
+    if isinstance(value, dt.timedelta):
+        return ["duration", value.total_seconds()]
+    raise TypeError(f"Unable to encode field value {value!r}.")
+
+
+def decode_field(value: Any) -> Any:
+    """
+    Get the value of one of the `RECORD_FIELDS` back from `encode_field`.
+    """
+    if value is None or isinstance(value, str):
+        return value
+    kind, *args = value
+    if kind == "unparsed":
+        return UNPARSED
+    if kind == "zoned":
+        return ZonedTime(args[0], dt.datetime.fromisoformat(args[1]))
+    if kind == "datetime":
+        return dt.datetime.fromisoformat(args[0])
+    if kind == "date":
+        return dt.date.fromisoformat(args[0])
+    if kind == "duration":
+        return dt.timedelta(seconds=args[0])
+    raise ValueError(f"Unknown field value {value!r}.")
+
+
+class EventRecord:
+    """
+    An event, or other component, held as its raw lines and the properties used to
+    match it.
+
+    Can be used in place of a vobject `Component` when diffing and merging. The
+    `UID`, `SEQUENCE`, `LAST-MODIFIED`, `RECURRENCE-ID`, times and `RRULE` of an
+    event, and the `TZID` of a timezone, are available through `getChildValue`
+    without parsing it.
+    Anything else parses the event with vobject the first time it is needed, after
+    which the parsed `component` is kept. If the parsed event is changed, its lines
+    are serialized from it again the next time they are used, see `refresh_lines`.
+    """
+
+    __slots__ = (
+        "name",
+        "lines",
+        "_uid",
+        "_sequence",
+        "_last_modified",
+        "_recurrence_id",
+        "_dtstart",
+        "_dtend",
+        "_due",
+        "_duration",
+        "_rrule",
+        "_rdate",
+        "_tzid",
+        "_tzids",
+        "_fingerprint",
+        "_component",
+        "_parsed_fingerprint",
+    )
+
+    def __init__(self, name: str, lines: List[str]):
+        self.name = name
+        self.lines = lines
+        self._fingerprint = None
+        self._component = None
+        self._parsed_fingerprint = None
+        self.scan_lines()
+
+    def scan_lines(self):
+        """
+        Read the `RECORD_FIELDS` and the timezones used from the raw lines.
+        """
+        self._uid = None
+        self._sequence = None
+        self._last_modified = None
+        self._recurrence_id = None
+        self._dtstart = None
+        self._dtend = None
+        self._due = None
+        self._duration = None
+        self._rrule = None
+        self._rdate = None
+        self._tzid = None
+        self._tzids = set()
+
+        depth = 0
+        for line in unfold(self.lines[1:-1]):
+            upper_line = line[:6].upper()
+            if upper_line.startswith("BEGIN:"):
+                depth += 1
+            elif upper_line.startswith("END:"):
+                depth -= 1
+            elif depth == 0:
+                property_name, params, value = split_line(line)
+                if params:
+                    for tzid in TZID_PATTERN.findall(params):
+                        self._tzids.add(tzid.strip('"'))
+                field = RECORD_FIELDS.get(property_name)
+                if field is not None and getattr(self, field) is None:
+                    setattr(self, field, parse_field(property_name, params, value))
+
+    @property
+    def component(self) -> Component:
+        """
+        The event parsed by vobject.
+        """
+        if self._component is None:
+            self._component = parse_block(self.lines)
+            # Kept to tell whether the parsed event is changed, see `refresh_lines`.
+            self._parsed_fingerprint = get_fingerprint(self._component)
+        return self._component
+
+    def refresh_lines(self) -> List[str]:
+        """
+        Get the raw lines of the event.
+
+        If the event has been parsed and changed since, the lines are serialized
+        from the parsed event and read again first. An event that has been parsed
+        but not changed keeps the lines it was read from.
+        """
+        if self._component is not None:
+            fingerprint = get_fingerprint(self._component)
+            if fingerprint != self._parsed_fingerprint:
+                self.lines = self._component.serialize().splitlines()
+                self.scan_lines()
+                self._fingerprint = None
+                self._parsed_fingerprint = fingerprint
+        return self.lines
+
+    @property
+    def parsed(self) -> bool:
+        """
+        Whether the event has been parsed by vobject.
+        """
+        return self._component is not None
+
+    @property
+    def tzids(self) -> Set[str]:
+        """
+        The IDs of the timezones used by the properties of the event.
+        """
+        self.refresh_lines()
+        return self._tzids
+
+    @property
+    def contents(self) -> Dict[str, list]:
+        """
+        The contents of the parsed event.
+        """
+        return self.component.contents
+
+    def __getattr__(self, name: str):
+        """
+        Make properties accessible in the same way as a `Component`.
+        """
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.component, name)
+
+    def getChildValue(self, childName: str, default: Any = None) -> Any:
+        """
+        Return the value of the first child with the given name or `default`.
+
+        Once the event has been parsed it may have been changed, so the value is
+        always taken from the parsed event.
+        """
+        field = RECORD_FIELDS.get(toVName(childName))
+        if field is None or self._component is not None:
+            return self.component.getChildValue(childName, default)
+        value = getattr(self, field)
+        if isinstance(value, ZonedTime):
+            value = value.resolve()
+            if value is None:
+                return self.component.getChildValue(childName, default)
+        if value is UNPARSED:
+            return self.component.getChildValue(childName, default)
+        return default if value is None else value
+
+    def has_property(self, name: str) -> bool:
+        """
+        Check whether the event has a property.
+
+        Whether it has one of the `RECORD_FIELDS` is known without parsing the
+        event, even if its value isn't.
+        """
+        field = RECORD_FIELDS.get(name)
+        if field is None or self._component is not None:
+            return name in self.component.contents
+        return getattr(self, field) is not None
+
+    def getrruleset(self, addRDate: bool = False):
+        """
+        Get the rules an event recurs on as a `dateutil` rule set.
+
+        Unless the event has already been parsed, a copy is parsed to get the rules
+        and then discarded. The event itself stays unparsed, so is still written out
+        as it was read.
+        """
+        component = self._component or parse_block(self.lines)
+        return component.getrruleset(addRDate)
+
+    def get_fingerprint(self, ignored: Iterable[str] = IGNORED_PROPERTIES) -> str:
+        """
+        Get a hash of the raw contents of the event.
+
+        Like `diff.get_fingerprint`, the order of the properties and any `ignored`
+        properties make no difference to the hash. The two kinds of fingerprint are
+        not comparable with each other, so the fingerprint is always taken from the
+        raw lines, even once the event has been parsed. It only changes if the parsed
+        event is changed, see `refresh_lines`.
+        """
+        self.refresh_lines()
+        default = ignored is IGNORED_PROPERTIES
+        if default and self._fingerprint is not None:
+            return self._fingerprint
+
+        properties = []
+        child_lines = []
+        depth = 0
+        for line in unfold(self.lines[1:-1]):
+            upper_line = line[:6].upper()
+            if upper_line.startswith("BEGIN:"):
+                depth += 1
+            if depth:
+                child_lines.append(line)
+            elif split_line(line)[0] not in ignored:
+                properties.append(line)
+            if upper_line.startswith("END:"):
+                depth -= 1
+        properties.sort()
+
+        content = "\n".join(properties + child_lines)
+        fingerprint = hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+        if default:
+            self._fingerprint = fingerprint
+        return fingerprint
+
+    def to_json(self) -> Dict[str, Any]:
+        """
+        Get the lines and fields of the record, along with its fingerprint if it has
+        been worked out, in a form that can be stored as JSON.
+        """
+        fields = {}
+        for property_name, field in RECORD_FIELDS.items():
+            value = getattr(self, field)
+            if value is not None:
+                fields[property_name] = encode_field(value)
+        return {
+            "name": self.name,
+            "lines": self.refresh_lines(),
+            "fields": fields,
+            "tzids": sorted(self._tzids),
+            "fingerprint": self._fingerprint,
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "EventRecord":
+        """
+        Rebuild a record from `to_json` without reading its lines again.
+        """
+        record = cls.__new__(cls)
+        record.name = data["name"]
+        record.lines = data["lines"]
+        for property_name, field in RECORD_FIELDS.items():
+            setattr(record, field, decode_field(data["fields"].get(property_name)))
+        record._tzids = set(data["tzids"])
+        record._fingerprint = data["fingerprint"]
+        record._component = None
+        record._parsed_fingerprint = None
+        return record
+
+
+class RecordCalendar:
+    """
+    A calendar whose components are held as `EventRecord`s.
+
+    Has the `name`, `contents`, `add` and `serialize` of a vobject `Component` so
+    that it can be diffed, merged and saved in the same way. Calendar properties are
+    kept as raw lines.
+    """
+
+    def __init__(
+        self,
+        properties: List[str],
+        contents: Optional[Dict[str, list]] = None,
+    ):
+        self.name = CALENDAR_NAME
+        self.properties = properties
+        self.contents = contents if contents is not None else {}
+
+    def add(self, component):
+        """
+        Add an event, todo or other component to the calendar.
+        """
+        self.contents.setdefault(component.name.lower(), []).append(component)
+        return component
+
+    def to_component(self) -> Component:
+        """
+        Parse the whole calendar into a vobject `Component`.
+        """
+        calendar = parse_calendar_block(self.properties)
+        for children in self.contents.values():
+            for child in children:
+                if isinstance(child, EventRecord):
+                    child = child.component
+                calendar.add(child)
+        return calendar
+
+    def register_timezones(self):
+        """
+        Parse the timezones in the calendar so that they are registered with vobject.
+
+        Needed when the calendar wasn't read by `read_records`, such as when it was
+        loaded with `from_json`.
+        """
+        for timezone in self.contents.get(TIMEZONE_NAME, []):
+            parse_block(timezone.lines)
+
+    def to_json(self) -> Dict[str, Any]:
+        """
+        Get the calendar in a form that can be stored as JSON.
+
+        Every component must be an `EventRecord`, as they are in a calendar read by
+        `read_records`.
+        """
+        return {
+            "properties": self.properties,
+            "contents": {
+                name: [child.to_json() for child in children]
+                for name, children in self.contents.items()
+            },
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "RecordCalendar":
+        """
+        Rebuild a calendar from `to_json`.
+        """
+        return cls(
+            data["properties"],
+            {
+                name: [EventRecord.from_json(child) for child in children]
+                for name, children in data["contents"].items()
+            },
+        )
+
+    def get_missing_timezones(self) -> List[Component]:
+        """
+        Get the timezones used by events in the calendar that it doesn't define.
+
+        This can happen when an event is merged in from another calendar. vobject
+        adds the missing timezones when serializing a calendar, so this does too.
+        """
+        defined = {
+            timezone.getChildValue("tzid")
+            for timezone in self.contents.get(TIMEZONE_NAME, [])
+        }
+        used = set()
+        for children in self.contents.values():
+            for child in children:
+                if isinstance(child, EventRecord):
+                    used |= child.tzids
+
+        missing = []
+        for tzid in sorted(used - defined):
+            tzinfo = getTzid(tzid)
+            if tzinfo is None:
+                log.warning(f"Timezone {tzid} is used but not defined.")
+                continue
+            missing.append(TimezoneComponent(tzinfo))
+        return missing
+
+    def serialize(self, buf: Optional[IO[str]] = None) -> Optional[str]:
+        """
+        Serialize the calendar to `buf` if it is given, otherwise return a string.
+
+        Records are written out as the lines they were read from, unless they have
+        been parsed and changed, see `EventRecord.refresh_lines`. Only components
+        that were added as vobject components are serialized by vobject. A calendar
+        that has been read and not changed is written back exactly as it was read,
+        aside from line endings.
+        """
+        out = buf if buf is not None else io.StringIO()
+        out.write(f"BEGIN:{CALENDAR_NAME}\r\n")
+        write_lines(out, self.properties)
+        for timezone in self.get_missing_timezones():
+            timezone.serialize(out)
+        # Timezones have to be defined before they are used.
+        for name in sorted(self.contents, key=lambda name: name != TIMEZONE_NAME):
+            for child in self.contents[name]:
+                if isinstance(child, EventRecord):
+                    write_lines(out, child.refresh_lines())
+                    continue
+                child.serialize(out)
+        out.write(f"END:{CALENDAR_NAME}\r\n")
+
+        if buf is None:
+            return out.getvalue()
+
+
+def write_lines(buf: IO[str], lines: List[str]):
+    """
+    Write lines to `buf` with the line endings used by iCalendar.
+    """
+    for line in lines:
+        buf.write(line)
+        buf.write("\r\n")
+
+
+def read_records(lines: Iterable[str]) -> RecordCalendar:
+    """
+    Read an iCalendar document into a `RecordCalendar`.
+
+    Components are stored as `EventRecord`s without being parsed, apart from
+    timezones. These are parsed in the order they appear so that they are registered
+    with vobject before any event that uses them is parsed.
+    """
+    calendar = RecordCalendar([])
+    for name, block in iter_blocks(lines):
+        if name is None:
+            calendar.properties += block
+            continue
+        if name.lower() == TIMEZONE_NAME:
+            parse_block(block)
+        calendar.add(EventRecord(name, block))
+    return calendar
@@ -0,0 +1,103 @@
+"""
+Expanding recurring events into their occurrences within a window of time.
+
+Events are diffed and merged as a recurring event plus its overridden instances
+rather than as individual occurrences, so nothing needs expanding to sync a
+calendar. Expansion is only used where the occurrences themselves matter and is
+always bounded, both by the window and by a maximum number of occurrences, so that
+an endless rule can't run away.
+"""
+
+import datetime as dt
+import logging
+from itertools import islice
+from typing import List, Union
+
+from vobject.base import Component
+
+log = logging.getLogger(__name__)
+
+# The most occurrences of a single event that are expanded.
+MAX_OCCURRENCES = 1000
+
+DateOrDateTime = Union[dt.date, dt.datetime]
+
+
+def to_datetime(value: DateOrDateTime) -> dt.datetime:
+    """
+    Convert a date to a date time at the start of the day.
+    """
+    if isinstance(value, dt.datetime):
+        return value
+    return dt.datetime(value.year, value.month, value.day)
+
+
+def align(value: dt.datetime, reference: dt.datetime) -> dt.datetime:
+    """
+    Make `value` comparable with `reference`.
+
+    Dates and floating date times have no timezone, so a window given in a timezone
+    is compared with them as local time.
+    """
+    if reference.tzinfo is None and value.tzinfo is not None:
+        return value.replace(tzinfo=None)
+    if reference.tzinfo is not None and value.tzinfo is None:
+        return value.replace(tzinfo=reference.tzinfo)
+    return value
+
+
+def has_property(event: Component, name: str) -> bool:
+    """
+    Check whether an event has a property, without parsing an `EventRecord` to find
+    out.
+    """
+    own_has_property = getattr(type(event), "has_property", None)
+    if own_has_property is not None:
+        return own_has_property(event, name)
+    return name in event.contents
+
+
+def is_recurring(event: Component) -> bool:
+    """
+    Check whether an event has a rule or dates that it recurs on.
+    """
+    return has_property(event, "rrule") or has_property(event, "rdate")
+
+
+def get_occurrences(
+    event: Component,
+    start: DateOrDateTime,
+    end: DateOrDateTime,
+    limit: int = MAX_OCCURRENCES,
+) -> List[dt.datetime]:
+    """
+    Get the start of each occurrence of an event between `start` and `end`.
+
+    Occurrences starting at `start` are included, those starting at `end` are not.
+    An event that doesn't recur has a single occurrence at its `DTSTART`. At most
+    `limit` occurrences are returned.
+    """
+    dtstart = event.getChildValue("dtstart")
+    if dtstart is None:
+        return []
+    reference = to_datetime(dtstart)
+    start = align(to_datetime(start), reference)
+    end = align(to_datetime(end), reference)
+
+    rruleset = event.getrruleset(addRDate=True) if is_recurring(event) else None
+    if rruleset is None:
+        return [reference] if start <= reference < end else []
+
+    occurrences = rruleset.xafter(start, inc=True)
+    expanded = []
+    for occurrence in islice(occurrences, limit):
+        if occurrence >= end:
+            break
+        expanded.append(occurrence)
+    else:
+        if len(expanded) == limit:
+            log.debug(
+                f"Stopped expanding {event.getChildValue('uid')} after {limit} "
+                "occurrences."
+            )
+    return expanded
@@ -1,20 +1,65 @@
 import logging
 from contextlib import contextmanager
-from time import sleep
-from typing import Mapping
+from time import monotonic, perf_counter, sleep
+from typing import Callable, Dict, Mapping, Optional, Tuple, Type, TypeVar
+from urllib.parse import urlsplit
 
+import requests
 from selenium import webdriver
-from selenium.common.exceptions import NoSuchElementException
+from selenium.common.exceptions import NoSuchElementException, TimeoutException
 from selenium.webdriver import ActionChains
 from selenium.webdriver.common.by import By
 from selenium.webdriver.firefox.options import Options
-from selenium.webdriver.support import expected_conditions
-from selenium.webdriver.support.wait import WebDriverWait
+from selenium.webdriver.remote.webelement import WebElement
 
-from fifty_cal.exceptions import UnableToLogoutException
+from fifty_cal.exceptions import ConfigurationException, UnableToLogoutException
 
 log = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+LOGOUT_MODES = ("ui", "http")
+
+# Read the name and element ID of every calendar in the calendar list.
+CALENDAR_MAP_SCRIPT = """
+return Array.from(
+    document.querySelectorAll("#calendarslist li .calname"),
+    calendar => [calendar.innerText, calendar.id]
+);
+"""
+
+
+def wait_until(
+    condition: Callable[[], T],
+    timeout: float,
+    initial_delay: float = 0.1,
+    max_delay: float = 5.0,
+    ignored: Tuple[Type[Exception], ...] = (NoSuchElementException,),
+) -> T:
+    """
+    Call `condition` until it returns a truthy value and return that value.
+
+    The delay between attempts starts at `initial_delay` and doubles after each
+    failed attempt up to `max_delay`, so conditions that are met quickly are noticed
+    quickly without polling a slow page too often. Any `ignored` exceptions raised by
+    `condition` count as a failed attempt. `TimeoutException` is raised if the
+    condition hasn't been met after `timeout` seconds.
+    """
+    deadline = monotonic() + timeout
+    delay = initial_delay
+    while True:
+        try:
+            result = condition()
+            if result:
+                return result
+        except ignored:
+            pass
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            raise TimeoutException(f"Condition not met after {timeout} seconds.")
+        sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+
 
 class Session:
     """
@@ -23,33 +68,93 @@ class Session:
     Uses selenium with the Firefox driver in headless mode. This is so that session
     and auth cookies can be retrieved by interacting with the relevant JavaScript on
     the login page that cannot be done using a simple http request.
+
+    The browser is only started the first time it is needed. If `timings` is passed
+    in, the seconds taken to start the browser and to log in are recorded in it.
+
+    Pages are waited on with `wait_until` for at most `login_timeout` seconds while
+    logging in and `logout_timeout` seconds while logging out. With a `logout_mode`
+    of `"http"` the browser is closed as soon as the cookies have been collected and
+    the session is logged out with a plain http request instead.
     """
 
-    LOGOUT_RETRY_MAX_SECONDS: int = 120
+    LOGIN_URL: str = "https://webmail.names.co.uk/"
+    LOGIN_TIMEOUT_SECONDS: float = 60
+    LOGOUT_RETRY_MAX_SECONDS: float = 120
 
-    def __init__(self):
+    def __init__(
+        self,
+        timings: Optional[Dict[str, float]] = None,
+        login_timeout: float = LOGIN_TIMEOUT_SECONDS,
+        logout_timeout: float = LOGOUT_RETRY_MAX_SECONDS,
+        logout_mode: str = "ui",
+    ):
+        if logout_mode not in LOGOUT_MODES:
+            raise ConfigurationException(
+                f"logout_mode must be one of: {', '.join(LOGOUT_MODES)}."
+            )
         self.logged_in = False
+        self.cookies_expire: Optional[float] = None
+        self.timings = timings if timings is not None else {}
+        self.login_timeout = login_timeout
+        self.logout_timeout = logout_timeout
+        self.logout_mode = logout_mode
+        self._driver = None
+
+    @property
+    def driver(self) -> webdriver.Firefox:
+        """
+        The browser, started on first use.
+        """
+        if self._driver is None:
+            self.start_browser()
+        return self._driver
 
+    @driver.setter
+    def driver(self, driver: webdriver.Firefox):
+        self._driver = driver
+
+    def start_browser(self):
+        """
+        Start headless Firefox.
+        """
+        start = perf_counter()
         options = Options()
         options.headless = True
-        self.driver = webdriver.Firefox(options=options)
-        self.driver.service.log_file = None
-        self.wait = WebDriverWait(self.driver, 60)
+        self._driver = webdriver.Firefox(options=options)
+        self._driver.service.log_file = None
+        self.timings["browser"] = perf_counter() - start
+        log.debug("Browser Started")
 
-    @contextmanager
-    def start_session(self, username: str, password: str) -> Mapping[str, str]:
+    def quit(self):
         """
-        Log in and get session and auth cookies.
+        Close the browser if it has been started.
+        """
+        if self._driver is not None:
+            self._driver.quit()
+            self._driver = None
 
-        Implemented as a Context Manager which will log in to a namesco email account
-        and yield the relevant cookies. Upon exiting scope, the user will be logged
-        out of the session.
+    def wait_for_element(
+        self, by: str, value: str, timeout: Optional[float] = None
+    ) -> WebElement:
         """
-        log.debug("Browser Started")
-        self.driver.get("http://webmail.names.co.uk/")
+        Wait for an element to appear on the page and return it.
+
+        Waits for up to `login_timeout` seconds unless `timeout` is given.
+        """
+        if timeout is None:
+            timeout = self.login_timeout
+        return wait_until(lambda: self.driver.find_element(by, value), timeout)
+
+    def login(self, username: str, password: str) -> Dict[str, str]:
+        """
+        Log in through the browser, open the calendar and return the session cookies.
+        """
+        self.driver.get(self.LOGIN_URL)
         log.debug("Logging in.")
+        login_start = perf_counter()
 
-        username_field = self.driver.find_element_by_id("rcmloginuser")
+        username_field = self.wait_for_element(By.ID, "rcmloginuser")
         password_field = self.driver.find_element_by_id("rcmloginpwd")
         login_button = self.driver.find_element_by_id("rcmloginsubmit")
 
@@ -60,65 +165,150 @@ class Session:
         actions.perform()
 
         cookies = self.driver.get_cookies()
+        expiry_times = [cookie["expiry"] for cookie in cookies if "expiry" in cookie]
+        self.cookies_expire = min(expiry_times) if expiry_times else None
         self.logged_in = True
-        self.wait.until(
-            expected_conditions.presence_of_element_located((By.ID, "rcmbtn110"))
-        )
-        calendar_button = self.driver.find_element_by_id("rcmbtn110")
-        # For some reason we have to click twice.
-        actions.click(calendar_button)
-        actions.click(calendar_button)
-        actions.perform()
+        self.open_calendar()
 
-        self.get_calendar_map()
-        yield {cookie["name"]: cookie["value"] for cookie in cookies}
-        log.debug("Session exited. Logging out.")
-        self.logout()
-        self.driver.quit()
+        self.timings["login"] = perf_counter() - login_start
+        return {cookie["name"]: cookie["value"] for cookie in cookies}
 
-    def get_calendar_map(self):
+    @contextmanager
+    def start_session(
+        self, username: str, password: str, logout: bool = True
+    ) -> Mapping[str, str]:
         """
-        Get a mapping of calendar name to the calendar ID.
+        Log in and get session and auth cookies.
+
+        Implemented as a Context Manager which will log in to a namesco email account
+        and yield the relevant cookies. Upon exiting scope, the user will be logged
+        out of the session unless `logout` is `False`, in which case the browser is
+        closed before the cookies are yielded and they remain valid after. The
+        earliest expiry time of the cookies, if they have one, is stored in
+        `cookies_expire`. If logging in fails, the browser is closed before the
+        exception is raised.
         """
-        self.wait.until(
-            expected_conditions.presence_of_element_located((By.ID, "calendarslist"))
-        )
+        try:
+            cookies = self.login(username, password)
+        except BaseException:
+            # Don't leave the browser running if the login fails or times out.
+            self.quit()
+            raise
 
-        cal_map = {}
+        if not logout:
+            # The session is left logged in so nothing more is needed from the browser.
+            self.quit()
+            try:
+                yield cookies
+            finally:
+                log.debug("Session exited. Leaving session logged in for reuse.")
+            return
 
-        calendar_list = self.driver.find_element(By.ID, "calendarslist")
-        calendars = calendar_list.find_elements(By.TAG_NAME, "li")
-        for calendar in calendars:
-            cal_attributes = calendar.find_element(By.CLASS_NAME, "calname")
-            cal_map[cal_attributes.text] = cal_attributes.get_attribute("id")[3:]
+        if self.logout_mode == "http":
+            # Everything needed to log out is in hand so the browser can go now.
+            try:
+                token = self.driver.execute_script("return rcmail.env.request_token;")
+                url = urlsplit(self.driver.current_url)
+            finally:
+                self.quit()
+            logout_url = f"{url.scheme}://{url.netloc}{url.path}"
+            try:
+                yield cookies
+            finally:
+                log.debug("Session exited. Logging out over http.")
+                self.logout_over_http(cookies, token, logout_url)
+            return
 
-        return cal_map
+        try:
+            yield cookies
+        finally:
+            try:
+                log.debug("Session exited. Logging out.")
+                self.logout()
+            finally:
+                self.quit()
+
+    def open_calendar(self):
+        """
+        Navigate from the inbox to the calendar.
+
+        The first click on the calendar button is sometimes ignored while the inbox
+        is still loading, so it is clicked again each time the calendar list is
+        found not to have appeared yet.
+        """
+        calendar_button = self.wait_for_element(By.ID, "rcmbtn110")
+        calendar_button.click()
+
+        def calendar_list_loaded() -> WebElement:
+            try:
+                return self.driver.find_element(By.ID, "calendarslist")
+            except NoSuchElementException:
+                calendar_button.click()
+                raise
+
+        wait_until(calendar_list_loaded, self.login_timeout, initial_delay=0.5)
+
+    def get_calendar_map(self) -> Dict[str, str]:
+        """
+        Get a mapping of calendar name to the calendar ID.
+
+        The calendar list is read with a single script rather than looking up each
+        calendar in it separately, which would take several round trips to the
+        browser per calendar.
+        """
+        self.wait_for_element(By.ID, "calendarslist")
+
+        calendars = self.driver.execute_script(CALENDAR_MAP_SCRIPT)
+
+        return {name: calendar_id[3:] for name, calendar_id in calendars}
 
     def logout(self):
         """
         Log out of the current session.
 
-        Sometimes the session can exit before the page has had a chance to load,
-        causing a `NoSuchElementException` to be raised. If this happens,
-        wait 5 seconds for the page to load and try again up to a maximum of 2 minutes.
+        Sometimes the session can exit before the page has had a chance to load, so
+        wait for up to `logout_timeout` seconds for the logout button to appear.
+        """
+        try:
+            logout_button = wait_until(
+                lambda: self.driver.find_element_by_class_name("button-logout"),
+                self.logout_timeout,
+            )
+        except TimeoutException:
+            log.exception("Unable to log out of current session.")
+            raise UnableToLogoutException
+
+        logout_button.click()
+        self.logged_in = False
+        log.debug("Successfully logged out.")
+
+    def logout_over_http(
+        self, cookies: Mapping[str, str], token: str, url: str = LOGIN_URL
+    ):
+        """
+        Log out of the session identified by `cookies` without using the browser.
 
-        # TODO: Change this to use the `wait_until` method.
+        `token` is the request token roundcube requires to accept the logout. The
+        logout is sent to `url`, the page the browser ended up on after logging in.
+        The cookies are only ever sent over https, as anyone who sees them can use
+        the session.
         """
-        elapsed_seconds = 0
-        while self.logged_in and elapsed_seconds <= self.LOGOUT_RETRY_MAX_SECONDS:
-            try:
-                self.driver.find_element_by_class_name("button-logout").click()
-                self.logged_in = False
-            except NoSuchElementException:
-                log.exception(
-                    "Logout button not loaded on page. Will Retry in 5 seconds."
-                )
-                sleep(5)
-                elapsed_seconds += 5
-                log.debug("Retrying.")
-
-        if self.logged_in:
+        if urlsplit(url).scheme != "https":
+            log.error(f"Refusing to send session cookies to {url} without https.")
+            raise UnableToLogoutException
+        try:
+            response = requests.get(
+                url,
+                params={"_task": "logout", "_token": token},
+                cookies=cookies,
+                timeout=self.logout_timeout,
+            )
+        except requests.RequestException:
             log.exception("Unable to log out of current session.")
             raise UnableToLogoutException
+        if response.status_code >= 400:
+            log.error(f"Logout request failed with status {response.status_code}.")
+            raise UnableToLogoutException
 
+        self.logged_in = False
         log.debug("Successfully logged out.")
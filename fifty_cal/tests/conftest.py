@@ -0,0 +1,47 @@
+import shutil
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from fifty_cal.local import get_local_records
+
+
+@pytest.fixture
+def read_resource(tmp_path):
+    """
+    Read one of the test calendars as records.
+
+    The calendar is copied somewhere temporary first, so that its records cache
+    isn't written next to the test resources.
+    """
+
+    def read(file_name: str):
+        file_path = tmp_path / file_name
+        if not file_path.exists():
+            shutil.copy(f"fifty_cal/tests/resources/{file_name}", file_path)
+        return get_local_records(str(file_path))
+
+    return read
+
+
+@pytest.fixture
+def stub_server(request):
+    """
+    Run a stub HTTP server for the duration of a test and yield it.
+
+    The request handler class to serve with is passed by parametrizing the fixture
+    indirectly. Handlers can record what they were sent in the server's `requests`
+    list, and the server's URL is in `url`.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), request.param)
+    server.requests = []
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+    )
+    thread.start()
+    host, port = server.server_address
+    server.url = f"http://{host}:{port}/"
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,67 @@
+import os
+import stat
+import time
+from tempfile import TemporaryDirectory
+
+from fifty_cal.cache import CalendarMapCache, CookieCache, FeedCache
+
+
+def test_feed_cache_saved_and_loaded():
+    """
+    Validators stored in the cache are available after saving and reloading.
+    """
+    with TemporaryDirectory() as cache_path:
+        cache = FeedCache(cache_path)
+        cache.update("AB1234", '"etag"', "Mon, 01 Mar 2021", "hash")
+        cache.save()
+
+        assert FeedCache(cache_path).get("AB1234") == {
+            "etag": '"etag"',
+            "last_modified": "Mon, 01 Mar 2021",
+            "body_hash": "hash",
+        }
+
+
+def test_unreadable_feed_cache_ignored():
+    """
+    A damaged cache file is treated as an empty cache.
+    """
+    with TemporaryDirectory() as cache_path:
+        with open(f"{cache_path}/{FeedCache.FILE_NAME}", "w") as cache_file:
+            cache_file.write("{not json")
+
+        assert FeedCache(cache_path).get("AB1234") is None
+
+
+def test_cookie_cache_only_readable_by_user():
+    """
+    Stored cookies can only be read by the current user.
+    """
+    with TemporaryDirectory() as cache_path:
+        cache = CookieCache(cache_path)
+        cache.save({"roundcube_sessid": "1234"}, time.time() + 60)
+
+        assert stat.S_IMODE(os.stat(cache.path).st_mode) == 0o600
+        assert cache.load() == {"roundcube_sessid": "1234"}
+
+
+def test_expired_cookies_not_loaded():
+    """
+    Cookies are not returned once they have expired.
+    """
+    with TemporaryDirectory() as cache_path:
+        cache = CookieCache(cache_path)
+        cache.save({"roundcube_sessid": "1234"}, time.time() - 1)
+
+        assert cache.load() is None
+
+
+def test_calendar_map_cache_saved_and_loaded():
+    """
+    A stored calendar mapping is available until it is too old.
+    """
+    with TemporaryDirectory() as cache_path:
+        CalendarMapCache(cache_path).save({"Person 1": "AB1234"})
+
+        assert CalendarMapCache(cache_path).load() == {"Person 1": "AB1234"}
+        assert CalendarMapCache(cache_path, max_age=0).load() is None
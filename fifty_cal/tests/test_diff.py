@@ -4,7 +4,9 @@ import pytest
 from vobject import readOne
 from vobject.base import Component
 
-from fifty_cal.diff import CalendarDiff
+from fifty_cal import diff
+from fifty_cal.diff import CalendarDiff, get_fingerprint
+from fifty_cal.records import read_records
 
 
 @pytest.fixture
@@ -117,3 +119,151 @@ def test_events_are_recognised_as_the_same_after_sequence_is_removed(downloaded_
     expected_attributes = ["uid", "DTSTART", "DTEND"]
     assert list(cal_diff.diff[0][0].contents.keys()) == expected_attributes
     assert list(cal_diff.diff[0][1].contents.keys()) == expected_attributes
+
+
+def test_events_only_in_second_calendar_are_reported(
+    local_cal: Component, downloaded_cal: Component
+):
+    """
+    Every event that only exists in the second calendar appears in the diff.
+
+    `vobject.ics_diff.diff` drops these when they sort after the last event in the
+    first calendar.
+    """
+    local_uids = {event.uid.value for event in local_cal.contents["vevent"]}
+    new_uids = {
+        event.uid.value
+        for event in downloaded_cal.contents["vevent"]
+        if event.uid.value not in local_uids
+    }
+
+    cal_diff = CalendarDiff(cal1=local_cal, cal2=downloaded_cal)
+    cal_diff.clean_calendars()
+    cal_diff.get_diff()
+
+    reported_uids = {pair[1].uid.value for pair in cal_diff.diff if pair[0] is None}
+
+    assert new_uids
+    assert reported_uids == new_uids
+
+
+def test_overridden_instances_are_matched_on_recurrence_id(local_cal: Component):
+    """
+    Events sharing a UID are matched using their `RECURRENCE-ID`.
+
+    Overriding a single instance of a recurring event adds a new VEVENT with the same
+    UID. Only the override should appear in the diff.
+    """
+    updated = Component.duplicate(local_cal)
+    override = Component.duplicate(updated.contents["vevent"][0])
+    override.add("recurrence-id").value = dt.datetime(2021, 1, 1, 9)
+    updated.add(override)
+
+    cal_diff = CalendarDiff(cal1=local_cal, cal2=updated)
+    cal_diff.clean_calendars()
+    cal_diff.get_diff()
+
+    assert len(cal_diff.diff) == 1
+    assert cal_diff.diff[0][0] is None
+    assert cal_diff.diff[0][1].recurrence_id.value == dt.datetime(2021, 1, 1, 9)
+
+
+def test_duplicate_events_are_matched_in_order(local_cal: Component):
+    """
+    A copy of an event that only exists on one side is reported as missing.
+    """
+    updated = Component.duplicate(local_cal)
+    updated.add(Component.duplicate(updated.contents["vevent"][0]))
+
+    cal_diff = CalendarDiff(cal1=local_cal, cal2=updated)
+    cal_diff.clean_calendars()
+    cal_diff.get_diff()
+
+    assert len(cal_diff.diff) == 1
+    assert cal_diff.diff[0][0] is None
+    assert cal_diff.diff[0][1].uid.value == local_cal.contents["vevent"][0].uid.value
+
+
+def test_fingerprint_ignores_sequence(downloaded_cal: Component):
+    """
+    Events that only differ by their `SEQUENCE` have the same fingerprint.
+    """
+    event = downloaded_cal.contents["vevent"][0]
+    updated = Component.duplicate(event)
+    updated.sequence.value = str(int(event.sequence.value) + 1)
+
+    assert get_fingerprint(event) == get_fingerprint(updated)
+
+
+def test_fingerprint_changes_when_event_modified(downloaded_cal: Component):
+    """
+    Modifying an event changes its fingerprint.
+    """
+    event = downloaded_cal.contents["vevent"][0]
+    updated = Component.duplicate(event)
+    updated.summary.value = "Updated Summary"
+
+    assert get_fingerprint(event) != get_fingerprint(updated)
+
+
+def test_matching_fingerprints_skip_comparison(mocker):
+    """
+    Event records with matching fingerprints are not compared property by property.
+    """
+    diff_pair = mocker.patch("fifty_cal.diff.diff_pair")
+    with open("fifty_cal/tests/resources/dummy_local.ics") as calendar:
+        lines = calendar.read().splitlines()
+
+    cal_diff = CalendarDiff(cal1=read_records(lines), cal2=read_records(lines))
+    cal_diff.clean_calendars()
+    cal_diff.get_diff()
+
+    assert cal_diff.diff == []
+    diff_pair.assert_not_called()
+
+
+def test_vobject_events_compared_without_fingerprints(local_cal: Component, mocker):
+    """
+    Parsed events are compared straight away, as fingerprinting them costs more.
+    """
+    fingerprint_lines = mocker.spy(diff, "_fingerprint_lines")
+
+    cal_diff = CalendarDiff(cal1=local_cal, cal2=Component.duplicate(local_cal))
+    cal_diff.clean_calendars()
+    cal_diff.get_diff()
+
+    assert cal_diff.diff == []
+    fingerprint_lines.assert_not_called()
+
+
+def test_clean_calendars_does_not_copy_events(downloaded_cal: Component, mocker):
+    """
+    Cleaning calendars creates views of the original events rather than copies.
+    """
+    duplicate = mocker.spy(Component, "duplicate")
+
+    cal_diff = CalendarDiff(cal1=downloaded_cal, cal2=downloaded_cal)
+    cal_diff.clean_calendars()
+
+    duplicate.assert_not_called()
+    for view, event in zip(
+        cal_diff.cal1_cleaned.contents["vevent"], downloaded_cal.contents["vevent"]
+    ):
+        assert view.component is event
+        assert view.getChildValue("sequence") is None
+        assert view.uid.value == event.uid.value
+
+
+def test_original_events_returned_in_diff(local_cal: Component, downloaded_cal):
+    """
+    Events that only exist in one calendar are returned as the original event.
+    """
+    cal_diff = CalendarDiff(cal1=local_cal, cal2=downloaded_cal)
+    cal_diff.clean_calendars()
+    cal_diff.get_diff()
+
+    new_events = [pair[1] for pair in cal_diff.diff if pair[0] is None]
+
+    assert new_events
+    for event in new_events:
+        assert any(event is original for original in downloaded_cal.vevent_list)
@@ -1,6 +1,20 @@
+import gzip
+import io
+import json
+from http.server import BaseHTTPRequestHandler
+
 import pytest
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
 
-from fifty_cal.downloader import get_calendar, get_requests_session
+from fifty_cal.downloader import (
+    check_session,
+    fetch_calendar,
+    get_calendar_map,
+    get_requests_session,
+    parse_calendar_map,
+)
 from fifty_cal.exceptions import (
     HttpErrorException,
     NotFoundException,
@@ -24,16 +38,18 @@ def test_get_called_on_correct_calendar_url(mocker):
     """
     Test that the http GET request is sent to the correct calendar URL.
     """
-    mocker.patch("fifty_cal.downloader.readOne")
     calendar_hash = "foo"
 
     session = mocker.MagicMock()
     request = mocker.MagicMock()
     request.status_code = 200
+    request.content = b"BEGIN:VCALENDAR\r\nEND:VCALENDAR\r\n"
 
     session.get.return_value = request
 
-    get_calendar(calendar_hash=calendar_hash, session=session, calendar_url='test_url')
+    fetch_calendar(
+        calendar_hash=calendar_hash, session=session, calendar_url="test_url"
+    )
 
     assert session.get.call_args[0][0] == "test_urlfoo.ics&_action=feed"
 
@@ -58,4 +74,289 @@ def test_exceptions_thrown_on_non_200_response_codes(mocker, status_code, except
     session.get.return_value = request
 
     with pytest.raises(exception):
-        get_calendar(calendar_hash="", session=session, calendar_url="test_url")
+        fetch_calendar(calendar_hash="", session=session, calendar_url="test_url")
+
+
+@pytest.fixture
+def feed_session(mocker):
+    """
+    Mock a session that returns a calendar feed with validators.
+    """
+    session = mocker.MagicMock()
+    response = mocker.MagicMock()
+    response.status_code = 200
+    response.content = b"BEGIN:VCALENDAR"
+    response.headers = {"ETag": '"1234"', "Last-Modified": "Mon, 01 Mar 2021"}
+    session.get.return_value = response
+    return session
+
+
+def test_fetch_calendar_sends_conditional_headers(feed_session):
+    """
+    Cached validators are sent as conditional request headers.
+    """
+    validators = {"etag": '"1234"', "last_modified": "Mon, 01 Mar 2021"}
+
+    fetch_calendar("foo", feed_session, "test_url", validators)
+
+    assert feed_session.get.call_args[1]["headers"] == {
+        "If-None-Match": '"1234"',
+        "If-Modified-Since": "Mon, 01 Mar 2021",
+    }
+
+
+def test_fetch_calendar_returns_feed_with_validators(feed_session):
+    """
+    A modified feed is returned with the validators needed to cache it.
+    """
+    feed = fetch_calendar("foo", feed_session, "test_url")
+
+    assert feed.content == b"BEGIN:VCALENDAR"
+    assert feed.etag == '"1234"'
+    assert feed.last_modified == "Mon, 01 Mar 2021"
+    assert feed.body_hash
+
+
+def test_fetch_calendar_returns_none_when_not_modified(feed_session):
+    """
+    Nothing is returned when the server responds with a 304.
+    """
+    feed_session.get.return_value.status_code = 304
+
+    assert fetch_calendar("foo", feed_session, "test_url", {"etag": '"1"'}) is None
+
+
+def test_fetch_calendar_returns_none_when_body_unchanged(feed_session):
+    """
+    Nothing is returned when the body is identical to the last download.
+    """
+    body_hash = fetch_calendar("foo", feed_session, "test_url").body_hash
+
+    assert (
+        fetch_calendar("foo", feed_session, "test_url", {"body_hash": body_hash})
+        is None
+    )
+
+
+@pytest.mark.parametrize(
+    "status_code, text, valid",
+    [
+        (200, "<div id='calendarslist'></div>", True),
+        (200, "<input name='_user' id='rcmloginuser'>", False),
+        (302, "", False),
+    ],
+)
+def test_check_session(mocker, status_code, text, valid):
+    """
+    Sessions are only valid when the calendar page loads without a login form.
+    """
+    session = mocker.MagicMock()
+    session.get.return_value.status_code = status_code
+    session.get.return_value.text = text
+
+    assert check_session(session, "test_url") is valid
+
+
+CALENDAR_PAGE = """
+<script>
+rcmail.set_env({"task":"calendar","calendars":{
+"1":{"id":"1","name":"Person 1","feedurl":"./?_task=calendar&_cal=AB1234.ics&_action=feed"},
+"2":{"id":"2","name":"Person 2"}
+}});
+</script>
+"""
+
+
+def test_parse_calendar_map():
+    """
+    Calendars are mapped to the hash in their feed URL, or their ID if they have no
+    feed URL.
+    """
+    assert parse_calendar_map(CALENDAR_PAGE) == {"Person 1": "AB1234", "Person 2": "2"}
+
+
+@pytest.mark.parametrize("name", ["../person_1", "people/person_1", ".."])
+def test_parse_calendar_map_skips_unsafe_names(name):
+    """
+    Calendars whose names would be saved outside the output directory are skipped.
+    """
+    page = CALENDAR_PAGE.replace('"name":"Person 1"', f'"name":{json.dumps(name)}')
+
+    assert parse_calendar_map(page) == {"Person 2": "2"}
+
+
+def test_parse_calendar_map_without_calendars():
+    """
+    A page without any calendars gives an empty mapping.
+    """
+    assert parse_calendar_map("<p>No calendars here</p>") == {}
+
+
+def test_get_calendar_map(mocker):
+    """
+    The calendar page is requested once and the calendars found on it returned.
+    """
+    session = mocker.MagicMock()
+    session.get.return_value.status_code = 200
+    session.get.return_value.text = CALENDAR_PAGE
+
+    assert get_calendar_map(session, "test_url") == {
+        "Person 1": "AB1234",
+        "Person 2": "2",
+    }
+    session.get.assert_called_once_with("test_url")
+
+
+def test_get_calendar_map_raises_on_error(mocker):
+    """
+    Unsuccessful requests for the calendar page raise the relevant exception.
+    """
+    session = mocker.MagicMock()
+    session.get.return_value.status_code = 403
+
+    with pytest.raises(UnauthorizedException):
+        get_calendar_map(session, "test_url")
+
+
+def test_fetch_calendar_measures_bytes_received(mocker):
+    """
+    The bytes received are those sent over the connection, before decompressing.
+    """
+    body = gzip.compress(b"BEGIN:VCALENDAR\r\n" * 100)
+    raw = urllib3.HTTPResponse(
+        body=io.BytesIO(body),
+        headers={"Content-Encoding": "gzip"},
+        status=200,
+        preload_content=False,
+    )
+    session = mocker.MagicMock()
+    session.get.return_value = HTTPAdapter().build_response(
+        requests.PreparedRequest(), raw
+    )
+    metrics = {}
+
+    feed = fetch_calendar("foo", session, "test_url", metrics=metrics)
+
+    assert len(feed.content) == 1700
+    assert metrics["bytes"] == len(body)
+
+
+class FlakyFeed(BaseHTTPRequestHandler):
+    """
+    A feed that fails with a server error before it succeeds.
+
+    Fails with `failure_status` as many times as the `failures` set on the server.
+    """
+
+    protocol_version = "HTTP/1.1"
+    failure_status = 500
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self):
+        self.server.requests.append((self.client_address, dict(self.headers)))
+        if self.server.failures:
+            self.server.failures -= 1
+            status, body = self.failure_status, b"Server Error"
+        else:
+            status, body = 200, gzip.compress(b"BEGIN:VCALENDAR\r\nEND:VCALENDAR\r\n")
+        self.send_response(status)
+        if status == 200:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.respond()
+
+
+serve_flaky_feed = pytest.mark.parametrize("stub_server", [FlakyFeed], indirect=True)
+
+
+def get_calendar_url(server) -> str:
+    """
+    Get the URL of the calendar feed served by a stub server.
+    """
+    return f"{server.url}?_task=calendar&_cal="
+
+
+@serve_flaky_feed
+def test_server_errors_retried(stub_server):
+    """
+    A feed request that fails with a server error is retried over the same
+    connection, and the feed is negotiated with gzip encoding.
+    """
+    calendar_url = get_calendar_url(stub_server)
+    stub_server.failures = 2
+    session = get_requests_session({}, retries=2, backoff_factor=0)
+
+    feed = fetch_calendar("foo", session, calendar_url)
+
+    assert feed.content == b"BEGIN:VCALENDAR\r\nEND:VCALENDAR\r\n"
+    assert len(stub_server.requests) == 3
+    assert len({client for client, _ in stub_server.requests}) == 1
+    assert "gzip" in stub_server.requests[0][1]["Accept-Encoding"]
+
+
+@serve_flaky_feed
+def test_server_error_raised_once_retries_run_out(stub_server):
+    """
+    The last server error is raised as usual once every retry has failed.
+    """
+    calendar_url = get_calendar_url(stub_server)
+    stub_server.failures = 3
+    session = get_requests_session({}, retries=2, backoff_factor=0)
+
+    with pytest.raises(ServerErrorException):
+        fetch_calendar("foo", session, calendar_url)
+
+    assert len(stub_server.requests) == 3
+
+
+@serve_flaky_feed
+def test_unavailable_server_raised_once_retries_run_out(stub_server, mocker):
+    """
+    Every status code that is retried is raised as a server error once the retries
+    have run out.
+    """
+    mocker.patch.object(FlakyFeed, "failure_status", 503)
+    stub_server.failures = 3
+    session = get_requests_session({}, retries=2, backoff_factor=0)
+
+    with pytest.raises(ServerErrorException):
+        fetch_calendar("foo", session, get_calendar_url(stub_server))
+
+    assert len(stub_server.requests) == 3
+
+
+@serve_flaky_feed
+def test_uploads_not_retried(stub_server):
+    """
+    Requests that could change the calendar aren't retried.
+    """
+    calendar_url = get_calendar_url(stub_server)
+    stub_server.failures = 1
+    session = get_requests_session({}, backoff_factor=0)
+
+    response = session.post(calendar_url, data={"_data": "BEGIN:VCALENDAR"})
+
+    assert response.status_code == 500
+    assert len(stub_server.requests) == 1
+
+
+def test_connections_pooled_up_to_pool_size():
+    """
+    The session keeps up to `pool_size` connections alive to each host.
+    """
+    session = get_requests_session({}, pool_size=16)
+
+    adapter = session.get_adapter("https://webmail.names.co.uk/")
+
+    assert adapter._pool_maxsize == 16
+    assert adapter.max_retries.status_forcelist == (500, 502, 503, 504)
@@ -0,0 +1,239 @@
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from fifty_cal.exceptions import (
+    ConfigurationException,
+    DownloadFailedException,
+    InvalidCredentialsException,
+    LoginFailedException,
+    UnableToLogoutException,
+)
+from fifty_cal.http_session import HttpSession
+
+USERNAME = "user@example.com"
+PASSWORD = "allYourBase"
+
+LOGIN_PAGE = """
+<form name="login-form" method="post" action="./?_task=login">
+<input type="hidden" name="_token" value="{token}">
+<input name="_user" id="rcmloginuser"><input name="_pass" id="rcmloginpwd">
+</form>
+"""
+MAIL_PAGE = '<script>rcmail.set_env({{"task":"mail","request_token":"{token}"}});'
+
+
+class RoundcubeStub(BaseHTTPRequestHandler):
+    """
+    Just enough of roundcube's login and logout to test `HttpSession` against.
+    """
+
+    login_token = "login-token"
+    request_token = "request-token"
+    login_page = LOGIN_PAGE
+
+    def log_message(self, *args):
+        pass
+
+    def send_page(self, status, body, cookies=()):
+        self.send_response(status)
+        for cookie in cookies:
+            self.send_header("Set-Cookie", cookie)
+        self.send_header("Content-Type", "text/html")
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def do_GET(self):
+        if self.path == "/moved/":
+            self.send_response(301)
+            self.send_header("Location", "/")
+            self.end_headers()
+            return
+        query = parse_qs(urlparse(self.path).query)
+        task = query.get("_task", [""])[0]
+        self.server.requests.append((task, query, self.headers.get("Cookie")))
+        if task == "mail":
+            self.send_page(200, MAIL_PAGE.format(token=self.request_token))
+        elif task == "logout":
+            if query.get("_token") == [self.request_token]:
+                self.send_page(200, "Logged out")
+            else:
+                self.send_page(403, "Invalid request token")
+        else:
+            page = self.login_page.format(token=self.login_token)
+            self.send_page(200, page, cookies=["roundcube_sessid=abc; Path=/"])
+
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        form = parse_qs(self.rfile.read(length).decode())
+        self.server.requests.append(("login", form, self.headers.get("Cookie")))
+        if urlparse(self.path).path != "/":
+            self.send_page(404, "Not found")
+        elif form.get("_token") != [self.login_token]:
+            self.send_page(400, "Invalid request")
+        elif form.get("_user") != [USERNAME] or form.get("_pass") != [PASSWORD]:
+            self.send_page(401, self.login_page.format(token=self.login_token))
+        else:
+            self.send_response(302)
+            self.send_header("Set-Cookie", "roundcube_sessauth=def; Path=/")
+            self.send_header("Location", "/?_task=mail")
+            self.end_headers()
+
+
+serve_roundcube = pytest.mark.parametrize("stub_server", [RoundcubeStub], indirect=True)
+
+
+@pytest.fixture
+def session(stub_server):
+    return HttpSession(login_url=stub_server.url, allow_insecure=True)
+
+
+@serve_roundcube
+def test_start_session_gets_session_cookies(session):
+    """
+    The session and auth cookies set by the login are yielded.
+    """
+    with session.start_session(USERNAME, PASSWORD) as cookies:
+        assert cookies == {"roundcube_sessid": "abc", "roundcube_sessauth": "def"}
+        assert session.logged_in
+
+
+@serve_roundcube
+def test_login_posts_form_with_token(session, stub_server):
+    """
+    The login form is posted with the token scraped from the login page.
+    """
+    session.login(USERNAME, PASSWORD)
+
+    tasks = [task for task, _, _ in stub_server.requests]
+    assert tasks == ["", "login", "mail"]
+    _, form, cookie = stub_server.requests[1]
+    assert form["_token"] == ["login-token"]
+    assert form["_action"] == ["login"]
+    assert cookie == "roundcube_sessid=abc"
+
+
+@serve_roundcube
+def test_login_posted_to_redirected_page(stub_server):
+    """
+    The login form is posted to the page the login page was redirected to, rather
+    than the redirect losing the form.
+    """
+    session = HttpSession(login_url=f"{stub_server.url}moved/", allow_insecure=True)
+
+    session.login(USERNAME, PASSWORD)
+
+    assert session.logged_in
+
+
+def test_login_without_https_refused():
+    """
+    Credentials are never sent to a login page without https.
+    """
+    with pytest.raises(ConfigurationException):
+        HttpSession(login_url="http://webmail.names.co.uk/")
+
+
+@serve_roundcube
+def test_start_session_logs_out_when_exiting(session, stub_server):
+    """
+    The session is logged out with the request token on exit.
+    """
+    with session.start_session(USERNAME, PASSWORD):
+        pass
+
+    task, query, _ = stub_server.requests[-1]
+    assert task == "logout"
+    assert query["_token"] == ["request-token"]
+    assert not session.logged_in
+
+
+@serve_roundcube
+def test_start_session_logs_out_when_download_fails(session, stub_server):
+    """
+    The session is still logged out if the code using it raises an exception.
+    """
+    with pytest.raises(DownloadFailedException):
+        with session.start_session(USERNAME, PASSWORD):
+            raise DownloadFailedException()
+
+    task, _, _ = stub_server.requests[-1]
+    assert task == "logout"
+    assert not session.logged_in
+
+
+@serve_roundcube
+def test_start_session_stays_logged_in_when_not_logging_out(session, stub_server):
+    """
+    The session is left open when `logout` is `False`.
+    """
+    with session.start_session(USERNAME, PASSWORD, logout=False):
+        pass
+
+    assert "logout" not in [task for task, _, _ in stub_server.requests]
+    assert session.logged_in
+
+
+@serve_roundcube
+def test_invalid_credentials_raise_error(session):
+    """
+    Rejected credentials raise `InvalidCredentialsException`.
+    """
+    with pytest.raises(InvalidCredentialsException):
+        session.login(USERNAME, "wrong")
+
+
+@serve_roundcube
+def test_invalid_credentials_not_retried_with_fallback(session, mocker):
+    """
+    The fallback isn't used when the credentials are wrong.
+    """
+    session.fallback = mocker.MagicMock()
+
+    with pytest.raises(InvalidCredentialsException):
+        with session.start_session(USERNAME, "wrong"):
+            pass
+
+    session.fallback.start_session.assert_not_called()
+
+
+@serve_roundcube
+def test_missing_token_raises_error(session, mocker):
+    """
+    `LoginFailedException` is raised if the login page has no token.
+    """
+    mocker.patch.object(RoundcubeStub, "login_page", "<p>Down for maintenance</p>")
+
+    with pytest.raises(LoginFailedException):
+        session.login(USERNAME, PASSWORD)
+
+
+@serve_roundcube
+def test_falls_back_when_login_form_changes(session, mocker):
+    """
+    The fallback session is used if the login form can't be submitted.
+    """
+    mocker.patch.object(RoundcubeStub, "login_page", "<p>Down for maintenance</p>")
+    fallback = mocker.MagicMock()
+    fallback.start_session.return_value.__enter__.return_value = {"from": "browser"}
+    fallback.cookies_expire = 1234
+    session.fallback = fallback
+
+    with session.start_session(USERNAME, PASSWORD, logout=False) as cookies:
+        assert cookies == {"from": "browser"}
+        assert session.cookies_expire == 1234
+
+    fallback.start_session.assert_called_once_with(USERNAME, PASSWORD, False)
+
+
+@serve_roundcube
+def test_failed_logout_raises_error(session, mocker):
+    """
+    `UnableToLogoutException` is raised if the logout is rejected.
+    """
+    session.login(USERNAME, PASSWORD)
+    session.request_token = "stale"
+
+    with pytest.raises(UnableToLogoutException):
+        session.logout()
@@ -1,15 +1,81 @@
+import json
+import os
+import pickle
+import shutil
+from tempfile import TemporaryDirectory
+
 from vobject import readOne
 
-from fifty_cal.local import get_local_calendar
+from fifty_cal.local import get_local_records, get_records_cache_path
 
 
-def test_local_calendar_events_loaded_as_expected():
+def test_local_records_hydrate_to_same_calendar(read_resource):
     """
-    Test that the events from the local calendar are loaded correctly.
+    A calendar read as records is the same as the parsed calendar once hydrated.
     """
-    loaded_cal = get_local_calendar("fifty_cal/tests/resources/test_calendar.ics")
+    records = read_resource("test_calendar.ics")
 
     with open("fifty_cal/tests/resources/test_calendar.ics") as local_test:
         expected = local_test.read()
 
-    assert str(loaded_cal) == str(readOne(expected))
+    assert str(records.to_component()) == str(readOne(expected))
+
+
+def test_local_records_loaded_from_cache(mocker):
+    """
+    A calendar that hasn't changed since it was last read is loaded from the cache.
+    """
+    with TemporaryDirectory() as output_path:
+        file_path = os.path.join(output_path, "person_1.ics")
+        shutil.copy("fifty_cal/tests/resources/test_calendar.ics", file_path)
+        expected = get_local_records(file_path)
+        read_records = mocker.patch("fifty_cal.local.read_records")
+
+        cached = get_local_records(file_path)
+
+        assert os.path.isfile(get_records_cache_path(file_path))
+    read_records.assert_not_called()
+    assert cached.serialize() == expected.serialize()
+    assert all(event._fingerprint for event in cached.contents["vevent"])
+
+
+def test_local_records_cache_ignored_when_file_changes():
+    """
+    The cache is replaced once the calendar file changes.
+    """
+    with TemporaryDirectory() as output_path:
+        file_path = os.path.join(output_path, "person_1.ics")
+        shutil.copy("fifty_cal/tests/resources/dummy_local.ics", file_path)
+        get_local_records(file_path)
+        shutil.copy("fifty_cal/tests/resources/dummy_downloaded.ics", file_path)
+
+        records = get_local_records(file_path)
+
+        with open(file_path) as calendar_file:
+            expected = calendar_file.read()
+    assert records.serialize().replace("\r\n", "\n") == expected.replace("\r\n", "\n")
+
+
+def test_local_records_cached_as_json():
+    """
+    The records cache is a compact JSON file that only the current user can read,
+    and a cache that isn't JSON, such as one left by an older version, is replaced.
+    """
+    with TemporaryDirectory() as output_path:
+        file_path = os.path.join(output_path, "person_1.ics")
+        shutil.copy("fifty_cal/tests/resources/dummy_local.ics", file_path)
+        cache_path = get_records_cache_path(file_path)
+        with open(cache_path, "wb") as cache_file:
+            pickle.dump({"version": 2}, cache_file)
+
+        records = get_local_records(file_path)
+
+        with open(cache_path) as cache_file:
+            content = cache_file.read()
+        mode = os.stat(cache_path).st_mode & 0o777
+    cached = json.loads(content)
+    assert mode == 0o600
+    assert "\n" not in content
+    assert len(cached["calendar"]["contents"]["vevent"]) == len(
+        records.contents["vevent"]
+    )
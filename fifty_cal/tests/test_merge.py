@@ -8,7 +8,7 @@ from vobject import readOne
 from vobject.base import Component, newFromBehavior
 
 from fifty_cal.diff import CalendarDiff
-from fifty_cal.merge import merge
+from fifty_cal.merge import build_sync_base, merge, merge_three_way
 
 
 @pytest.fixture
@@ -186,3 +186,217 @@ def test_new_and_updated_events_merged_correctly(
         merged.contents["vevent"][-1].contents
         == local_cal.contents["vevent"][-1].contents
     )
+
+
+def test_merge_does_not_modify_calendars(local_cal: Component, create_event: callable):
+    """
+    Merging shares events with the input calendars without modifying them.
+    """
+    cal_1 = Component.duplicate(local_cal)
+    cal_1.add(create_event({"SUMMARY": "Calendar 1 new event."}))
+    cal_2 = Component.duplicate(local_cal)
+    cal_2_events = list(cal_2.contents["vevent"])
+
+    merged = merge(CalendarDiff(cal_1, cal_2))
+
+    assert cal_2.contents["vevent"] == cal_2_events
+    assert len(merged.contents["vevent"]) == len(cal_2_events) + 1
+    assert merged.contents["vevent"][0] is cal_2_events[0]
+
+
+@pytest.mark.parametrize("modified_calendar", [0, 1])
+def test_superseded_event_replaced_in_place(local_cal: Component, modified_calendar):
+    """
+    The newer version of a conflicting event replaces the older one in place.
+
+    Only properties that differ appear in the diff, so the `LAST-MODIFIED` values of
+    the full events are compared.
+    """
+    modified = Component.duplicate(local_cal)
+    event = modified.contents["vevent"][0]
+    event.summary.value = "Updated Test"
+    event.last_modified.value += dt.timedelta(days=1)
+    event.dtstamp.value = event.last_modified.value
+
+    calendars = [local_cal, local_cal]
+    calendars[modified_calendar] = modified
+
+    merged = merge(CalendarDiff(*calendars))
+
+    uids = [event.uid.value for event in merged.contents["vevent"]]
+    assert uids == [event.uid.value for event in local_cal.contents["vevent"]]
+    assert merged.contents["vevent"][0] is event
+
+
+def test_older_version_in_calendar_1_is_ignored(local_cal: Component):
+    """
+    A conflicting event in calendar 1 that is older than calendar 2's is not used.
+    """
+    modified = Component.duplicate(local_cal)
+    event = modified.contents["vevent"][0]
+    event.summary.value = "Stale Test"
+    event.last_modified.value -= dt.timedelta(days=1)
+
+    merged = merge(CalendarDiff(modified, local_cal))
+
+    assert merged.contents["vevent"] == local_cal.contents["vevent"]
+
+
+def get_uids(calendar: Component) -> list:
+    """
+    Get the UIDs of the events in a calendar in order.
+    """
+    return [event.uid.value for event in calendar.contents["vevent"]]
+
+
+def test_three_way_merge_keeps_remote_deletion(local_cal: Component):
+    """
+    An event deleted from calendar 2 since the last sync stays deleted.
+    """
+    base = build_sync_base(local_cal)
+    cal_2 = Component.duplicate(local_cal)
+    deleted = cal_2.contents["vevent"].pop(0)
+
+    merged = merge_three_way(CalendarDiff(local_cal, cal_2), base)
+
+    assert deleted.uid.value not in get_uids(merged)
+    assert get_uids(merged) == get_uids(cal_2)
+
+
+def test_three_way_merge_keeps_local_deletion(local_cal: Component):
+    """
+    An event deleted from calendar 1 since the last sync is removed from calendar 2.
+    """
+    base = build_sync_base(local_cal)
+    cal_1 = Component.duplicate(local_cal)
+    deleted = cal_1.contents["vevent"].pop(0)
+
+    merged = merge_three_way(CalendarDiff(cal_1, local_cal), base)
+
+    assert deleted.uid.value not in get_uids(merged)
+    assert len(merged.contents["vevent"]) == len(local_cal.contents["vevent"]) - 1
+
+
+def test_three_way_merge_keeps_event_changed_after_deletion(local_cal: Component):
+    """
+    An event deleted from one calendar but changed in the other is kept.
+    """
+    base = build_sync_base(local_cal)
+    cal_1 = Component.duplicate(local_cal)
+    cal_1.contents["vevent"][0].summary.value = "Changed"
+    cal_2 = Component.duplicate(local_cal)
+    cal_2.contents["vevent"].pop(0)
+
+    merged = merge_three_way(CalendarDiff(cal_1, cal_2), base)
+
+    assert merged.contents["vevent"][-1] is cal_1.contents["vevent"][0]
+
+
+@pytest.mark.parametrize("changed_calendar", [0, 1])
+def test_three_way_merge_takes_change_from_either_side(
+    local_cal: Component, changed_calendar
+):
+    """
+    An event changed in only one calendar is taken from that calendar, however old
+    its `LAST-MODIFIED`.
+    """
+    base = build_sync_base(local_cal)
+    calendars = [Component.duplicate(local_cal), Component.duplicate(local_cal)]
+    event = calendars[changed_calendar].contents["vevent"][0]
+    event.summary.value = "Changed"
+    event.last_modified.value -= dt.timedelta(days=365)
+
+    merged = merge_three_way(CalendarDiff(*calendars), base)
+
+    assert merged.contents["vevent"][0] is event
+    assert get_uids(merged) == get_uids(local_cal)
+
+
+def test_three_way_merge_resolves_conflicts_by_last_modified(local_cal: Component):
+    """
+    An event changed in both calendars is resolved by taking the latest version.
+    """
+    base = build_sync_base(local_cal)
+    cal_1 = Component.duplicate(local_cal)
+    cal_2 = Component.duplicate(local_cal)
+    newer = cal_1.contents["vevent"][0]
+    newer.summary.value = "Newer"
+    newer.last_modified.value += dt.timedelta(days=2)
+    cal_2.contents["vevent"][0].summary.value = "Older"
+    cal_2.contents["vevent"][0].last_modified.value += dt.timedelta(days=1)
+
+    merged = merge_three_way(CalendarDiff(cal_1, cal_2), base)
+
+    assert merged.contents["vevent"][0] is newer
+
+
+def test_three_way_merge_adds_new_events(local_cal: Component, create_event):
+    """
+    Events added to either calendar since the last sync are both kept.
+    """
+    base = build_sync_base(local_cal)
+    cal_1 = Component.duplicate(local_cal)
+    cal_1_new_event = create_event({"SUMMARY": "Calendar 1 new event."})
+    cal_1.add(cal_1_new_event)
+    cal_2 = Component.duplicate(local_cal)
+    cal_2_new_event = create_event({"SUMMARY": "Calendar 2 new event."})
+    cal_2.add(cal_2_new_event)
+
+    merged = merge_three_way(CalendarDiff(cal_1, cal_2), base)
+
+    assert merged.contents["vevent"][-2] is cal_2_new_event
+    assert merged.contents["vevent"][-1] is cal_1_new_event
+
+
+def add_overrides(calendar: Component, count: int) -> Component:
+    """
+    Make the first event of a copy of the calendar recur daily and override the first
+    `count` instances.
+    """
+    calendar = Component.duplicate(calendar)
+    series = calendar.contents["vevent"][0]
+    series.add("rrule").value = "FREQ=DAILY"
+    for day in range(count):
+        override = Component.duplicate(series)
+        del override.contents["rrule"]
+        start = series.dtstart.value + dt.timedelta(days=day)
+        override.add("recurrence-id").value = start
+        override.summary.value = f"Instance {day}"
+        calendar.add(override)
+    return calendar
+
+
+def test_overridden_instances_merged_separately(local_cal: Component):
+    """
+    A newer override in calendar 1 replaces the same override in calendar 2, leaving
+    the recurring event and its other overrides alone.
+    """
+    cal_2 = add_overrides(local_cal, 3)
+    cal_1 = Component.duplicate(cal_2)
+    changed = cal_1.contents["vevent"][-1]
+    changed.summary.value = "Moved instance"
+    changed.last_modified.value += dt.timedelta(days=1)
+
+    merged = merge(CalendarDiff(cal_1, cal_2))
+
+    assert len(merged.contents["vevent"]) == len(cal_2.contents["vevent"])
+    assert merged.contents["vevent"][:-1] == cal_2.contents["vevent"][:-1]
+    assert merged.contents["vevent"][-1] is changed
+
+
+def test_three_way_merge_keeps_deleted_override(local_cal: Component):
+    """
+    Deleting one override of a recurring event only removes that override.
+    """
+    cal_1 = add_overrides(local_cal, 3)
+    base = build_sync_base(cal_1)
+    cal_2 = Component.duplicate(cal_1)
+    deleted = cal_2.contents["vevent"].pop()
+
+    merged = merge_three_way(CalendarDiff(cal_1, cal_2), base)
+
+    recurrence_ids = [
+        event.getChildValue("recurrence_id") for event in merged.contents["vevent"]
+    ]
+    assert len(merged.contents["vevent"]) == len(cal_1.contents["vevent"]) - 1
+    assert deleted.recurrence_id.value not in recurrence_ids
@@ -0,0 +1,88 @@
+import json
+import os
+from tempfile import TemporaryDirectory
+
+from fifty_cal.metrics import (
+    MetricsRecorder,
+    format_prometheus,
+    measure_stage,
+)
+
+
+def test_stage_measured_into_stages():
+    """
+    A stage is stored with its wall time, peak memory and any values added to it.
+    """
+    stages = {}
+
+    with measure_stage(stages, "parse") as metrics:
+        metrics["events"] = 3
+
+    assert stages["parse"]["events"] == 3
+    assert stages["parse"]["seconds"] >= 0
+    assert stages["parse"]["max_rss_bytes"] > 0
+
+
+def test_stage_stored_when_it_fails():
+    """
+    A stage that raises an exception is still measured.
+    """
+    stages = {}
+
+    try:
+        with measure_stage(stages, "fetch"):
+            raise ValueError()
+    except ValueError:
+        pass
+
+    assert "seconds" in stages["fetch"]
+
+
+def test_prometheus_gauges_labelled_by_calendar_and_stage():
+    """
+    Each value is a gauge labelled with its stage, and calendar if it has one.
+    """
+    latest = {
+        ('Bob "B"', "merge"): {"seconds": 0.5, "conflicts": 2},
+        (None, "login"): {"seconds": 3.0},
+    }
+
+    lines = format_prometheus(latest, 1600000000.0).splitlines()
+
+    assert lines[:4] == [
+        "# HELP fifty_cal_stage_seconds Wall time taken by the stage.",
+        "# TYPE fifty_cal_stage_seconds gauge",
+        'fifty_cal_stage_seconds{stage="login"} 3.0',
+        'fifty_cal_stage_seconds{calendar="Bob \\"B\\"",stage="merge"} 0.5',
+    ]
+    assert 'fifty_cal_stage_conflicts{calendar="Bob \\"B\\"",stage="merge"} 2' in lines
+    assert lines[-1] == "fifty_cal_last_export_timestamp_seconds 1600000000.0"
+
+
+def test_recorder_appends_log_and_replaces_textfile():
+    """
+    Every export appends the new stages to the JSON log, while the Prometheus file
+    only holds the latest value of each stage.
+    """
+    with TemporaryDirectory() as output_path:
+        json_path = os.path.join(output_path, "metrics.jsonl")
+        prometheus_path = os.path.join(output_path, "fifty_cal.prom")
+        recorder = MetricsRecorder(json_path, prometheus_path)
+
+        recorder.record("person_1", "fetch", {"seconds": 1.0, "bytes": 100})
+        recorder.export()
+        recorder.record("person_1", "fetch", {"seconds": 2.0, "bytes": 200})
+        recorder.export()
+
+        with open(json_path) as json_file:
+            samples = [json.loads(line) for line in json_file]
+        with open(prometheus_path) as prometheus_file:
+            prometheus = prometheus_file.read()
+        assert sorted(os.listdir(output_path)) == ["fifty_cal.prom", "metrics.jsonl"]
+
+    assert [(sample["calendar"], sample["bytes"]) for sample in samples] == [
+        ("person_1", 100),
+        ("person_1", 200),
+    ]
+    assert 'fifty_cal_stage_bytes{calendar="person_1",stage="fetch"} 200' in prometheus
+    assert 'stage="fetch"} 100' not in prometheus
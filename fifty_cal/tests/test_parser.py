@@ -0,0 +1,36 @@
+from fifty_cal.parser import iter_blocks
+
+
+def test_blocks_yielded_as_lines_are_read():
+    """
+    Each block is yielded before the rest of the calendar has been read.
+    """
+    with open("fifty_cal/tests/resources/dummy_local.ics") as calendar_file:
+        lines = iter(calendar_file.readlines())
+
+    name, block = next(
+        (name, block) for name, block in iter_blocks(lines) if name == "VEVENT"
+    )
+
+    assert "UID:9d71ae4b-b124-4715-93fa-6b684893cfca" in block
+    assert "BEGIN:VEVENT\n" in list(lines)
+
+
+def test_folded_lines_kept_with_their_property():
+    """
+    Folded lines are returned as part of the property they continue.
+    """
+    lines = [
+        "BEGIN:VCALENDAR\r\n",
+        "X-WR-CALNAME:A very long\r\n",
+        "  calendar name\r\n",
+        "BEGIN:VEVENT\r\n",
+        "UID:1234\r\n",
+        "END:VEVENT\r\n",
+        "END:VCALENDAR\r\n",
+    ]
+
+    assert list(iter_blocks(lines)) == [
+        (None, ["X-WR-CALNAME:A very long", "  calendar name"]),
+        ("VEVENT", ["BEGIN:VEVENT", "UID:1234", "END:VEVENT"]),
+    ]
@@ -0,0 +1,191 @@
+import os
+import shutil
+import stat
+from tempfile import TemporaryDirectory
+
+import pytest
+
+from vobject import readOne
+
+from fifty_cal import pipeline
+from fifty_cal.pipeline import (
+    UMASK,
+    parse_calendar,
+    save_calendar,
+    sync_calendar_data,
+)
+
+
+def read_test_file(file_name: str) -> bytes:
+    """
+    Read the raw bytes of one of the test calendars.
+    """
+    with open(f"fifty_cal/tests/resources/{file_name}", "rb") as calendar_file:
+        return calendar_file.read()
+
+
+def test_parse_calendar_from_bytes():
+    """
+    Raw calendar bytes are parsed into a calendar.
+    """
+    calendar_data = read_test_file("dummy_local.ics")
+
+    calendar = parse_calendar(calendar_data).to_component()
+
+    assert str(calendar) == str(readOne(calendar_data.decode()))
+
+
+def test_sync_saves_new_calendar():
+    """
+    A calendar with no local copy is saved as it was downloaded.
+    """
+    calendar_data = read_test_file("dummy_downloaded.ics")
+    with TemporaryDirectory() as output_path:
+        filepath = os.path.join(output_path, "person_1.ics")
+
+        sync_calendar_data(calendar_data, filepath)
+
+        with open(filepath) as saved_file:
+            saved = readOne(saved_file.read())
+
+    assert len(saved.vevent_list) == 6
+
+
+def test_sync_merges_with_local_calendar():
+    """
+    A calendar with a local copy is merged with it before being saved.
+    """
+    calendar_data = read_test_file("dummy_local.ics")
+    with TemporaryDirectory() as output_path:
+        filepath = os.path.join(output_path, "person_1.ics")
+        shutil.copy("fifty_cal/tests/resources/dummy_downloaded.ics", filepath)
+
+        sync_calendar_data(calendar_data, filepath)
+
+        with open(filepath) as saved_file:
+            saved = readOne(saved_file.read())
+
+    assert len(saved.vevent_list) == 6
+
+
+def test_sync_base_used_to_keep_deletions():
+    """
+    With a sync base, an event deleted from the server is removed from the local
+    copy rather than being added back to the server's calendar.
+    """
+    calendar_data = read_test_file("dummy_downloaded.ics")
+    remote = readOne(calendar_data.decode())
+    deleted = remote.contents["vevent"].pop(0)
+    with TemporaryDirectory() as output_path:
+        filepath = os.path.join(output_path, "person_1.ics")
+        base_path = os.path.join(output_path, "sync_base", "person_1.json")
+
+        sync_calendar_data(calendar_data, filepath, base_path)
+        sync_calendar_data(remote.serialize().encode(), filepath, base_path)
+
+        with open(filepath) as saved_file:
+            saved = readOne(saved_file.read())
+        assert os.path.isfile(base_path)
+
+    uids = [event.uid.value for event in saved.vevent_list]
+    assert len(uids) == 5
+    assert deleted.uid.value not in uids
+
+
+def test_first_sync_with_base_leaves_unchanged_file(mocker):
+    """
+    A local copy that matches the server is left as it is on the first run with a
+    sync base, and the base is built without reading the saved file back.
+    """
+    calendar_data = read_test_file("test_calendar.ics")
+    with TemporaryDirectory() as output_path:
+        filepath = os.path.join(output_path, "person_1.ics")
+        base_path = os.path.join(output_path, "sync_base", "person_1.json")
+        shutil.copy("fifty_cal/tests/resources/test_calendar.ics", filepath)
+        get_local_records = mocker.spy(pipeline, "get_local_records")
+        write_file = mocker.spy(pipeline, "write_file")
+
+        sync_calendar_data(calendar_data, filepath, base_path)
+
+        with open(filepath, "rb") as saved_file:
+            saved = saved_file.read()
+        assert os.path.isfile(base_path)
+
+    write_file.assert_not_called()
+    get_local_records.assert_called_once()
+    assert saved == calendar_data
+
+
+def test_save_writes_calendar_atomically(mocker):
+    """
+    Calendars are written to a temporary file that replaces the original.
+    """
+    replace = mocker.spy(os, "replace")
+    calendar = parse_calendar(read_test_file("dummy_local.ics"))
+    with TemporaryDirectory() as output_path:
+        filepath = os.path.join(output_path, "person_1.ics")
+
+        assert save_calendar(calendar, filepath)
+
+        assert os.listdir(output_path) == ["person_1.ics"]
+        assert replace.call_args[0][1] == filepath
+        mode = stat.S_IMODE(os.stat(filepath).st_mode)
+        with open(filepath, "rb") as saved_file:
+            saved = saved_file.read()
+
+    assert saved == calendar.serialize().encode()
+    assert mode == 0o666 & ~UMASK
+
+
+def test_save_skipped_when_calendar_unchanged(mocker):
+    """
+    Nothing is written when the file already holds the same calendar.
+    """
+    calendar = parse_calendar(read_test_file("dummy_local.ics"))
+    with TemporaryDirectory() as output_path:
+        filepath = os.path.join(output_path, "person_1.ics")
+        save_calendar(calendar, filepath)
+        replace = mocker.spy(os, "replace")
+
+        assert not save_calendar(calendar, filepath)
+
+    replace.assert_not_called()
+
+
+def test_failed_save_leaves_original_file(mocker):
+    """
+    The original file is untouched and no temporary file is left if saving fails.
+    """
+    calendar = parse_calendar(read_test_file("dummy_local.ics"))
+    with TemporaryDirectory() as output_path:
+        filepath = os.path.join(output_path, "person_1.ics")
+        with open(filepath, "w") as calendar_file:
+            calendar_file.write("original")
+        mocker.patch("fifty_cal.pipeline.os.fsync", side_effect=OSError("disk full"))
+
+        with pytest.raises(OSError):
+            save_calendar(calendar, filepath)
+
+        assert os.listdir(output_path) == ["person_1.ics"]
+        with open(filepath) as calendar_file:
+            assert calendar_file.read() == "original"
+
+
+def test_sync_measures_each_stage():
+    """
+    Each stage of a sync is measured and returned, as it may happen in another
+    process.
+    """
+    calendar_data = read_test_file("dummy_local.ics")
+    with TemporaryDirectory() as output_path:
+        filepath = os.path.join(output_path, "person_1.ics")
+        shutil.copy("fifty_cal/tests/resources/dummy_downloaded.ics", filepath)
+
+        result = sync_calendar_data(calendar_data, filepath)
+
+    assert result.pid == os.getpid()
+    assert list(result.stages) == ["parse", "read_local", "diff", "merge", "save"]
+    assert result.stages["parse"]["events"] == 3
+    assert result.stages["read_local"]["events"] == 6
+    assert result.stages["merge"]["conflicts"] == 2
+    assert result.stages["merge"]["events"] == 6
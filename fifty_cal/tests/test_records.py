@@ -0,0 +1,289 @@
+import json
+
+from vobject import readOne
+
+from fifty_cal.diff import CalendarDiff, get_event_key
+from fifty_cal.merge import merge
+from fifty_cal.records import RECORD_FIELDS, EventRecord, ZonedTime, read_records
+
+EVENT_LINES = [
+    "BEGIN:VEVENT",
+    "UID:event-1",
+    "SEQUENCE:2",
+    "LAST-MODIFIED:20201214T084031Z",
+    "SUMMARY:A long summary that has been folded",
+    "  onto a second line",
+    "DTSTART;VALUE=DATE:20201218",
+    "BEGIN:VALARM",
+    "UID:alarm-1",
+    "ACTION:DISPLAY",
+    "TRIGGER:-PT15M",
+    "END:VALARM",
+    "END:VEVENT",
+]
+
+
+def read_component(file_name: str):
+    """
+    Read one of the test calendars with vobject.
+    """
+    with open(f"fifty_cal/tests/resources/{file_name}") as calendar_file:
+        return readOne(calendar_file.read())
+
+
+def get_uids(diff: list) -> list:
+    """
+    Get the UIDs of each pair in a diff.
+    """
+    return [(event_1 or event_2).getChildValue("uid") for event_1, event_2 in diff]
+
+
+def test_key_fields_read_without_parsing():
+    """
+    The fields used to match events are read without parsing the event.
+    """
+    record = EventRecord("VEVENT", EVENT_LINES)
+    component = readOne("\r\n".join(EVENT_LINES))
+
+    for name in ("uid", "sequence", "last_modified", "recurrence_id"):
+        assert record.getChildValue(name) == component.getChildValue(name)
+    assert record._component is None
+
+
+def test_recurrence_id_in_timezone_read_without_parsing(read_resource):
+    """
+    A `RECURRENCE-ID` in a timezone gives the same value as vobject without parsing
+    the event.
+    """
+    calendar = read_resource("dummy_local.ics")
+    lines = EVENT_LINES[:2] + ["RECURRENCE-ID;TZID=Europe/London:20210301T090000"]
+    lines += EVENT_LINES[2:]
+    record = EventRecord("VEVENT", lines)
+    component = readOne("\r\n".join(lines))
+
+    assert calendar.contents["vtimezone"]
+    assert record.getChildValue("recurrence_id") == component.getChildValue(
+        "recurrence_id"
+    )
+    assert get_event_key(record) == get_event_key(component)
+    assert record._component is None
+
+
+def test_record_restored_from_json_without_reading_lines(mocker):
+    """
+    A record stored as JSON gives the same fields and fingerprint once restored,
+    without its lines being read again.
+    """
+    lines = EVENT_LINES[:2] + [
+        "RECURRENCE-ID;TZID=Europe/London:20210301T090000",
+        "DTEND:20201218T100000Z",
+        "DURATION:PT1H",
+        "RRULE:FREQ=WEEKLY",
+        "RDATE:20201225",
+    ]
+    record = EventRecord("VEVENT", lines + EVENT_LINES[2:])
+    record.get_fingerprint()
+    unfold = mocker.patch("fifty_cal.records.unfold")
+
+    restored = EventRecord.from_json(json.loads(json.dumps(record.to_json())))
+
+    unfold.assert_not_called()
+    for field in RECORD_FIELDS.values():
+        value = getattr(restored, field)
+        if isinstance(value, ZonedTime):
+            assert (value.tzid, value.value) == (
+                getattr(record, field).tzid,
+                getattr(record, field).value,
+            )
+        else:
+            assert value == getattr(record, field)
+    assert restored.tzids == {"Europe/London"}
+    assert restored.get_fingerprint() == record.get_fingerprint()
+    assert not restored.parsed
+
+
+def test_other_properties_parsed_on_demand():
+    """
+    Anything other than the key fields is read from the parsed event.
+    """
+    record = EventRecord("VEVENT", EVENT_LINES)
+
+    assert (
+        record.summary.value == "A long summary that has been folded onto a second line"
+    )
+    assert record._component is not None
+
+
+def test_escaped_uid_parsed_by_vobject():
+    """
+    Values that need unescaping are left to vobject.
+    """
+    lines = ["BEGIN:VEVENT", "UID:event\\,1", "END:VEVENT"]
+
+    assert EventRecord("VEVENT", lines).getChildValue("uid") == "event,1"
+
+
+def test_fingerprint_ignores_sequence_and_order():
+    """
+    Reordering properties or changing the sequence doesn't change the fingerprint.
+    """
+    reordered = EVENT_LINES[:1] + EVENT_LINES[3:7] + ["SEQUENCE:3"] + EVENT_LINES[1:2]
+    reordered += EVENT_LINES[7:]
+    modified = [line.replace("TRIGGER:-PT15M", "TRIGGER:-PT5M") for line in EVENT_LINES]
+    fingerprint = EventRecord("VEVENT", EVENT_LINES).get_fingerprint()
+
+    assert EventRecord("VEVENT", reordered).get_fingerprint() == fingerprint
+    assert EventRecord("VEVENT", modified).get_fingerprint() != fingerprint
+
+
+def test_changes_to_parsed_event_seen():
+    """
+    Once an event has been parsed and changed, the change is seen when reading its
+    key fields and fingerprinting it.
+    """
+    record = EventRecord("VEVENT", EVENT_LINES)
+    fingerprint = record.get_fingerprint()
+
+    record.uid.value = "event-2"
+
+    assert record.getChildValue("uid") == "event-2"
+    assert record.get_fingerprint() != fingerprint
+
+
+def test_fingerprint_unchanged_by_parsing():
+    """
+    Parsing an event without changing it leaves its fingerprint as it was.
+    """
+    record = EventRecord("VEVENT", EVENT_LINES)
+    fingerprint = record.get_fingerprint()
+
+    assert record.summary.value
+    assert record.parsed
+    assert record.get_fingerprint() == fingerprint
+    assert record.lines is EVENT_LINES
+
+
+def test_identical_calendars_diffed_without_parsing_events(read_resource):
+    """
+    Diffing unchanged calendars never parses an event.
+    """
+    cal_1 = read_resource("dummy_local.ics")
+    cal_2 = read_resource("dummy_local.ics")
+
+    cal_diff = CalendarDiff(cal_1, cal_2)
+    cal_diff.clean_calendars()
+    cal_diff.get_diff()
+
+    assert cal_diff.diff == []
+    for calendar in (cal_1, cal_2):
+        assert all(event._component is None for event in calendar.contents["vevent"])
+
+
+def test_records_diff_matches_components_diff(read_resource):
+    """
+    Diffing records finds the same differences as diffing parsed calendars.
+    """
+    records_diff = CalendarDiff(
+        read_resource("dummy_local.ics"), read_resource("dummy_downloaded.ics")
+    )
+    records_diff.clean_calendars()
+    records_diff.get_diff()
+    components_diff = CalendarDiff(
+        read_component("dummy_local.ics"),
+        read_component("dummy_downloaded.ics"),
+    )
+    components_diff.clean_calendars()
+    components_diff.get_diff()
+
+    assert records_diff.diff
+    assert get_uids(records_diff.diff) == get_uids(components_diff.diff)
+
+
+def test_merged_records_match_merged_components(read_resource):
+    """
+    Merging records gives the same calendar as merging parsed calendars.
+    """
+    merged_records = merge(
+        CalendarDiff(
+            read_resource("dummy_local.ics"), read_resource("dummy_downloaded.ics")
+        )
+    )
+    merged_components = merge(
+        CalendarDiff(
+            read_component("dummy_local.ics"),
+            read_component("dummy_downloaded.ics"),
+        )
+    )
+
+    assert merged_records.to_component().serialize() == merged_components.serialize()
+
+
+def test_read_records_keeps_raw_lines():
+    """
+    Events are stored as the lines they were read from.
+    """
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0"] + EVENT_LINES + ["END:VCALENDAR"]
+
+    calendar = read_records(lines)
+
+    assert calendar.properties == ["VERSION:2.0"]
+    assert calendar.contents["vevent"][0].lines == EVENT_LINES
+
+
+def test_unchanged_calendar_written_verbatim(read_resource):
+    """
+    A calendar that is read and serialized without changes is written as it was
+    read.
+    """
+    with open("fifty_cal/tests/resources/dummy_local.ics") as calendar_file:
+        original = calendar_file.read()
+
+    serialized = read_resource("dummy_local.ics").serialize()
+
+    assert serialized.replace("\r\n", "\n") == original.replace("\r\n", "\n")
+
+
+def test_only_changed_events_reserialized(read_resource):
+    """
+    Events that have been changed are serialized by vobject, the rest are copied.
+    """
+    calendar = read_resource("dummy_local.ics")
+    changed_event, read_event, *unparsed_events = calendar.contents["vevent"]
+    original_lines = changed_event.lines
+    changed_event.summary.value = "Changed"
+    read_event.getChildValue("summary")
+
+    serialized = calendar.serialize()
+
+    assert "SUMMARY:Changed\r\n" in serialized
+    assert "\r\n".join(original_lines) not in serialized
+    assert read_event.parsed
+    assert "\r\n".join(read_event.lines) in serialized
+    for event in unparsed_events + calendar.contents["vtimezone"]:
+        assert not event.parsed
+        assert "\r\n".join(event.lines) in serialized
+    assert len(readOne(serialized).vevent_list) == len(calendar.contents["vevent"])
+
+
+def test_missing_timezone_added(read_resource):
+    """
+    A timezone used by an event but not defined in the calendar is added.
+    """
+    calendar = read_resource("dummy_local.ics")
+    calendar.contents["vtimezone"] = []
+    calendar.add(
+        EventRecord(
+            "VEVENT",
+            [
+                "BEGIN:VEVENT",
+                "UID:timezone-test",
+                "DTSTART;TZID=Europe/London:20210301T090000",
+                "END:VEVENT",
+            ],
+        )
+    )
+
+    serialized = calendar.serialize()
+
+    assert serialized.count("BEGIN:VTIMEZONE") == 1
+    assert "TZID:Europe/London" in serialized
@@ -0,0 +1,49 @@
+import datetime as dt
+
+from fifty_cal.parser import parse_block
+from fifty_cal.recurrence import get_occurrences
+from fifty_cal.records import EventRecord
+
+EVENT = """BEGIN:VEVENT
+UID:recurring-1
+DTSTART;TZID=Europe/London:20210104T090000
+DTEND;TZID=Europe/London:20210104T100000
+RRULE:FREQ=WEEKLY
+SUMMARY:Weekly meeting
+END:VEVENT
+"""
+
+
+def test_occurrences_within_window():
+    """
+    Only the occurrences starting inside the window are expanded.
+    """
+    event = parse_block(EVENT.splitlines())
+
+    occurrences = get_occurrences(event, dt.date(2021, 2, 1), dt.date(2021, 3, 1))
+
+    assert [occurrence.day for occurrence in occurrences] == [1, 8, 15, 22]
+    assert occurrences[0].tzinfo is not None
+
+
+def test_endless_rule_expansion_is_limited():
+    """
+    No more than `limit` occurrences are expanded, however long the window.
+    """
+    event = EventRecord("VEVENT", EVENT.splitlines())
+
+    occurrences = get_occurrences(
+        event, dt.date(2021, 1, 1), dt.date(9999, 1, 1), limit=10
+    )
+
+    assert len(occurrences) == 10
+
+
+def test_single_event_has_one_occurrence():
+    """
+    An event that doesn't recur occurs once at its start, if that is in the window.
+    """
+    event = parse_block(EVENT.replace("RRULE:FREQ=WEEKLY\n", "").splitlines())
+
+    assert len(get_occurrences(event, dt.date(2021, 1, 1), dt.date(2021, 2, 1))) == 1
+    assert get_occurrences(event, dt.date(2021, 2, 1), dt.date(2021, 3, 1)) == []
@@ -1,8 +1,13 @@
 import pytest
-from selenium.common.exceptions import NoSuchElementException
+from selenium.common.exceptions import NoSuchElementException, TimeoutException
 
-from fifty_cal.exceptions import UnableToLogoutException
-from fifty_cal.session import Session
+from fifty_cal import session as session_module
+from fifty_cal.exceptions import (
+    ConfigurationException,
+    DownloadFailedException,
+    UnableToLogoutException,
+)
+from fifty_cal.session import Session, wait_until
 
 
 @pytest.fixture
@@ -21,8 +26,6 @@ def setup_mocks(mocker):
 
     mocker.patch("fifty_cal.session.ActionChains")
     mocker.patch("fifty_cal.session.Options")
-    mocker.patch("fifty_cal.session.expected_conditions")
-    mocker.patch("fifty_cal.session.WebDriverWait")
     mocker.patch("fifty_cal.session.By")
     yield
 
@@ -32,6 +35,21 @@ def session(setup_mocks):
     return Session()
 
 
+def test_browser_not_started_until_needed(setup_mocks):
+    """
+    Creating a session doesn't start the browser.
+    """
+    timings = {}
+    session = Session(timings=timings)
+
+    session_module.webdriver.Firefox.assert_not_called()
+
+    with session.start_session(username="", password=""):
+        session_module.webdriver.Firefox.assert_called_once()
+
+    assert set(timings) == {"browser", "login"}
+
+
 def test_start_session_gets_session_cookies(session):
     """
     Test the start_session context manager yields cookies.
@@ -49,6 +67,33 @@ def test_start_session_logs_out_when_exiting(session):
     assert not session.logged_in
 
 
+def test_start_session_logs_out_when_download_fails(session):
+    """
+    The session is logged out and the browser closed even if the code using the
+    session raises an exception.
+    """
+    with pytest.raises(DownloadFailedException):
+        with session.start_session(username="", password=""):
+            raise DownloadFailedException()
+
+    assert not session.logged_in
+    session_module.webdriver.Firefox.return_value.quit.assert_called_once()
+
+
+def test_browser_closed_when_login_times_out(session, mocker):
+    """
+    The browser is closed if the login page never loads.
+    """
+    mocker.patch.object(session, "wait_for_element", side_effect=TimeoutException())
+
+    with pytest.raises(TimeoutException):
+        with session.start_session(username="", password=""):
+            pass
+
+    session_module.webdriver.Firefox.return_value.quit.assert_called_once()
+    assert not session.logged_in
+
+
 def test_exception_raised_if_unable_to_logout(session, mocker):
     """
     Test that `UnableToLogoutException` is raised if logout button does not appear.
@@ -56,9 +101,131 @@ def test_exception_raised_if_unable_to_logout(session, mocker):
     click = mocker.MagicMock()
     click.click.side_effect = UnableToLogoutException()
 
-    session.LOGOUT_RETRY_MAX_SECONDS = 1
+    session.logout_timeout = 1
     session.driver = mocker.MagicMock()
     session.driver.find_element_by_class_name.return_value = click
     with pytest.raises(UnableToLogoutException):
         with session.start_session(username="", password=""):
             pass
+
+
+def test_start_session_stays_logged_in_when_not_logging_out(session, mocker):
+    """
+    The session is left open when `logout` is `False`, and the browser closed as soon
+    as the cookies have been read.
+    """
+    logout = mocker.patch.object(session, "logout")
+
+    with session.start_session(username="", password="", logout=False):
+        session_module.webdriver.Firefox.return_value.quit.assert_called_once()
+
+    logout.assert_not_called()
+    assert session.logged_in
+
+
+def test_exception_raised_if_logout_button_never_appears(session, mocker):
+    """
+    `UnableToLogoutException` is raised once the logout deadline has passed.
+    """
+    session.logout_timeout = 0
+    session.driver = mocker.MagicMock()
+    session.driver.find_element_by_class_name.side_effect = NoSuchElementException()
+
+    with pytest.raises(UnableToLogoutException):
+        session.logout()
+
+
+def test_wait_until_backs_off(mocker):
+    """
+    The delay between attempts doubles until the condition is met.
+    """
+    sleep = mocker.patch("fifty_cal.session.sleep")
+    condition = mocker.MagicMock(
+        side_effect=[NoSuchElementException(), None, None, "found"]
+    )
+
+    assert wait_until(condition, timeout=60, initial_delay=0.1) == "found"
+    assert [call[0][0] for call in sleep.call_args_list] == [0.1, 0.2, 0.4]
+
+
+def test_wait_until_times_out():
+    """
+    `TimeoutException` is raised if the condition isn't met before the deadline.
+    """
+    with pytest.raises(TimeoutException):
+        wait_until(lambda: None, timeout=0)
+
+
+def test_calendar_button_clicked_until_calendar_list_appears(session, mocker):
+    """
+    The calendar button is clicked again if the calendar list hasn't loaded.
+    """
+    mocker.patch("fifty_cal.session.sleep")
+    calendar_button = mocker.MagicMock()
+    calendar_list = mocker.MagicMock()
+    session.driver = mocker.MagicMock()
+    session.driver.find_element.side_effect = [
+        calendar_button,
+        NoSuchElementException(),
+        calendar_list,
+    ]
+
+    session.open_calendar()
+
+    assert calendar_button.click.call_count == 2
+
+
+def test_http_logout_closes_browser_before_yielding(session, mocker):
+    """
+    With `logout_mode` of `"http"` the browser is closed straight after logging in
+    and the session is logged out with the request token.
+    """
+    get = mocker.patch("fifty_cal.session.requests.get")
+    get.return_value.status_code = 200
+    browser = session_module.webdriver.Firefox.return_value
+    browser.execute_script.return_value = "token"
+    browser.current_url = "https://webmail.names.co.uk/?_task=calendar"
+    session.logout_mode = "http"
+
+    with session.start_session(username="", password="") as cookies:
+        browser.quit.assert_called_once()
+        get.assert_not_called()
+
+    assert get.call_args[0][0] == "https://webmail.names.co.uk/"
+    assert get.call_args[1]["params"] == {"_task": "logout", "_token": "token"}
+    assert get.call_args[1]["cookies"] == cookies
+    assert not session.logged_in
+
+
+def test_http_logout_never_sends_cookies_in_cleartext(session, mocker):
+    """
+    The session cookies aren't sent to a page that was loaded without https.
+    """
+    get = mocker.patch("fifty_cal.session.requests.get")
+
+    with pytest.raises(UnableToLogoutException):
+        session.logout_over_http({"session": "1234"}, "token", "http://example.com/")
+
+    get.assert_not_called()
+
+
+def test_invalid_logout_mode_raises_error():
+    """
+    Only the supported logout modes can be used.
+    """
+    with pytest.raises(ConfigurationException):
+        Session(logout_mode="carrier pigeon")
+
+
+def test_get_calendar_map_reads_list_in_one_call(session, mocker):
+    """
+    The calendar list is read with a single script.
+    """
+    session.driver = mocker.MagicMock()
+    session.driver.execute_script.return_value = [
+        ["Person 1", "calAB1234"],
+        ["Person 2", "calAB4321"],
+    ]
+
+    assert session.get_calendar_map() == {"Person 1": "AB1234", "Person 2": "AB4321"}
+    session.driver.execute_script.assert_called_once()
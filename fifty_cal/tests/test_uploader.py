@@ -0,0 +1,165 @@
+import base64
+import datetime as dt
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+from vobject import readOne
+
+from fifty_cal.exceptions import UnauthorizedException
+from fifty_cal.records import read_records
+from fifty_cal.uploader import (
+    get_calendar_id,
+    get_delta,
+    get_import_url,
+    get_request_token,
+    upload_calendar,
+)
+
+CALENDAR_PAGE = '<script>rcmail.set_env({"task":"calendar","request_token":"abc"});'
+
+
+class ImportStub(BaseHTTPRequestHandler):
+    """
+    Just enough of the calendar page and event import to test uploading against.
+    """
+
+    calendar_page = CALENDAR_PAGE
+
+    def log_message(self, *args):
+        pass
+
+    def send_page(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html")
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def do_GET(self):
+        self.send_page(200, self.calendar_page)
+
+    def do_POST(self):
+        query = parse_qs(urlparse(self.path).query)
+        length = int(self.headers["Content-Length"])
+        body = self.rfile.read(length)
+        form = BytesParser(policy=policy.default).parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body
+        )
+        fields = {
+            part.get_param("name", header="content-disposition"): part.get_content()
+            for part in form.iter_parts()
+        }
+        self.server.requests.append((query, fields, self.headers))
+        if fields.get("_token") != "abc":
+            self.send_page(403, "Invalid request")
+        else:
+            self.send_page(200, "<script>parent.rcmail.import_success();</script>")
+
+
+serve_import = pytest.mark.parametrize("stub_server", [ImportStub], indirect=True)
+
+
+def test_calendar_id_decoded_from_hash():
+    """
+    The calendar ID is decoded from the feed hash, or the hash is used as it is.
+    """
+    calendar_hash = base64.b64encode(b"user@example.com:42").decode()
+
+    assert get_calendar_id(calendar_hash) == "42"
+    assert get_calendar_id("AB1234") == "AB1234"
+
+
+def test_import_url_built_from_calendar_url():
+    """
+    Events are imported through the same page as the calendar.
+    """
+    url = get_import_url("https://example.com/mail/?_task=calendar&_cal=")
+
+    assert url == "https://example.com/mail/?_task=calendar&_action=import_events"
+
+
+def test_delta_only_has_new_and_newer_events(read_resource):
+    """
+    Only events missing from the server or changed locally since are uploaded.
+    """
+    server = read_resource("dummy_local.ics")
+    local = read_records(server.serialize().splitlines())
+    changed = local.contents["vevent"][0]
+    changed.summary.value = "Changed locally"
+    changed.last_modified.value += dt.timedelta(days=1)
+    stale = local.contents["vevent"][1]
+    stale.summary.value = "Changed on the server since"
+    stale.last_modified.value -= dt.timedelta(days=1)
+    added = read_resource("dummy_downloaded.ics").contents["vevent"][-1]
+    local.add(added)
+
+    delta = get_delta(local, server)
+
+    assert len(delta.contents["vevent"]) == 2
+    assert set(delta.contents["vevent"]) == {changed, added}
+    assert readOne(delta.serialize()).vtimezone.tzid.value == "Europe/London"
+
+
+def test_delta_skips_events_deleted_from_server(read_resource):
+    """
+    An event synced before and since deleted from the server isn't uploaded again.
+    """
+    local = read_resource("dummy_local.ics")
+    server = read_records(local.serialize().splitlines())
+    server.contents["vevent"].pop(0)
+
+    assert get_delta(local, server) is not None
+    assert (
+        get_delta(local, server, {"9d71ae4b-b124-4715-93fa-6b684893cfca": []}) is None
+    )
+
+
+@serve_import
+def test_upload_posts_delta_with_token(stub_server, read_resource):
+    """
+    The delta is posted to the import with the request token and calendar ID.
+    """
+    calendar_url = f"{stub_server.url}?_task=calendar&_cal="
+    session = requests.Session()
+    delta = read_resource("dummy_local.ics")
+
+    token = get_request_token(session, calendar_url)
+    upload_calendar(delta, "AB1234", session, calendar_url, token)
+
+    query, fields, headers = stub_server.requests[0]
+    assert query["_action"] == ["import_events"]
+    assert fields["_calendar"] == "AB1234"
+    assert fields["_token"] == headers["X-Roundcube-Request"] == "abc"
+    assert fields["_data"] == delta.serialize()
+
+
+@serve_import
+def test_rejected_upload_raises_error(stub_server, read_resource):
+    """
+    An upload the server refuses raises the exception for its status code.
+    """
+    calendar_url = f"{stub_server.url}?_task=calendar&_cal="
+
+    with pytest.raises(UnauthorizedException):
+        upload_calendar(
+            read_resource("dummy_local.ics"),
+            "AB1234",
+            requests.Session(),
+            calendar_url,
+            "stale",
+        )
+
+
+@serve_import
+def test_missing_request_token_raises_error(stub_server, mocker):
+    """
+    A calendar page without a request token means the session isn't logged in.
+    """
+    calendar_url = f"{stub_server.url}?_task=calendar&_cal="
+    mocker.patch.object(ImportStub, "calendar_page", "<form id=rcmloginuser>")
+
+    with pytest.raises(UnauthorizedException):
+        get_request_token(requests.Session(), calendar_url)
@@ -0,0 +1,81 @@
+import os
+import random
+from tempfile import TemporaryDirectory
+
+from fifty_cal.watch import FileWatcher, Scheduler
+
+
+class FakeClock:
+    """
+    A clock that only moves when told to.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_every_calendar_due_at_start():
+    """
+    Every calendar is synced as soon as watching starts.
+    """
+    scheduler = Scheduler({"person_1": 60, "person_2": 300}, clock=FakeClock())
+
+    assert scheduler.get_due() == ["person_1", "person_2"]
+    assert scheduler.seconds_until_next() == 0
+
+
+def test_calendars_scheduled_on_own_interval_with_jitter():
+    """
+    Each calendar is next due after its own interval, varied by up to the jitter.
+    """
+    clock = FakeClock()
+    scheduler = Scheduler(
+        {"person_1": 60, "person_2": 300}, 0.1, clock, random.Random(0)
+    )
+    for name in scheduler.get_due():
+        scheduler.schedule(name)
+
+    assert scheduler.get_due() == []
+    assert 54 <= scheduler.next_due["person_1"] - clock.now <= 66
+    assert 270 <= scheduler.next_due["person_2"] - clock.now <= 330
+    assert scheduler.seconds_until_next() == scheduler.next_due["person_1"] - clock.now
+
+    clock.now += 66
+    assert scheduler.get_due() == ["person_1"]
+
+
+def test_triggered_calendar_due_straight_away():
+    """
+    A triggered calendar is due without waiting for its interval.
+    """
+    scheduler = Scheduler({"person_1": 60}, clock=FakeClock())
+    scheduler.schedule("person_1")
+
+    scheduler.trigger("person_1")
+
+    assert scheduler.get_due() == ["person_1"]
+
+
+def test_file_watcher_reports_outside_changes():
+    """
+    Changed files are reported once, but not after being refreshed.
+    """
+    with TemporaryDirectory() as output_path:
+        paths = {
+            name: os.path.join(output_path, f"{name}.ics")
+            for name in ("person_1", "person_2")
+        }
+        watcher = FileWatcher(paths)
+
+        with open(paths["person_1"], "w") as calendar_file:
+            calendar_file.write("changed")
+        changed = watcher.get_changed()
+        with open(paths["person_2"], "w") as calendar_file:
+            calendar_file.write("synced")
+        watcher.refresh("person_2")
+
+        assert changed == ["person_1"]
+        assert watcher.get_changed() == []
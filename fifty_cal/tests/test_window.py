@@ -0,0 +1,192 @@
+import datetime as dt
+import os
+import shutil
+from tempfile import TemporaryDirectory
+
+import pytest
+
+from fifty_cal.local import get_local_records
+from fifty_cal.merge import build_sync_base, get_sync_key, iter_events
+from fifty_cal.pipeline import parse_calendar, sync_calendar_data, update_local
+from fifty_cal.records import EventRecord
+from fifty_cal.window import get_sync_window, is_outside_window
+
+UTC = dt.timezone.utc
+
+# Only the events from February 2021 onwards in the test calendars are in this.
+WINDOW = (dt.datetime(2021, 2, 1, tzinfo=UTC), None)
+
+
+def make_event(*lines: str) -> EventRecord:
+    """
+    Make an event from the lines between its `BEGIN` and `END`.
+    """
+    return EventRecord(
+        "VEVENT", ["BEGIN:VEVENT", "UID:window-test", *lines, "END:VEVENT"]
+    )
+
+
+@pytest.fixture
+def local_path():
+    """
+    Copy the local test calendar somewhere it can be read and yield its path.
+    """
+    with TemporaryDirectory() as output_path:
+        file_path = os.path.join(output_path, "person_1.ics")
+        shutil.copy("fifty_cal/tests/resources/dummy_local.ics", file_path)
+        yield file_path
+
+
+def read_downloaded():
+    """
+    Read the downloaded test calendar as records.
+    """
+    with open("fifty_cal/tests/resources/dummy_downloaded.ics", "rb") as calendar_file:
+        return parse_calendar(calendar_file.read())
+
+
+def test_sync_window_around_now():
+    """
+    The window runs from the given number of days before now to the number after.
+    """
+    now = dt.datetime(2021, 6, 1, tzinfo=UTC)
+
+    assert get_sync_window(30, 7, now) == (
+        dt.datetime(2021, 5, 2, tzinfo=UTC),
+        dt.datetime(2021, 6, 8, tzinfo=UTC),
+    )
+    assert get_sync_window(None, 7, now) == (None, dt.datetime(2021, 6, 8, tzinfo=UTC))
+    assert get_sync_window() is None
+
+
+@pytest.mark.parametrize(
+    "lines, outside",
+    [
+        (["DTSTART:20210101T090000Z", "DTEND:20210101T100000Z"], True),
+        (["DTSTART:20210131T230000Z", "DTEND:20210201T010000Z"], False),
+        (["DTSTART;VALUE=DATE:20210131"], True),
+        (["DTSTART:20210131T230000Z", "DURATION:PT2H"], False),
+        (["DTSTART:20210301T090000Z"], True),
+        (["DTSTART:20201201T090000Z", "RRULE:FREQ=WEEKLY"], False),
+        (["DTSTART:20201201T090000Z", "RRULE:FREQ=WEEKLY;COUNT=4"], True),
+        (["DTSTART:20200101T090000Z", "RRULE:FREQ=YEARLY"], True),
+        ([], False),
+    ],
+)
+def test_events_outside_window(lines, outside):
+    """
+    Events are outside the window if they, and every occurrence of a recurring
+    event, end before it or start after it.
+    """
+    window = (dt.datetime(2021, 2, 1, tzinfo=UTC), dt.datetime(2021, 3, 1, tzinfo=UTC))
+    event = make_event(*lines)
+
+    assert is_outside_window(event, window) is outside
+    assert not event.parsed
+
+
+def test_events_outside_window_passed_through(local_path):
+    """
+    Events outside the window are taken from the downloaded calendar as they are,
+    while those inside are merged.
+    """
+    downloaded = read_downloaded()
+
+    merged = update_local(downloaded, get_local_records(local_path), window=WINDOW)
+
+    events = list(iter_events(merged))
+    assert [get_sync_key(event) for event in events] == [
+        get_sync_key(event) for event in iter_events(downloaded)
+    ]
+    for event in events:
+        assert event in downloaded.contents["vevent"]
+        if is_outside_window(event, WINDOW):
+            assert not event.parsed
+
+
+def test_local_event_outside_window_kept(local_path):
+    """
+    An event outside the window that is only in the local calendar is kept, unless
+    the sync base shows it was deleted from the downloaded calendar.
+    """
+    downloaded = read_downloaded()
+    deleted = downloaded.contents["vevent"].pop(0)
+
+    merged = update_local(downloaded, get_local_records(local_path), window=WINDOW)
+    base = build_sync_base(get_local_records(local_path))
+    merged_with_base = update_local(
+        downloaded, get_local_records(local_path), base, WINDOW
+    )
+
+    assert get_sync_key(deleted) in map(get_sync_key, iter_events(merged))
+    assert get_sync_key(deleted) not in map(get_sync_key, iter_events(merged_with_base))
+
+
+def test_unchanged_calendars_have_no_conflicts_with_window(local_path):
+    """
+    Events passed through from outside the window are taken out of the sync base
+    too, so they aren't seen as deleted from both calendars.
+    """
+    downloaded = read_downloaded()
+    base = build_sync_base(get_local_records(local_path))
+    stages = {}
+
+    merged = update_local(
+        get_local_records(local_path),
+        get_local_records(local_path),
+        base,
+        WINDOW,
+        stages,
+    )
+
+    assert stages["merge"]["conflicts"] == 0
+    assert [get_sync_key(event) for event in iter_events(merged)] == [
+        get_sync_key(event) for event in iter_events(get_local_records(local_path))
+    ]
+
+
+def make_calendar(*events: str) -> bytes:
+    """
+    Make the raw data of a calendar holding events given as their lines.
+    """
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//fifty-cal//test//EN"]
+    lines += events
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(lines).encode()
+
+
+def test_event_with_rdate_deleted_from_server_stays_deleted(tmp_path):
+    """
+    Checking whether an event with an `RDATE` recurs doesn't parse it, which would
+    change its fingerprint and make it look changed locally.
+    """
+    plain = "\r\n".join(
+        [
+            "BEGIN:VEVENT",
+            "UID:plain",
+            "DTSTART:20210301T090000Z",
+            "DTEND:20210301T100000Z",
+            "END:VEVENT",
+        ]
+    )
+    rdate = "\r\n".join(
+        [
+            "BEGIN:VEVENT",
+            "UID:rdate",
+            "DTSTART:20210301T090000Z",
+            "DTEND:20210301T100000Z",
+            "RDATE:20210308T090000Z",
+            "END:VEVENT",
+        ]
+    )
+    file_path = str(tmp_path / "person_1.ics")
+    base_path = str(tmp_path / "sync_base" / "person_1.json")
+
+    sync_calendar_data(make_calendar(plain, rdate), file_path, base_path, WINDOW)
+    sync_calendar_data(make_calendar(plain, rdate), file_path, base_path, WINDOW)
+    sync_calendar_data(make_calendar(), file_path, base_path, WINDOW)
+
+    with open(file_path) as calendar_file:
+        saved = calendar_file.read()
+    assert "UID:plain" not in saved
+    assert "UID:rdate" not in saved
@@ -0,0 +1,152 @@
+"""
+Uploading local changes to calendars back to the server.
+
+Only the events that have been added or changed locally are uploaded, using the
+import of the roundcube calendar plugin, rather than the whole calendar.
+"""
+
+import base64
+import binascii
+import logging
+from typing import Optional
+from urllib.parse import urlsplit
+
+from requests import Response, Session
+
+from fifty_cal.diff import CalendarDiff
+from fifty_cal.downloader import ERROR_RESPONSE_CODES
+from fifty_cal.exceptions import HttpErrorException, UnauthorizedException
+from fifty_cal.http_session import REQUEST_TOKEN_PATTERN
+from fifty_cal.merge import SyncBase, get_sync_key, index_events, is_newer
+from fifty_cal.records import TIMEZONE_NAME, RecordCalendar
+
+log = logging.getLogger(__name__)
+
+IMPORT_ACTION = "import_events"
+
+# Only the events in the file are imported, not just those in the next few months.
+IMPORT_ALL_EVENTS = "0"
+
+
+def get_import_url(calendar_url: str) -> str:
+    """
+    Get the URL that events are imported into a calendar with.
+    """
+    url = urlsplit(calendar_url)
+    return (
+        f"{url.scheme}://{url.netloc}{url.path}?_task=calendar&_action={IMPORT_ACTION}"
+    )
+
+
+def get_calendar_id(calendar_hash: str) -> str:
+    """
+    Get the ID of a calendar from the hash in its feed URL.
+
+    The hash is the username and calendar ID, separated by a colon and base64
+    encoded. If it can't be decoded it is assumed to be the ID already, as it is for
+    calendars without a feed URL.
+    """
+    try:
+        decoded = base64.b64decode(calendar_hash, validate=True).decode("utf-8")
+    except (binascii.Error, UnicodeDecodeError):
+        return calendar_hash
+    _, separator, calendar_id = decoded.rpartition(":")
+    return calendar_id if separator and calendar_id else calendar_hash
+
+
+def get_request_token(session: Session, calendar_url: str) -> str:
+    """
+    Get the token roundcube expects to be sent with every change from the calendar
+    page.
+
+    Raises `UnauthorizedException` if the page has no token, as it is only given to
+    logged in users.
+    """
+    response = session.get(calendar_url)
+    if response.status_code != 200:
+        log.error(f"Request Failed {response.status_code}: {response.reason}")
+        raise ERROR_RESPONSE_CODES.get(response.status_code, HttpErrorException)
+
+    token = REQUEST_TOKEN_PATTERN.search(response.text)
+    if token is None:
+        raise UnauthorizedException("No request token found on the calendar page.")
+    return token.group(1)
+
+
+def get_delta(
+    local_calendar: RecordCalendar,
+    server_calendar: RecordCalendar,
+    base: Optional[SyncBase] = None,
+) -> Optional[RecordCalendar]:
+    """
+    Build a calendar of the events that need uploading to bring the server up to date.
+
+    These are the events only in the local calendar and those that were last
+    modified more recently locally than on the server. If the sync `base` is given,
+    events that were synced before and are now missing from the server have been
+    deleted there, so are not uploaded again.
+
+    The delta has the properties of the local calendar and the timezones its events
+    use. Any timezone an event uses that the local calendar doesn't define is added
+    when the delta is serialized. Returns `None` if there is nothing to upload.
+    """
+    diff = CalendarDiff(cal1=local_calendar, cal2=server_calendar)
+    diff.clean_calendars()
+    diff.get_diff()
+
+    local_events = index_events(local_calendar)
+    server_events = index_events(server_calendar)
+    delta = RecordCalendar(list(local_calendar.properties))
+    for local_diff, server_diff in diff.diff:
+        if local_diff is None:
+            continue
+        key = get_sync_key(local_diff)
+        if server_diff is None:
+            if base and key in base:
+                continue
+            delta.add(local_diff)
+        elif is_newer(local_events[key], server_events[key]):
+            delta.add(local_events[key])
+
+    if not delta.contents:
+        return None
+    used = set()
+    for children in delta.contents.values():
+        for event in children:
+            used |= getattr(event, "tzids", set())
+    delta.contents[TIMEZONE_NAME] = [
+        timezone
+        for timezone in local_calendar.contents.get(TIMEZONE_NAME, [])
+        if timezone.getChildValue("tzid") in used
+    ]
+    return delta
+
+
+def upload_calendar(
+    delta: RecordCalendar,
+    calendar_hash: str,
+    session: Session,
+    calendar_url: str,
+    token: str,
+) -> Response:
+    """
+    Upload a calendar of events to the calendar with the given hash.
+
+    The events are imported into the calendar, adding new events and updating those
+    that already exist.
+    """
+    response = session.post(
+        get_import_url(calendar_url),
+        data={
+            "_calendar": get_calendar_id(calendar_hash),
+            "_range": IMPORT_ALL_EVENTS,
+            "_token": token,
+        },
+        files={"_data": ("calendar.ics", delta.serialize(), "text/calendar")},
+        headers={"X-Roundcube-Request": token},
+    )
+    if response.status_code != 200:
+        log.error(f"Upload Failed {response.status_code}: {response.reason}")
+        raise ERROR_RESPONSE_CODES.get(response.status_code, HttpErrorException)
+
+    return response
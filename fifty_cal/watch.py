@@ -0,0 +1,120 @@
+"""
+Scheduling for watch mode, where fifty-cal keeps running and syncs calendars as
+they fall due rather than once per invocation.
+"""
+
+import logging
+import os
+import random
+import time
+from typing import Callable, Dict, List, Mapping, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+# The state of a file used to tell whether it has changed: its modification time in
+# nanoseconds and its size, or `None` if it doesn't exist.
+FileState = Optional[Tuple[int, int]]
+
+
+class Scheduler:
+    """
+    Keeps track of when each calendar is next due to be synced.
+
+    Each calendar has its own interval. The time until the next sync is varied at
+    random by up to `jitter` of the interval, so that calendars with the same
+    interval drift apart rather than all being requested at once.
+    """
+
+    def __init__(
+        self,
+        intervals: Mapping[str, float],
+        jitter: float = 0.1,
+        clock: Callable[[], float] = time.monotonic,
+        rng: Optional[random.Random] = None,
+    ):
+        self.intervals = dict(intervals)
+        self.jitter = jitter
+        self.clock = clock
+        self.rng = rng or random.Random()
+        # Every calendar is synced as soon as watching starts.
+        now = self.clock()
+        self.next_due: Dict[str, float] = {name: now for name in self.intervals}
+        # The number of times a calendar has been scheduled after being synced.
+        self.runs = 0
+
+    def schedule(self, name: str):
+        """
+        Schedule the next sync of a calendar one interval, give or take the jitter,
+        from now.
+        """
+        interval = self.intervals[name]
+        interval *= self.rng.uniform(1 - self.jitter, 1 + self.jitter)
+        self.next_due[name] = self.clock() + interval
+        self.runs += 1
+
+    def trigger(self, name: str):
+        """
+        Make a calendar due to be synced straight away.
+        """
+        self.next_due[name] = self.clock()
+
+    def get_due(self) -> List[str]:
+        """
+        Get the calendars that are due to be synced, most overdue first.
+        """
+        now = self.clock()
+        due = [name for name, due_at in self.next_due.items() if due_at <= now]
+        return sorted(due, key=self.next_due.__getitem__)
+
+    def seconds_until_next(self) -> float:
+        """
+        Get the number of seconds until the next calendar is due.
+        """
+        if not self.next_due:
+            return float("inf")
+        return max(0.0, min(self.next_due.values()) - self.clock())
+
+
+def get_file_state(path: str) -> FileState:
+    """
+    Get the modification time and size of a file, or `None` if it doesn't exist.
+    """
+    try:
+        file_stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return file_stat.st_mtime_ns, file_stat.st_size
+
+
+class FileWatcher:
+    """
+    Polls the local copies of calendars for changes made outside of fifty-cal.
+
+    Only the modification time and size of each file are checked, so polling is
+    cheap however large the calendars are. Call `refresh` after writing a file so
+    that the change isn't reported.
+    """
+
+    def __init__(self, paths: Mapping[str, str]):
+        self.paths = dict(paths)
+        self.states: Dict[str, FileState] = {
+            name: get_file_state(path) for name, path in self.paths.items()
+        }
+
+    def refresh(self, name: str):
+        """
+        Record the current state of a file as seen.
+        """
+        self.states[name] = get_file_state(self.paths[name])
+
+    def get_changed(self) -> List[str]:
+        """
+        Get the calendars whose files have changed since they were last seen.
+        """
+        changed = []
+        for name, path in self.paths.items():
+            state = get_file_state(path)
+            if state != self.states[name]:
+                self.states[name] = state
+                changed.append(name)
+        return changed
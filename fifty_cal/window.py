@@ -0,0 +1,162 @@
+"""
+Limiting a sync to the events within a window of time.
+
+Events that lie entirely outside the window are passed through to the merged
+calendar as they are, without being diffed, merged or re-serialized, so the work
+done on each run stays the same however much history a calendar builds up.
+"""
+
+import datetime as dt
+from typing import Dict, List, Optional, Tuple
+
+from vobject.base import Component
+
+from fifty_cal.diff import DIFFED_COMPONENTS
+from fifty_cal.merge import SyncBase, copy_calendar, get_sync_key, iter_events
+from fifty_cal.recurrence import align, get_occurrences, is_recurring, to_datetime
+
+# The start and end of a sync window. Either may be `None` to leave the window open
+# on that side.
+SyncWindow = Tuple[Optional[dt.datetime], Optional[dt.datetime]]
+
+
+def get_sync_window(
+    past_days: Optional[int] = None,
+    future_days: Optional[int] = None,
+    now: Optional[dt.datetime] = None,
+) -> Optional[SyncWindow]:
+    """
+    Get the window from `past_days` before `now` to `future_days` after it.
+
+    Returns `None` if neither is given, meaning that every event is synced.
+    """
+    if past_days is None and future_days is None:
+        return None
+    now = now or dt.datetime.now(dt.timezone.utc)
+    start = now - dt.timedelta(days=past_days) if past_days is not None else None
+    end = now + dt.timedelta(days=future_days) if future_days is not None else None
+    return start, end
+
+
+def get_event_span(event: Component) -> Optional[Tuple[dt.datetime, dt.datetime]]:
+    """
+    Get the start and end of an event, or of the first occurrence of a recurring
+    event.
+
+    Returns `None` if the event has no start.
+    """
+    start = event.getChildValue("dtstart")
+    end = event.getChildValue("dtend", event.getChildValue("due"))
+    if start is None:
+        start = end
+    if start is None:
+        return None
+    if end is None:
+        duration = event.getChildValue("duration")
+        if duration is not None:
+            end = start + duration
+        elif isinstance(start, dt.datetime):
+            end = start
+        else:
+            # An all day event without an end lasts the day.
+            end = start + dt.timedelta(days=1)
+    return to_datetime(start), to_datetime(end)
+
+
+def is_outside_window(event: Component, window: SyncWindow) -> bool:
+    """
+    Check whether an event lies entirely outside the window.
+
+    Recurring events are expanded over the window to see whether any occurrence
+    overlaps it.
+    """
+    span = get_event_span(event)
+    if span is None:
+        return False
+    start, end = span
+    window_start, window_end = window
+
+    if window_end is not None and start >= align(window_end, start):
+        return True
+    if window_start is None:
+        return False
+    window_start = align(window_start, start)
+    if not is_recurring(event):
+        return end <= window_start
+
+    # Include occurrences that start before the window and run into it.
+    expand_from = window_start - (end - start)
+    expand_to = window_end if window_end is not None else dt.datetime.max
+    return not get_occurrences(event, expand_from, expand_to, limit=1)
+
+
+def split_calendars(
+    calendar_1: Component,
+    calendar_2: Component,
+    window: SyncWindow,
+    base: Optional[SyncBase] = None,
+) -> Tuple[Component, Component, List[Component], Optional[SyncBase]]:
+    """
+    Take the events that are outside the window out of two calendars to be merged.
+
+    An event is only taken out if every copy of it in both calendars is outside the
+    window, so an event moved into or out of the window on one side is still merged.
+    Events outside the window in `calendar_2` are passed through. Those only in
+    `calendar_1` are passed through too, unless the sync `base` shows they were
+    deleted from `calendar_2`.
+
+    Returns copies of the calendars with only the events to merge, the events to
+    pass through and the `base` without the events taken out, so that they aren't
+    seen as deleted from both calendars when merging against it.
+    """
+    inside_keys = set()
+    outside_keys = set()
+    for calendar in (calendar_1, calendar_2):
+        for event in iter_events(calendar):
+            key = get_sync_key(event)
+            if is_outside_window(event, window):
+                outside_keys.add(key)
+            else:
+                inside_keys.add(key)
+    passed_keys = outside_keys - inside_keys
+
+    calendar_2_keys = set()
+    passed_events = []
+    calendars = []
+    for calendar in (calendar_2, calendar_1):
+        calendar_copy = copy_calendar(calendar)
+        for name, children in calendar_copy.contents.items():
+            if name not in DIFFED_COMPONENTS:
+                continue
+            kept = []
+            for event in children:
+                key = get_sync_key(event)
+                if key not in passed_keys:
+                    kept.append(event)
+                elif calendar is calendar_2:
+                    calendar_2_keys.add(key)
+                    passed_events.append(event)
+                elif key not in calendar_2_keys and key not in (base or {}):
+                    passed_events.append(event)
+            calendar_copy.contents[name] = kept
+        calendars.append(calendar_copy)
+    calendar_2_inside, calendar_1_inside = calendars
+    if base:
+        base = {key: entry for key, entry in base.items() if key not in passed_keys}
+
+    return calendar_1_inside, calendar_2_inside, passed_events, base
+
+
+def pass_through(calendar: Component, events: List[Component]) -> Component:
+    """
+    Add events passed through from outside the window back into a merged calendar.
+
+    They go before the merged events so that the calendar keeps the same order from
+    one run to the next.
+    """
+    passed: Dict[str, List[Component]] = {}
+    for event in events:
+        passed.setdefault(event.name.lower(), []).append(event)
+    for name, children in passed.items():
+        calendar.contents[name] = children + calendar.contents.get(name, [])
+    return calendar
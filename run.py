@@ -1,17 +1,50 @@
+# Record when imports started so that `--timings` can report how long they took.
+from time import perf_counter
+
+IMPORTS_STARTED = perf_counter()
+
 import logging
+import multiprocessing
 import os
 import sys
+import time
 from argparse import ArgumentParser
-from typing import Mapping, Sequence
+from concurrent.futures import (
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
+from contextlib import contextmanager
+from typing import Dict, Iterator, Mapping, Optional, Sequence, Set, Union
 
+import requests
 import yaml
-from vobject.base import Component, readOne
 
-from fifty_cal import downloader
-from fifty_cal.diff import CalendarDiff
-from fifty_cal.exceptions import ArgumentConflictException, ConfigurationException
-from fifty_cal.merge import merge
-from fifty_cal.session import Session
+from fifty_cal import downloader, pipeline, uploader
+from fifty_cal.cache import (
+    CalendarMapCache,
+    CookieCache,
+    FeedCache,
+    get_sync_base_path,
+    read_json,
+)
+from fifty_cal.exceptions import (
+    ArgumentConflictException,
+    ConfigurationException,
+    DownloadFailedException,
+    UnauthorizedException,
+    UploadFailedException,
+)
+from fifty_cal.http_session import AUTHENTICATORS, HttpSession
+from fifty_cal.local import get_local_records
+from fifty_cal.merge import count_events
+from fifty_cal.metrics import MetricsRecorder, Recorder, Stages, measure_stage
+from fifty_cal.session import LOGOUT_MODES, Session
+from fifty_cal.watch import FileWatcher, Scheduler
+from fifty_cal.window import SyncWindow, get_sync_window
+
+IMPORT_SECONDS = perf_counter() - IMPORTS_STARTED
 
 log = logging.getLogger(__name__)
 
@@ -34,6 +67,8 @@ class Command:
         * Publish
             - Uploads the calendars specified in the configuration file to the NamesCo
               server. Use the `--publish` optional arg to run in Publish mode.
+
+    Either mode can be run once, or kept running with the `--watch` optional arg.
     """
 
     calendar_ids: Mapping[str, str]
@@ -44,11 +79,31 @@ class Command:
 
         # TODO: Break this out into a smaller __init__ and a handle method.
         """
-        self.session: Session = Session()
+        self.timings: Dict[str, float] = {"imports": IMPORT_SECONDS}
+        # The browser isn't started until the session is used to log in.
+        self.session: Union[Session, HttpSession] = Session(timings=self.timings)
         self.username: str = ""
         self.password: str = ""
         self.calendar_url: str = ""
         self.output_path: str = ""
+        self.download_workers: int = 1
+        self.pipeline_workers: int = 0
+        self.http_pool_size: int = downloader.DEFAULT_POOL_SIZE
+        self.http_retries: int = downloader.DEFAULT_RETRIES
+        self.http_backoff_factor: float = downloader.DEFAULT_BACKOFF_FACTOR
+        self.pipeline_executor: Optional[Executor] = None
+        self.cache_path: Optional[str] = None
+        self.feed_cache: Optional[FeedCache] = None
+        self.cookie_cache: Optional[CookieCache] = None
+        self.calendar_map_cache: Optional[CalendarMapCache] = None
+        self.session_max_age: int = 1800
+        self.sync_window_past: Optional[int] = None
+        self.sync_window_future: Optional[int] = None
+        self.watch_interval: float = 900
+        self.calendar_intervals: Dict[str, float] = {}
+        self.watch_jitter: float = 0.1
+        self.watch_poll_interval: float = 5
+        self.recorder: Recorder = Recorder()
         run_methods = {"download": self.download, "publish": self.publish}
 
         parser = ArgumentParser()
@@ -68,6 +123,17 @@ class Command:
             help="Run in Publish mode.",
             action="store_true",
         )
+        parser.add_argument(
+            "--watch",
+            help="Keep running, repeating the mode for each calendar on its interval "
+            "and whenever its local copy changes.",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--timings",
+            help="Print how long each stage of the run took.",
+            action="store_true",
+        )
 
         args = parser.parse_args(command_args)
 
@@ -76,11 +142,41 @@ class Command:
                 "Both download and publish options specified. Pick one or the other."
             )
 
+        config_start = perf_counter()
         self.load_config(config_path=args.config_path)
+        self.timings["config"] = perf_counter() - config_start
 
         mode = "publish" if args.publish else "download"
-        with self.session.start_session(self.username, self.password) as cookies:
-            run_methods.get(mode)(cookies)
+        try:
+            if args.watch:
+                self.watch(mode)
+                return
+            with self.authenticate() as cookies:
+                run_start = perf_counter()
+                run_methods.get(mode)(cookies)
+                self.timings[mode] = perf_counter() - run_start
+        finally:
+            self.export_metrics()
+            if args.timings:
+                self.print_timings()
+
+    def print_timings(self):
+        """
+        Print how long each stage of the run took.
+        """
+        for stage, seconds in self.timings.items():
+            print(f"{stage:<10} {seconds:8.3f}s")
+
+    def export_metrics(self):
+        """
+        Record how long each stage of the run as a whole took, like starting the
+        browser and logging in, and export everything recorded.
+        """
+        self.recorder.record_stages(
+            None,
+            {stage: {"seconds": seconds} for stage, seconds in self.timings.items()},
+        )
+        self.recorder.export()
 
     def load_config(self, config_path: str):
         """
@@ -108,50 +204,506 @@ class Command:
         try:
             self.calendar_ids = config["cal_ids"]
         except KeyError:
-            log.warning("No calendar IDs provided in config.")
+            log.warning(
+                "No calendar IDs provided in config. They will be found from the "
+                "calendar page."
+            )
+            self.calendar_ids = {}
+        self.download_workers = config.get("download_workers", 1)
+        if not isinstance(self.download_workers, int) or self.download_workers < 1:
+            raise ConfigurationException("download_workers must be at least 1.")
+        self.pipeline_workers = config.get("pipeline_workers", 0)
+        if not isinstance(self.pipeline_workers, int) or self.pipeline_workers < 0:
+            raise ConfigurationException("pipeline_workers must be 0 or more.")
+        # Every download worker needs a connection of its own to reuse.
+        self.http_pool_size = config.get(
+            "http_pool_size", max(downloader.DEFAULT_POOL_SIZE, self.download_workers)
+        )
+        if not isinstance(self.http_pool_size, int) or self.http_pool_size < 1:
+            raise ConfigurationException("http_pool_size must be at least 1.")
+        self.http_retries = config.get("http_retries", downloader.DEFAULT_RETRIES)
+        if not isinstance(self.http_retries, int) or self.http_retries < 0:
+            raise ConfigurationException("http_retries must be 0 or more.")
+        self.http_backoff_factor = config.get(
+            "http_backoff_factor", downloader.DEFAULT_BACKOFF_FACTOR
+        )
+        if (
+            not isinstance(self.http_backoff_factor, (int, float))
+            or self.http_backoff_factor < 0
+        ):
+            raise ConfigurationException("http_backoff_factor must be 0 or more.")
+        self.cache_path = config.get("cache_path")
+        if self.cache_path:
+            self.feed_cache = FeedCache(self.cache_path)
+            self.calendar_map_cache = CalendarMapCache(
+                self.cache_path, config.get("calendar_map_max_age", 86400)
+            )
+        if config.get("persist_session", False):
+            if not self.cache_path:
+                raise ConfigurationException(
+                    "persist_session requires a cache_path to be provided."
+                )
+            self.cookie_cache = CookieCache(self.cache_path)
+        self.session_max_age = config.get("session_max_age", 1800)
+        self.watch_interval = config.get("watch_interval", 900)
+        self.calendar_intervals = config.get("calendar_intervals") or {}
+        self.watch_poll_interval = config.get("watch_poll_interval", 5)
+        for interval in (
+            self.watch_interval,
+            self.watch_poll_interval,
+            *self.calendar_intervals.values(),
+        ):
+            if not isinstance(interval, (int, float)) or interval <= 0:
+                raise ConfigurationException("Watch intervals must be over 0 seconds.")
+        self.watch_jitter = config.get("watch_jitter", 0.1)
+        if not isinstance(self.watch_jitter, (int, float)) or not (
+            0 <= self.watch_jitter < 1
+        ):
+            raise ConfigurationException("watch_jitter must be from 0 up to 1.")
+        for option in ("sync_window_past", "sync_window_future"):
+            days = config.get(option)
+            if days is not None and (not isinstance(days, int) or days < 0):
+                raise ConfigurationException(f"{option} must be 0 or more days.")
+            setattr(self, option, days)
+        metrics_json_path = config.get("metrics_json_path")
+        metrics_prometheus_path = config.get("metrics_prometheus_path")
+        if metrics_json_path or metrics_prometheus_path:
+            self.recorder = MetricsRecorder(metrics_json_path, metrics_prometheus_path)
+        login_timeout = config.get("login_timeout", Session.LOGIN_TIMEOUT_SECONDS)
+        logout_timeout = config.get("logout_timeout", Session.LOGOUT_RETRY_MAX_SECONDS)
+        self.session.login_timeout = login_timeout
+        self.session.logout_timeout = logout_timeout
+        logout_mode = config.get("logout_mode", "ui")
+        if logout_mode not in LOGOUT_MODES:
+            raise ConfigurationException(
+                f"logout_mode must be one of: {', '.join(LOGOUT_MODES)}."
+            )
+        self.session.logout_mode = logout_mode
+        authenticator = config.get("authenticator", "selenium")
+        if authenticator not in AUTHENTICATORS:
+            raise ConfigurationException(
+                f"authenticator must be one of: {', '.join(AUTHENTICATORS)}."
+            )
+        if authenticator == "http":
+            # The browser is kept in reserve in case logging in over http fails.
+            self.session = HttpSession(
+                timings=self.timings,
+                login_timeout=login_timeout,
+                logout_timeout=logout_timeout,
+                fallback=self.session,
+            )
+
+    @contextmanager
+    def authenticate(self) -> Iterator[Mapping[str, str]]:
+        """
+        Get session and auth cookies for the user.
+
+        If `persist_session` is set, cookies from a previous run are reused if they
+        are still valid, avoiding the need to start a browser and log in. Otherwise
+        the user is logged in and, if persisting, the new cookies are stored and the
+        session left open for the next run.
+        """
+        if self.cookie_cache:
+            cookies = self.cookie_cache.load()
+            if cookies and downloader.check_session(
+                self.get_requests_session(cookies), self.calendar_url
+            ):
+                log.debug("Reusing cookies from previous session.")
+                yield cookies
+                return
+            self.cookie_cache.clear()
+
+        logout = self.cookie_cache is None
+        with self.session.start_session(
+            self.username, self.password, logout=logout
+        ) as cookies:
+            if self.cookie_cache:
+                expires = time.time() + self.session_max_age
+                if self.session.cookies_expire:
+                    expires = min(expires, self.session.cookies_expire)
+                self.cookie_cache.save(cookies, expires)
+            yield cookies
+
+    def get_requests_session(self, cookies: Mapping[str, str]) -> requests.Session:
+        """
+        Get a `requests.Session` with the user's cookies, pooling and retrying
+        requests as configured.
+        """
+        return downloader.get_requests_session(
+            cookies,
+            pool_size=self.http_pool_size,
+            retries=self.http_retries,
+            backoff_factor=self.http_backoff_factor,
+        )
 
     def download(self, cookies: Mapping[str, str]):
         """
         Run the command in Download mode.
+
+        Calendars are synced concurrently by up to `download_workers` threads sharing
+        one `requests.Session`. A calendar that fails to sync does not stop the others,
+        but a `DownloadFailedException` is raised once they have all been attempted.
+
+        If `pipeline_workers` is set, the CPU bound work of parsing, merging and
+        saving each calendar is handed to a pool of that many processes.
+
+        If `cache_path` is set, feeds are requested conditionally and calendars whose
+        feed hasn't changed since the last run are skipped entirely.
         """
-        requests_session = downloader.get_requests_session(cookies)
-        for person, cal_id in self.calendar_ids.items():
-            downloaded_calendar = downloader.get_calendar(
-                cal_id, requests_session, self.calendar_url
+        requests_session = self.get_requests_session(cookies)
+        if not self.calendar_ids:
+            self.calendar_ids = self.discover_calendars(requests_session)
+        failed = []
+        if self.pipeline_workers:
+            self.pipeline_executor = ProcessPoolExecutor(
+                max_workers=self.pipeline_workers,
+                mp_context=multiprocessing.get_context("spawn"),
             )
-            calendar_file_path = f"{self.output_path}{person}.ics"
-            # If there is already a local version of this calendar, update it
-            # ensuring that the downloaded and local copies are both in sync.
-            if os.path.isfile(calendar_file_path):
-                calendar = self.update_local(downloaded_calendar, calendar_file_path)
-            else:
-                calendar = downloaded_calendar
-            self.save_calendar(calendar, calendar_file_path)
+        try:
+            with ThreadPoolExecutor(max_workers=self.download_workers) as executor:
+                syncs = {}
+                for person, cal_id in self.calendar_ids.items():
+                    sync = executor.submit(
+                        self.sync_calendar, person, cal_id, requests_session
+                    )
+                    syncs[sync] = person
+                for sync in as_completed(syncs):
+                    person = syncs[sync]
+                    try:
+                        elapsed = sync.result()
+                    except Exception:
+                        log.exception(f"Failed to sync calendar {person}.")
+                        failed.append(person)
+                        continue
+                    log.info(f"Synced calendar {person} in {elapsed:.2f}s.")
+        finally:
+            if self.pipeline_executor:
+                self.pipeline_executor.shutdown()
+                self.pipeline_executor = None
+            if self.feed_cache:
+                self.feed_cache.save()
 
-    def publish(self, cookies: Mapping[str, str]):
+        if failed:
+            raise DownloadFailedException(
+                f"Failed to sync calendars: {', '.join(sorted(failed))}"
+            )
+
+    def watch(self, mode: str):
         """
-        Run the command in Publish mode.
+        Keep running, repeating `mode` for each calendar when it falls due.
+
+        Each calendar is due every `watch_interval` seconds, or the number given for
+        it in `calendar_intervals`, give or take `watch_jitter`. The local copies of
+        the calendars are polled every `watch_poll_interval` seconds and a calendar
+        is also due as soon as its local copy is changed by something else. Such a
+        calendar is merged even if it hasn't changed on the server.
+
+        Calendars are synced one at a time, whatever `download_workers` is set to.
+
+        The same login is used for as long as it lasts. Only when the server rejects
+        it is the user logged in again. If a new login is rejected before a single
+        calendar has been synced, the `UnauthorizedException` is raised rather than
+        logging in over and over. Stops on a keyboard interrupt.
         """
+        scheduler = None
+        watcher = None
+        changed: Set[str] = set()
+        rejected = False
+        if self.pipeline_workers:
+            self.pipeline_executor = ProcessPoolExecutor(
+                max_workers=self.pipeline_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        try:
+            while True:
+                with self.authenticate() as cookies:
+                    requests_session = self.get_requests_session(cookies)
+                    if not self.calendar_ids:
+                        self.calendar_ids = self.discover_calendars(requests_session)
+                    if scheduler is None:
+                        scheduler = Scheduler(
+                            {
+                                person: self.calendar_intervals.get(
+                                    person, self.watch_interval
+                                )
+                                for person in self.calendar_ids
+                            },
+                            self.watch_jitter,
+                        )
+                        watcher = FileWatcher(
+                            {
+                                person: f"{self.output_path}{person}.ics"
+                                for person in self.calendar_ids
+                            }
+                        )
+                    runs = scheduler.runs
+                    try:
+                        self.watch_calendars(
+                            mode, scheduler, watcher, changed, requests_session
+                        )
+                    except UnauthorizedException:
+                        if rejected and scheduler.runs == runs:
+                            raise
+                        rejected = scheduler.runs == runs
+                        log.info("Session rejected by the server, logging in again.")
+                        if self.cookie_cache:
+                            self.cookie_cache.clear()
+        except KeyboardInterrupt:
+            log.info("Stopped watching.")
+        finally:
+            if self.pipeline_executor:
+                self.pipeline_executor.shutdown()
+                self.pipeline_executor = None
+            if self.feed_cache:
+                self.feed_cache.save()
 
-    def update_local(self, downloaded_calendar: Component, filepath: str) -> Component:
+    def watch_calendars(
+        self,
+        mode: str,
+        scheduler: Scheduler,
+        watcher: FileWatcher,
+        changed: Set[str],
+        requests_session: requests.Session,
+    ):
         """
-        Update the existing local copy of the specified calendar file.
+        Sync or publish calendars as they fall due until the session is rejected.
+
+        `changed` holds the calendars whose local copies have changed since they
+        were last synced. They are synced even if the server's copy is unchanged.
+
+        Raises `UnauthorizedException` when the server rejects the session, leaving
+        the calendar that was rejected due so that it is retried after logging in.
         """
-        with open(filepath, "r") as existing_file:
-            existing_calendar = readOne(existing_file.read())
+        token = None
+        if mode == "publish":
+            token = uploader.get_request_token(requests_session, self.calendar_url)
+        while True:
+            for person in watcher.get_changed():
+                log.info(f"Local copy of calendar {person} changed.")
+                scheduler.trigger(person)
+                changed.add(person)
+            due = scheduler.get_due()
+            for person in due:
+                cal_id = self.calendar_ids[person]
+                try:
+                    if mode == "publish":
+                        self.publish_calendar(person, cal_id, requests_session, token)
+                    else:
+                        self.sync_calendar(
+                            person, cal_id, requests_session, person in changed
+                        )
+                except UnauthorizedException:
+                    raise
+                except Exception:
+                    log.exception(f"Failed to {mode} calendar {person}.")
+                changed.discard(person)
+                # Changes made by syncing aren't changes to pick up.
+                watcher.refresh(person)
+                scheduler.schedule(person)
+            if self.feed_cache:
+                self.feed_cache.save()
+            if due:
+                self.recorder.export()
+            time.sleep(min(self.watch_poll_interval, scheduler.seconds_until_next()))
 
-        cal_diff = CalendarDiff(cal1=existing_calendar, cal2=downloaded_calendar)
-        return merge(diff=cal_diff)
+    def discover_calendars(self, requests_session: requests.Session) -> Dict[str, str]:
+        """
+        Find the calendars available to the user when none are configured.
 
-    def save_calendar(self, calendar: Component, filepath: str):
+        The calendars are read from the calendar page over http. If `cache_path` is
+        set, they are stored there and reused until `calendar_map_max_age` seconds
+        have passed.
         """
-        Save the downloaded calendar to disk.
+        if self.calendar_map_cache:
+            cal_map = self.calendar_map_cache.load()
+            if cal_map:
+                # Maps cached before unsafe names were skipped may still hold some.
+                return {
+                    name: cal_hash
+                    for name, cal_hash in cal_map.items()
+                    if downloader.is_safe_name(name)
+                }
+
+        cal_map = downloader.get_calendar_map(requests_session, self.calendar_url)
+        if not cal_map:
+            raise ConfigurationException(
+                "No cal_ids provided and no calendars found on the calendar page."
+            )
+        log.info(f"Found calendars: {', '.join(sorted(cal_map))}.")
+        if self.calendar_map_cache:
+            self.calendar_map_cache.save(cal_map)
+        return cal_map
+
+    def sync_calendar(
+        self,
+        person: str,
+        cal_id: str,
+        requests_session: requests.Session,
+        force: bool = False,
+    ) -> float:
+        """
+        Download a calendar, merge it with any local copy and save it.
+
+        If `force` is set, the calendar is merged even if it hasn't changed on the
+        server since it was last downloaded, for when the local copy has changed.
+
+        Each stage of the sync is recorded against the calendar, see
+        `fifty_cal.metrics`. Returns the number of seconds taken.
+        """
+        start = perf_counter()
+        stages: Stages = {}
+        try:
+            self.sync_calendar_stages(person, cal_id, requests_session, stages, force)
+        finally:
+            stages["sync"] = {"seconds": perf_counter() - start}
+            self.recorder.record_stages(person, stages)
+        return stages["sync"]["seconds"]
+
+    def sync_calendar_stages(
+        self,
+        person: str,
+        cal_id: str,
+        requests_session: requests.Session,
+        stages: Stages,
+        force: bool = False,
+    ):
         """
-        with open(filepath, "w+") as calendar_file:
-            try:
-                calendar_file.write(calendar.serialize())
-            except StopIteration:
-                log.info("Finished Writing")
+        Sync a calendar, measuring each stage into `stages`.
+
+        The raw calendar is handed to `pipeline.sync_calendar_data` to be parsed,
+        merged with any local copy and saved, in a worker process if
+        `pipeline_workers` is set.
+        """
+        calendar_file_path = f"{self.output_path}{person}.ics"
+        # Validators are only useful if the calendar they validate still exists.
+        validators = None
+        if self.feed_cache and not force and os.path.isfile(calendar_file_path):
+            validators = self.feed_cache.get(cal_id)
+        with measure_stage(stages, "fetch") as metrics:
+            feed = downloader.fetch_calendar(
+                cal_id,
+                requests_session,
+                self.calendar_url,
+                validators,
+                metrics=metrics,
+            )
+        if feed is None:
+            log.info(f"Calendar {person} unchanged since last download.")
+            return
+        base_path = None
+        if self.cache_path:
+            base_path = get_sync_base_path(self.cache_path, person)
+        window = self.get_sync_window()
+        if self.pipeline_executor:
+            result = self.pipeline_executor.submit(
+                pipeline.sync_calendar_data,
+                feed.content,
+                calendar_file_path,
+                base_path,
+                window=window,
+            ).result()
+            log.debug(f"Calendar {person} processed by process {result.pid}.")
+        else:
+            result = pipeline.sync_calendar_data(
+                feed.content, calendar_file_path, base_path, window=window
+            )
+        stages.update(result.stages)
+        if self.feed_cache:
+            self.feed_cache.update(
+                cal_id, feed.etag, feed.last_modified, feed.body_hash
+            )
+
+    def get_sync_window(self) -> Optional[SyncWindow]:
+        """
+        Get the window of time to sync events in, or `None` to sync every event.
+        """
+        return get_sync_window(self.sync_window_past, self.sync_window_future)
+
+    def publish(self, cookies: Mapping[str, str]):
+        """
+        Run the command in Publish mode.
+
+        Each local calendar is compared with the copy on the server and only the
+        events that have been added or changed locally are uploaded. Calendars are
+        published concurrently by up to `download_workers` threads sharing one
+        `requests.Session`. As with downloading, a calendar that fails to publish
+        does not stop the others, but an `UploadFailedException` is raised once they
+        have all been attempted.
+        """
+        requests_session = self.get_requests_session(cookies)
+        if not self.calendar_ids:
+            self.calendar_ids = self.discover_calendars(requests_session)
+        token = uploader.get_request_token(requests_session, self.calendar_url)
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.download_workers) as executor:
+            uploads = {}
+            for person, cal_id in self.calendar_ids.items():
+                upload = executor.submit(
+                    self.publish_calendar, person, cal_id, requests_session, token
+                )
+                uploads[upload] = person
+            for upload in as_completed(uploads):
+                person = uploads[upload]
+                try:
+                    uploaded = upload.result()
+                except Exception:
+                    log.exception(f"Failed to publish calendar {person}.")
+                    failed.append(person)
+                    continue
+                log.info(f"Published {uploaded} events to calendar {person}.")
+
+        if failed:
+            raise UploadFailedException(
+                f"Failed to publish calendars: {', '.join(sorted(failed))}"
+            )
+
+    def publish_calendar(
+        self,
+        person: str,
+        cal_id: str,
+        requests_session: requests.Session,
+        token: str,
+    ) -> int:
+        """
+        Upload the events in a local calendar that the server doesn't have yet.
+
+        Each stage is recorded against the calendar, as when syncing. Returns the
+        number of events uploaded.
+        """
+        calendar_file_path = f"{self.output_path}{person}.ics"
+        if not os.path.isfile(calendar_file_path):
+            log.info(f"No local copy of calendar {person} to publish.")
+            return 0
+
+        stages: Stages = {}
+        try:
+            with measure_stage(stages, "read_local") as metrics:
+                local_calendar = get_local_records(calendar_file_path)
+                metrics["events"] = count_events(local_calendar)
+            with measure_stage(stages, "fetch") as metrics:
+                feed = downloader.fetch_calendar(
+                    cal_id, requests_session, self.calendar_url, metrics=metrics
+                )
+            with measure_stage(stages, "parse") as metrics:
+                server_calendar = pipeline.parse_calendar(feed.content)
+                metrics["events"] = count_events(server_calendar)
+            base = None
+            if self.cache_path:
+                base = read_json(get_sync_base_path(self.cache_path, person))
+            with measure_stage(stages, "delta") as metrics:
+                delta = uploader.get_delta(local_calendar, server_calendar, base)
+                metrics["events"] = count_events(delta) if delta else 0
+            if delta is None:
+                return 0
+
+            with measure_stage(stages, "upload") as metrics:
+                response = uploader.upload_calendar(
+                    delta, cal_id, requests_session, self.calendar_url, token
+                )
+                metrics["bytes"] = len(response.request.body or b"")
+            return count_events(delta)
+        finally:
+            self.recorder.record_stages(person, stages)
 
 
 if __name__ == "__main__":
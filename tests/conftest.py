@@ -29,35 +29,27 @@ def mock_get_requests_session(mocker):
 
 
 @pytest.fixture()
-def mock_save(mocker):
-    """
-    Mock out the fifty_cal.Session object imported in the run.py module
-    """
-    return mocker.patch("run.Command.save_calendar")
-
-
-@pytest.fixture()
-def mock_update_local(mocker):
+def mock_download(mocker):
     """
-    Mock out the fifty_cal.Session object imported in the run.py module
+    Mock the download method of Command.
     """
-    return mocker.patch("run.Command.update_local")
+    return mocker.patch("run.Command.download")
 
 
 @pytest.fixture()
-def mock_download(mocker):
+def mock_fetch_calendar(mocker):
     """
-    Mock the download method of Command.
+    Mock the fifty_cal.downloader.fetch_calendar function.
     """
-    return mocker.patch("run.Command.download")
+    return mocker.patch("run.downloader.fetch_calendar")
 
 
 @pytest.fixture()
-def mock_get_calendar(mocker):
+def mock_sync_calendar_data(mocker):
     """
-    Mock the fifty_cal.downloader.get_calendar function.
+    Mock the fifty_cal.pipeline.sync_calendar_data function.
     """
-    return mocker.patch("run.downloader.get_calendar")
+    return mocker.patch("run.pipeline.sync_calendar_data")
 
 
 @pytest.fixture()
@@ -91,9 +83,12 @@ def config_factory():
             output_path="/path/",
             cal_ids=["person_1: AB1234"],
             calendar_url="https:example.com",
+            **options,
     ):
         """
         Create and yield a temporary config file and then remove.
+
+        Any other `options` are added to the config as they are given.
         """
         nonlocal config_path
         with NamedTemporaryFile(mode="w+", suffix=".yaml", delete=False) as config:
@@ -104,6 +99,8 @@ def config_factory():
             for cal_id in cal_ids:
                 config.write(f"  {cal_id}\n")
             config.write(f"calendar_url: {calendar_url}\n")
+            for name, value in options.items():
+                config.write(f"{name}: {value}\n")
         config_path = config.name
         return config
 
@@ -1,9 +1,23 @@
+import json
 import os
-from tempfile import NamedTemporaryFile
+import re
+import shutil
+import threading
+import time
+from datetime import datetime, timezone
+from tempfile import NamedTemporaryFile, TemporaryDirectory
 
 import pytest
 
-from fifty_cal.exceptions import ConfigurationException
+from fifty_cal.cache import CookieCache, FeedCache
+from fifty_cal.downloader import Feed
+from fifty_cal.exceptions import (
+    ConfigurationException,
+    DownloadFailedException,
+    NotFoundException,
+    UnauthorizedException,
+    UploadFailedException,
+)
 from run import Command
 
 
@@ -88,11 +102,11 @@ def test_invalid_config_raises_errors(line_to_omit, expected_error_message):
         assert e.value.args[0] == expected_error_message
 
 
-def test_get_calendar_called_with_calendar_ids(
-    standard_config, mocker, mock_save, mock_get_calendar
+def test_fetch_calendar_called_with_calendar_ids(
+    standard_config, mocker, mock_fetch_calendar, mock_sync_calendar_data
 ):
     """
-    Management Command makes a call to downloader.get_calendar with expected args.
+    Management Command makes a call to downloader.fetch_calendar with expected args.
     """
     request_session = mocker.MagicMock()
 
@@ -102,82 +116,629 @@ def test_get_calendar_called_with_calendar_ids(
 
     Command([standard_config.name])
 
-    assert mock_get_calendar.call_count == 2
-    assert mock_get_calendar.call_args_list[0][0] == (
+    assert mock_fetch_calendar.call_count == 2
+    assert mock_fetch_calendar.call_args_list[0][0] == (
         "AB1234",
         request_session,
         "https://example.com/",
+        None,
     )
-    assert mock_get_calendar.call_args_list[1][0] == (
+    assert mock_fetch_calendar.call_args_list[1][0] == (
         "AB4321",
         request_session,
         "https://example.com/",
+        None,
     )
 
 
-def test_update_local_not_called_when_new_calendar_downloaded(
-    mock_save, mock_update_local, mock_get_calendar, standard_config
+def test_downloaded_calendar_synced_with_local_path(
+    standard_config, mock_fetch_calendar, mock_sync_calendar_data
 ):
     """
-    Nothing updated when a downloaded calendar doesn't exist locally.
+    The raw downloaded calendar is handed to the pipeline with the path of its local
+    copy, without a sync base or window when none are configured.
     """
     Command([standard_config.name])
 
-    assert mock_update_local.call_count == 0
+    assert mock_sync_calendar_data.call_args_list[0][0] == (
+        mock_fetch_calendar.return_value.content,
+        "path/to/cals/person_1.ics",
+        None,
+    )
+    assert mock_sync_calendar_data.call_args_list[0][1] == {"window": None}
 
 
-def test_update_local_called_when_downloaded_calendar_already_exists(
-    mock_save, mock_update_local, mock_get_calendar, mocker
-):
+def test_full_download_process(config_factory, mocker):
     """
-    When an update to an existing calendar is downloaded, the two should be merged.
+    Test the entire download process from running the command and saving the file.
     """
-    downloaded_calendar_mock = mocker.MagicMock()
-    mock_get_calendar.return_value = downloaded_calendar_mock
+    with open("fifty_cal/tests/resources/dummy_downloaded.ics", "rb") as calendar:
+        downloaded = calendar.read()
+    mocker.patch(
+        "run.downloader.fetch_calendar", return_value=Feed(downloaded, None, None, "")
+    )
 
-    with NamedTemporaryFile(mode="w+", suffix=".ics", delete=False) as calendar_file:
-        calendar_file.write("placeholder")
-    mock_cal_file_path = calendar_file.name
+    with TemporaryDirectory() as output_path:
+        local_path = os.path.join(output_path, "person_1.ics")
+        shutil.copy("fifty_cal/tests/resources/dummy_local.ics", local_path)
+        config = config_factory(output_path=f"{output_path}/")
 
-    with NamedTemporaryFile(mode="w+", suffix=".yaml", delete=False) as config:
-        config.writelines("username: test_user\n")
-        config.writelines("password: allYourBase\n")
-        config.writelines("output_path: /tmp/\n")
-        config.write("cal_ids:\n")
-        config.write(f"  {mock_cal_file_path.split('/')[-1].split('.')[0]}: AB1234\n")
-        config.writelines("calendar_url: https://example.com/\n")
+        Command([config.name])
 
-    Command([config.name])
+        with open(local_path, "rb") as calendar:
+            merged = calendar.read()
 
-    os.remove(config.name)
-    os.remove(calendar_file.name)
+    for uid in re.findall(rb"^UID:(.*)$", downloaded, re.MULTILINE):
+        assert uid in merged
 
-    assert mock_update_local.call_args_list[0][0] == (
-        downloaded_calendar_mock,
-        f"{mock_cal_file_path}",
+
+def test_failed_calendar_does_not_stop_others(
+    config_factory, mock_fetch_calendar, mock_sync_calendar_data
+):
+    """
+    A calendar that fails to download doesn't stop the remaining calendars syncing.
+    """
+    mock_fetch_calendar.side_effect = [NotFoundException(), None, None]
+    config = config_factory(
+        cal_ids=["person_1: AB1234", "person_2: AB4321", "person_3: CD1234"]
     )
 
+    with pytest.raises(DownloadFailedException) as e:
+        Command([config.name])
+
+    assert mock_fetch_calendar.call_count == 3
+    assert e.value.args[0] == "Failed to sync calendars: person_1"
 
-def test_full_download_process(
-    config_factory, mock_get_calendar, mock_update_local, mock_save
+
+def test_calendars_downloaded_concurrently(
+    config_factory, mock_fetch_calendar, mock_sync_calendar_data
 ):
     """
-    Test the entire download process from running the command and saving the file.
+    Calendars are downloaded by as many threads as `download_workers` allows.
     """
+    barrier = threading.Barrier(2, timeout=5)
 
-    with open("fifty_cal/tests/resources/dummy_local.ics", "r") as local_calendar:
-        with NamedTemporaryFile(mode="w+", suffix=".ics", delete=False) as temp_local:
-            for line in local_calendar.read():
-                temp_local.write(line)
-    mock_local_cal_path = temp_local.name
+    def fetch_calendar(*args, **kwargs):
+        barrier.wait()
 
+    mock_fetch_calendar.side_effect = fetch_calendar
     config = config_factory(
-        output_path="/tmp/",
-        cal_ids=[f"{mock_local_cal_path.split('/')[-1].split('.')[0]}: "],
+        cal_ids=["person_1: AB1234", "person_2: AB4321"], download_workers=2
     )
 
     Command([config.name])
 
-    mock_get_calendar.assert_called_once()
-    mock_update_local.assert_called_once()
-    mock_save.assert_called_once()
+    assert mock_fetch_calendar.call_count == 2
+
+
+@pytest.mark.parametrize("workers", ["0", "many"])
+def test_invalid_download_workers_raises_error(config_factory, workers):
+    """
+    `download_workers` must be a positive integer.
+    """
+    config = config_factory(download_workers=workers)
+
+    with pytest.raises(ConfigurationException):
+        Command([config.name])
+
+
+def test_http_options_passed_to_requests_session(
+    config_factory,
+    mock_get_requests_session,
+    mock_fetch_calendar,
+    mock_sync_calendar_data,
+):
+    """
+    The connection pool defaults to one connection per download worker, and the
+    retries can be configured.
+    """
+    config = config_factory(download_workers=16, http_retries=5, http_backoff_factor=2)
+
+    Command([config.name])
+
+    assert mock_get_requests_session.call_args[1] == {
+        "pool_size": 16,
+        "retries": 5,
+        "backoff_factor": 2,
+    }
+
+
+@pytest.mark.parametrize(
+    "option",
+    [{"http_pool_size": 0}, {"http_retries": -1}, {"http_backoff_factor": "soon"}],
+)
+def test_invalid_http_options_raise_error(config_factory, option):
+    """
+    Invalid connection pool and retry options raise `ConfigurationException`.
+    """
+    config = config_factory(**option)
+
+    with pytest.raises(ConfigurationException):
+        Command([config.name])
+
+
+def test_calendars_processed_in_process_pool(config_factory, mocker):
+    """
+    When `pipeline_workers` is set, raw calendar data is handed to worker processes.
+    """
+    with open("fifty_cal/tests/resources/dummy_downloaded.ics", "rb") as calendar:
+        feed = Feed(calendar.read(), None, None, "")
+    mocker.patch("run.downloader.fetch_calendar", return_value=feed)
+
+    with TemporaryDirectory() as output_path:
+        config = config_factory(
+            output_path=f"{output_path}/",
+            cal_ids=["person_1: AB1234", "person_2: AB4321"],
+            pipeline_workers=2,
+        )
+
+        Command([config.name])
+
+        assert sorted(os.listdir(output_path)) == ["person_1.ics", "person_2.ics"]
+
+
+def test_metrics_exported_for_each_calendar(config_factory, mocker):
+    """
+    The stages of each calendar, including those synced in worker processes, are
+    exported along with those of the run as a whole.
+    """
+    with open("fifty_cal/tests/resources/dummy_downloaded.ics", "rb") as calendar:
+        feed = Feed(calendar.read(), None, None, "")
+    mocker.patch("run.downloader.fetch_calendar", return_value=feed)
+
+    with TemporaryDirectory() as output_path:
+        config = config_factory(
+            output_path=f"{output_path}/",
+            pipeline_workers=1,
+            metrics_json_path=f"{output_path}/metrics.jsonl",
+            metrics_prometheus_path=f"{output_path}/sync.prom",
+        )
+
+        Command([config.name])
+
+        with open(f"{output_path}/metrics.jsonl") as json_file:
+            samples = [json.loads(line) for line in json_file]
+        with open(f"{output_path}/sync.prom") as prometheus_file:
+            prometheus = prometheus_file.read()
+
+    stages = {(sample["calendar"], sample["stage"]) for sample in samples}
+    assert {
+        ("person_1", "fetch"),
+        ("person_1", "parse"),
+        ("person_1", "save"),
+    } <= stages
+    assert (None, "download") in stages
+    assert 'fifty_cal_stage_events{calendar="person_1",stage="parse"} 6' in prometheus
+
+
+def test_unchanged_feed_not_processed(config_factory, mocker):
+    """
+    Calendars whose feed is unchanged since the last run are not merged or saved.
+    """
+    fetch_calendar = mocker.patch("run.downloader.fetch_calendar", return_value=None)
+    sync_calendar_data = mocker.patch("run.pipeline.sync_calendar_data")
+
+    with TemporaryDirectory() as output_path:
+        with open(f"{output_path}/person_1.ics", "w") as calendar_file:
+            calendar_file.write("placeholder")
+        cache = FeedCache(output_path)
+        cache.update("AB1234", '"etag"', None, "hash")
+        cache.save()
+
+        config = config_factory(output_path=f"{output_path}/", cache_path=output_path)
+
+        Command([config.name])
+
+    assert fetch_calendar.call_args[0][3] == {
+        "etag": '"etag"',
+        "last_modified": None,
+        "body_hash": "hash",
+    }
+    sync_calendar_data.assert_not_called()
+
+
+def test_feed_cache_updated_after_sync(config_factory, mocker):
+    """
+    The validators of a downloaded feed are cached once the calendar is saved.
+    """
+    feed = Feed(b"calendar", '"etag"', "Mon, 01 Mar 2021 09:00:00 GMT", "hash")
+    mocker.patch("run.downloader.fetch_calendar", return_value=feed)
+    mocker.patch("run.pipeline.sync_calendar_data")
+
+    with TemporaryDirectory() as output_path:
+        config = config_factory(output_path=f"{output_path}/", cache_path=output_path)
+
+        Command([config.name])
+
+        assert FeedCache(output_path).get("AB1234") == {
+            "etag": '"etag"',
+            "last_modified": "Mon, 01 Mar 2021 09:00:00 GMT",
+            "body_hash": "hash",
+        }
+
+
+def test_valid_cached_cookies_skip_login(
+    config_factory, mock_session, mock_download, mocker
+):
+    """
+    Cookies from a previous run are used without logging in when still valid.
+    """
+    mocker.patch("run.downloader.check_session", return_value=True)
+
+    with TemporaryDirectory() as cache_path:
+        CookieCache(cache_path).save({"session": "1234"}, time.time() + 60)
+        config = config_factory(cache_path=cache_path, persist_session=True)
+
+        Command([config.name])
+
+    mock_session.return_value.start_session.assert_not_called()
+    assert mock_download.call_args[0][0] == {"session": "1234"}
+
+
+def test_stale_cached_cookies_replaced_by_login(
+    config_factory, mock_session, mock_download, mocker
+):
+    """
+    When cached cookies are no longer valid, the user logs in and the new cookies
+    are stored without logging out.
+    """
+    mocker.patch("run.downloader.check_session", return_value=False)
+    session = mock_session.return_value
+    session.start_session.return_value.__enter__.return_value = {"session": "5678"}
+    session.cookies_expire = None
+
+    with TemporaryDirectory() as cache_path:
+        CookieCache(cache_path).save({"session": "1234"}, time.time() + 60)
+        config = config_factory(cache_path=cache_path, persist_session=True)
+
+        Command([config.name])
+
+        assert CookieCache(cache_path).load() == {"session": "5678"}
+
+    assert session.start_session.call_args[1]["logout"] is False
+    assert mock_download.call_args[0][0] == {"session": "5678"}
+
+
+def test_persist_session_requires_cache_path(config_factory):
+    """
+    Cookies can't be persisted without somewhere to store them.
+    """
+    config = config_factory(persist_session=True)
+
+    with pytest.raises(ConfigurationException):
+        Command([config.name])
+
+
+def test_timings_printed(mocker, mock_download, capsys):
+    """
+    The time taken by each stage is printed when `--timings` is passed.
+    """
+    mocker.patch("run.Command.load_config")
+
+    Command(["", "--timings"])
+
+    stages = [line.split()[0] for line in capsys.readouterr().out.splitlines()]
+    assert stages == ["imports", "config", "download"]
+
+
+def test_session_wait_options_loaded(config_factory, mock_download, mock_session):
+    """
+    Login and logout options are passed on to the session.
+    """
+    config = config_factory(login_timeout=10, logout_timeout=5, logout_mode="http")
+
+    Command([config.name])
+
+    session = mock_session.return_value
+    assert session.login_timeout == 10
+    assert session.logout_timeout == 5
+    assert session.logout_mode == "http"
+
+
+def test_invalid_logout_mode_raises_error(config_factory):
+    """
+    An unknown logout mode is rejected.
+    """
+    config = config_factory(logout_mode="carrier pigeon")
+
+    with pytest.raises(ConfigurationException):
+        Command([config.name])
+
+
+def test_http_authenticator_falls_back_to_browser(
+    config_factory, mock_download, mock_session, mocker
+):
+    """
+    The http authenticator is used when configured, with the browser as fallback.
+    """
+    http_session = mocker.patch("run.HttpSession")
+    config = config_factory(authenticator="http", login_timeout=10)
+
+    Command([config.name])
+
+    assert http_session.call_args[1]["fallback"] is mock_session.return_value
+    assert http_session.call_args[1]["login_timeout"] == 10
+    http_session.return_value.start_session.assert_called_once()
+    mock_session.return_value.start_session.assert_not_called()
+
+
+def test_invalid_authenticator_raises_error(config_factory):
+    """
+    An unknown authenticator is rejected.
+    """
+    config = config_factory(authenticator="telepathy")
+
+    with pytest.raises(ConfigurationException):
+        Command([config.name])
+
+
+def test_calendars_discovered_when_not_configured(
+    config_factory, mocker, mock_fetch_calendar, mock_sync_calendar_data
+):
+    """
+    Calendars are found from the calendar page when no `cal_ids` are configured.
+    """
+    get_calendar_map = mocker.patch(
+        "run.downloader.get_calendar_map", return_value={"person_1": "AB1234"}
+    )
+    config = config_factory(cal_ids=[])
+
+    Command([config.name])
+
+    get_calendar_map.assert_called_once()
+    assert mock_fetch_calendar.call_args[0][0] == "AB1234"
+
+
+def test_discovered_calendars_cached(config_factory, mocker):
+    """
+    Discovered calendars are stored in `cache_path` and reused on the next run.
+    """
+    get_calendar_map = mocker.patch(
+        "run.downloader.get_calendar_map", return_value={"person_1": "AB1234"}
+    )
+    fetch_calendar = mocker.patch("run.downloader.fetch_calendar", return_value=None)
+
+    with TemporaryDirectory() as output_path:
+        config = config_factory(
+            output_path=f"{output_path}/", cal_ids=[], cache_path=output_path
+        )
+
+        Command([config.name])
+        Command([config.name])
+
+    get_calendar_map.assert_called_once()
+    assert [call[0][0] for call in fetch_calendar.call_args_list] == [
+        "AB1234",
+        "AB1234",
+    ]
+
+
+def test_no_calendars_found_raises_error(config_factory, mocker):
+    """
+    An error is raised if there are no calendars to sync.
+    """
+    mocker.patch("run.downloader.get_calendar_map", return_value={})
+    config = config_factory(cal_ids=[])
+
+    with pytest.raises(ConfigurationException):
+        Command([config.name])
+
+
+def test_sync_base_stored_in_cache_path(config_factory, mocker):
+    """
+    Each calendar is merged using a sync base kept in `cache_path`.
+    """
+    feed = Feed(b"calendar", None, None, "hash")
+    mocker.patch("run.downloader.fetch_calendar", return_value=feed)
+    sync_calendar_data = mocker.patch("run.pipeline.sync_calendar_data")
+
+    with TemporaryDirectory() as output_path:
+        config = config_factory(output_path=f"{output_path}/", cache_path=output_path)
+
+        Command([config.name])
+
+    assert sync_calendar_data.call_args[0] == (
+        b"calendar",
+        f"{output_path}/person_1.ics",
+        f"{output_path}/sync_base/person_1.json",
+    )
+
+
+def test_sync_window_passed_to_pipeline(config_factory, mocker):
+    """
+    The sync window options give the window that calendars are merged in.
+    """
+    feed = Feed(b"calendar", None, None, "hash")
+    mocker.patch("run.downloader.fetch_calendar", return_value=feed)
+    sync_calendar_data = mocker.patch("run.pipeline.sync_calendar_data")
+
+    with TemporaryDirectory() as output_path:
+        config = config_factory(
+            output_path=f"{output_path}/", cache_path=output_path, sync_window_past=30
+        )
+
+        Command([config.name])
+
+    start, end = sync_calendar_data.call_args[1]["window"]
+    assert end is None
+    assert 29.9 < (datetime.now(timezone.utc) - start).total_seconds() / 86400 < 30.1
+
+
+def test_invalid_sync_window_raises_error(config_factory):
+    """
+    A negative sync window raises `ConfigurationException`.
+    """
+    config = config_factory(sync_window_future=-1)
+
+    with pytest.raises(ConfigurationException):
+        Command([config.name])
+
+
+def test_publish_uploads_local_changes(config_factory, mock_publish, mocker):
+    """
+    Publish mode uploads the events that are new or newer in each local calendar
+    than in the server copy. Calendars without a local copy are skipped.
+    """
+    mocker.stop(mock_publish)
+    with open("fifty_cal/tests/resources/dummy_local.ics", "rb") as server_file:
+        feed = Feed(server_file.read(), None, None, "hash")
+    mocker.patch("run.downloader.fetch_calendar", return_value=feed)
+    mocker.patch("run.uploader.get_request_token", return_value="abc")
+    upload_calendar = mocker.patch("run.uploader.upload_calendar")
+
+    with TemporaryDirectory() as output_path:
+        shutil.copy(
+            "fifty_cal/tests/resources/dummy_downloaded.ics",
+            f"{output_path}/person_1.ics",
+        )
+        config = config_factory(
+            output_path=f"{output_path}/",
+            cal_ids=["person_1: AB1234", "person_2: AB4321"],
+        )
+
+        Command([config.name, "--publish"])
+
+    upload_calendar.assert_called_once()
+    delta, cal_id, _, _, token = upload_calendar.call_args[0]
+    assert (cal_id, token) == ("AB1234", "abc")
+    assert {event.getChildValue("uid") for event in delta.contents["vevent"]} == {
+        "99ccbf3e-e882-4238-bf35-2508f522fd62",
+        "f42cdec0-e077-47e4-80dd-97740fceb8aa",
+        "a7478109-2813-45f3-9730-09f9900a996c",
+        "b7b6c72b-cbb8-40b6-a32f-1bd3f426acd2",
+    }
+
+
+def test_failed_publish_raises_error_after_all_calendars(
+    config_factory, mock_publish, mocker
+):
+    """
+    A calendar that fails to publish doesn't stop the others from being published.
+    """
+    mocker.stop(mock_publish)
+    mocker.patch("run.uploader.get_request_token", return_value="abc")
+    publish_calendar = mocker.patch(
+        "run.Command.publish_calendar", side_effect=[NotFoundException, 1]
+    )
+    config = config_factory(cal_ids=["person_1: AB1234", "person_2: AB4321"])
+
+    with pytest.raises(UploadFailedException):
+        Command([config.name, "--publish"])
+
+    assert publish_calendar.call_count == 2
+
+
+@pytest.fixture
+def watch_config(config_factory):
+    """
+    Create a config for two calendars saved in a temporary directory.
+    """
+    with TemporaryDirectory() as output_path:
+        yield config_factory(
+            output_path=f"{output_path}/",
+            cal_ids=["person_1: AB1234", "person_2: AB4321"],
+        ), output_path
+
+
+def test_watch_syncs_calendars_until_interrupted(watch_config, mock_session, mocker):
+    """
+    Watch mode syncs every calendar on one login and waits for the next to fall due.
+    """
+    config, _ = watch_config
+    sync_calendar = mocker.patch("run.Command.sync_calendar")
+    sleep = mocker.patch("run.time.sleep", side_effect=[None, KeyboardInterrupt])
+
+    Command([config.name, "--watch"])
+
+    assert sorted(call[0][0] for call in sync_calendar.call_args_list) == [
+        "person_1",
+        "person_2",
+    ]
+    assert mock_session.return_value.start_session.call_count == 1
+    assert 0 < sleep.call_args[0][0] <= 5
+
+
+def test_watch_syncs_calendar_changed_locally(watch_config, mocker):
+    """
+    A calendar is synced again as soon as its local copy is changed.
+    """
+    config, output_path = watch_config
+
+    def edit_calendar(seconds):
+        if sleep.call_count > 1:
+            raise KeyboardInterrupt
+        with open(f"{output_path}/person_2.ics", "w") as calendar_file:
+            calendar_file.write("edited")
+
+    sync_calendar = mocker.patch("run.Command.sync_calendar")
+    sleep = mocker.patch("run.time.sleep", side_effect=edit_calendar)
+
+    Command([config.name, "--watch"])
+
+    assert [call[0][0] for call in sync_calendar.call_args_list][2:] == ["person_2"]
+
+
+def test_watch_merges_calendar_changed_locally_when_feed_unchanged(
+    config_factory, mocker
+):
+    """
+    A calendar changed locally is merged again even if the feed cache says it hasn't
+    changed on the server since it was last downloaded.
+    """
+
+    def fetch_calendar(cal_id, requests_session, calendar_url, validators, **kwargs):
+        return None if validators else Feed(b"calendar", '"etag"', None, "hash")
+
+    def edit_calendar(seconds):
+        if sleep.call_count > 1:
+            raise KeyboardInterrupt
+        with open(f"{output_path}/person_2.ics", "w") as calendar_file:
+            calendar_file.write("edited")
+
+    mocker.patch("run.downloader.fetch_calendar", side_effect=fetch_calendar)
+    sync_calendar_data = mocker.patch("run.pipeline.sync_calendar_data")
+    sleep = mocker.patch("run.time.sleep", side_effect=edit_calendar)
+
+    with TemporaryDirectory() as output_path:
+        config = config_factory(
+            output_path=f"{output_path}/",
+            cal_ids=["person_1: AB1234", "person_2: AB4321"],
+            cache_path=output_path,
+        )
+
+        Command([config.name, "--watch"])
+
+    synced = [call[0][1] for call in sync_calendar_data.call_args_list]
+    assert synced[2:] == [f"{output_path}/person_2.ics"]
+
+
+def test_watch_logs_in_again_when_session_rejected(watch_config, mock_session, mocker):
+    """
+    The user is only logged in again when the server rejects the session, and the
+    rejected calendar is retried.
+    """
+    config, _ = watch_config
+    sync_calendar = mocker.patch(
+        "run.Command.sync_calendar", side_effect=[None, UnauthorizedException, None]
+    )
+    mocker.patch("run.time.sleep", side_effect=[None, KeyboardInterrupt])
+
+    Command([config.name, "--watch"])
+
+    assert mock_session.return_value.start_session.call_count == 2
+    assert sync_calendar.call_args_list[1] == sync_calendar.call_args_list[2]
+
+
+def test_watch_stops_when_new_logins_rejected(watch_config, mock_session, mocker):
+    """
+    If the server keeps rejecting new logins, watch mode stops rather than logging
+    in over and over.
+    """
+    config, _ = watch_config
+    mocker.patch("run.Command.sync_calendar", side_effect=UnauthorizedException)
+    mocker.patch("run.time.sleep")
+
+    with pytest.raises(UnauthorizedException):
+        Command([config.name, "--watch"])
+
+    assert mock_session.return_value.start_session.call_count == 2